@@ -0,0 +1,77 @@
+__author__ = "Haim Adrian"
+
+import argparse
+import contextlib
+import io
+import os
+
+import cv2
+
+from logic.objectdetectionlogic import runObjectDetection
+from util.imageprefetcher import DEFAULT_DEPTH, DEFAULT_WORKERS_COUNT, ImagePrefetcher
+from util.settings import Settings
+
+
+def runBatch(obj1Path, obj2Path, scenePaths, settings, prefetcher, outDir=None):
+    """
+    Detect the objects in several scenes, one after the other. While a scene is being processed, the next
+    scenes (up to the depth of the prefetcher) are decoded in background.
+    :param obj1Path: Path of the first object
+    :param obj2Path: Path of the second object
+    :param scenePaths: Paths of the scenes to look for the objects in
+    :param settings: The settings to use for the algorithm
+    :param prefetcher: ImagePrefetcher to read the images with
+    :param outDir: Optional. Directory to store the scenes with the findings marked in
+    :return: Dictionary of scene path -> (obj1Count, obj2Count). Scenes that could not be read are missing
+    """
+    obj1Image = prefetcher.readImage(obj1Path)
+    obj2Image = prefetcher.readImage(obj2Path)
+
+    results = {}
+    for index, scenePath in enumerate(scenePaths):
+        for nextScenePath in scenePaths[index + 1:index + 1 + prefetcher.depth]:
+            prefetcher.prefetch(nextScenePath, shape=settings.imageShape)
+
+        image = prefetcher.readImage(scenePath, shape=settings.imageShape)
+        if image is None:
+            print('WARN - Could not read image:', scenePath)
+            continue
+
+        findings = []
+        # The pipeline prints the structuring elements, we do not want them between the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            *_, imgMarks = runObjectDetection(obj1Image, obj2Image, image, settings,
+                                              lambda text: None,
+                                              lambda progress: None,
+                                              lambda obj1Centroids, obj2Centroids: findings.extend(
+                                                  (obj1Centroids, obj2Centroids)))
+
+        results[scenePath] = (len(findings[0]), len(findings[1]))
+        print('{}: {} x obj1, {} x obj2'.format(scenePath, *results[scenePath]))
+
+        if outDir:
+            cv2.imwrite(os.path.join(outDir, os.path.basename(scenePath)), imgMarks)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect two objects in several images, using the settings ' +
+                                                 'of the settings file')
+    parser.add_argument('obj1', help='Path of the first object')
+    parser.add_argument('obj2', help='Path of the second object')
+    parser.add_argument('images', nargs='+', help='Paths of the images to look for the objects in')
+    parser.add_argument('--out', help='Directory to store the images with the findings marked in')
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_DEPTH,
+                        help='How many of the next images to decode while an image is being processed')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS_COUNT, help='Amount of decoding threads')
+    args = parser.parse_args()
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    imagePrefetcher = ImagePrefetcher(workersCount=args.workers, depth=max(1, args.prefetch))
+    try:
+        runBatch(args.obj1, args.obj2, args.images, Settings().load(), imagePrefetcher, args.out)
+    finally:
+        imagePrefetcher.shutdown()
@@ -0,0 +1,95 @@
+__author__ = "Haim Adrian"
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmark.pipelinebenchmark import parseShape
+from util.imageloader import ImageLoader, readJpegSize
+
+IMAGES_DIR = 'images'
+DEFAULT_IMAGE_SHAPES = ((200, 200), (400, 400))
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_SIZE = 1000  # Smaller images are not worth benchmarking, they are decoded in no time
+SYNTHETIC_IMAGE_SIZE = (6000, 4000)  # 24 MP, as our captures
+
+
+def medianDecodeMs(loader, imagePath, imageShape, repeat):
+    """
+    Decode (and resize) an image several times, bypassing the cache of the loader
+    :return: Tuple (median duration in ms, the decoded image)
+    """
+    durations = []
+    image = None
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        image = loader.decodeImage(imagePath, cv2.IMREAD_COLOR, imageShape)
+        durations.append((time.perf_counter() - startTime) * 1000.0)
+    return float(np.median(durations)), image
+
+
+def createSyntheticImage(imagePath, outDir, size=SYNTHETIC_IMAGE_SIZE):
+    """
+    Create a big JPEG out of one of our images, to measure decoding of full resolution captures
+    :return: Path of the created image
+    """
+    outPath = os.path.join(outDir, 'synthetic_{}x{}.jpg'.format(*size))
+    cv2.imwrite(outPath, cv2.resize(cv2.imread(imagePath), size, interpolation=cv2.INTER_CUBIC),
+                [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return outPath
+
+
+def runDecodeBenchmark(imagePaths, imageShapes, repeat):
+    """
+    Compare a full decode followed by a resize, with a reduced decode followed by a resize
+    :return: List of tuples (image name, shape, full ms, reduced ms, mean absolute difference of the outputs)
+    """
+    fullLoader = ImageLoader(isUsingReducedDecode=False)
+    reducedLoader = ImageLoader(isUsingReducedDecode=True)
+
+    results = []
+    for imagePath in imagePaths:
+        for imageShape in imageShapes:
+            fullMs, fullImage = medianDecodeMs(fullLoader, imagePath, imageShape, repeat)
+            reducedMs, reducedImage = medianDecodeMs(reducedLoader, imagePath, imageShape, repeat)
+            difference = float(np.mean(cv2.absdiff(fullImage, reducedImage)))
+            results.append((os.path.basename(imagePath), imageShape, fullMs, reducedMs, difference))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the decoding time saved by reduced JPEG decoding. ' +
+                                                 'Run it from the MorphOperators directory: ' +
+                                                 'python -m benchmark.decodebenchmark')
+    parser.add_argument('--images', nargs='+', default=None,
+                        help='Images to decode. Default is the images bigger than --min-size in images/')
+    parser.add_argument('--shapes', nargs='+', type=parseShape, default=DEFAULT_IMAGE_SHAPES,
+                        help='Shapes to resize to, e.g. 200x200 400x400')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Decodes per case')
+    parser.add_argument('--min-size', type=int, default=DEFAULT_MIN_SIZE,
+                        help='Skip images whose width or height is smaller than that')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Also benchmark a {}x{} JPEG, created out of the first image'.format(
+                            *SYNTHETIC_IMAGE_SIZE))
+    args = parser.parse_args()
+
+    paths = args.images or sorted(glob.glob(os.path.join(IMAGES_DIR, '*.jpg')))
+    paths = [path for path in paths if min(readJpegSize(path) or (0, 0)) >= args.min_size]
+    if not paths:
+        print('WARN - There are no JPEG images to benchmark')
+        exit(1)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        if args.synthetic:
+            paths.append(createSyntheticImage(paths[0], tempDir))
+
+        print('{:30} {:>9} {:>10} {:>12} {:>8} {:>10}'.format('Image', 'Shape', 'Full ms', 'Reduced ms', 'Speedup',
+                                                            'Mean diff'))
+        for name, shape, fullMs, reducedMs, difference in runDecodeBenchmark(paths, args.shapes, args.repeat):
+            print('{:30} {:>9} {:10.2f} {:12.2f} {:7.1f}x {:10.2f}'.format(name, '{}x{}'.format(*shape), fullMs,
+                                                                          reducedMs, fullMs / reducedMs, difference))
@@ -0,0 +1,141 @@
+__author__ = "Haim Adrian"
+
+import argparse
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+
+from benchmark.pipelinebenchmark import StageTimer, environmentDescription, findScenes, parseShape
+from logic.objectdetectionlogic import runObjectDetection
+from logic.stagegraph import StageGraph
+from util.imageloader import readImage
+from util.settings import Settings
+from util.tracing import tracer
+
+DEFAULT_IMAGE_SHAPES = ((200, 200), (400, 400))
+DEFAULT_ROTATION_DEGREE_INC = 30
+DEFAULT_REPEAT = 3
+
+# Stages which prepare the images for hit & miss. These are the ones affected by converting to gray first
+PREPROCESSING_STAGES = ('validateSize', 'grey', 'blur', 'contrast', 'gradient', 'histogram', 'threshold',
+                        'contrastThreshold', 'objClosing', 'imageClosing')
+
+
+def runMode(obj1Image, obj2Image, image, settings, repeat):
+    """
+    Run the detection several times, without memoization, and time its stages
+    :return: Tuple (stage statistics, outcome of the last run, counts of the last run)
+    """
+    timer = StageTimer()
+    outcome = None
+    findings = []
+    tracer.enable(isTrackingMemory=False)
+    try:
+        for _ in range(repeat):
+            firstSpanIndex = len(tracer.getSpans())
+            del findings[:]
+
+            # The pipeline prints the structuring elements, we do not want them between the results
+            with contextlib.redirect_stdout(io.StringIO()):
+                outcome = runObjectDetection(obj1Image, obj2Image, image, settings,
+                                             lambda text: None,
+                                             lambda progress: None,
+                                             lambda obj1Centroids, obj2Centroids: findings.extend(
+                                                 (obj1Centroids, obj2Centroids)),
+                                             StageGraph())
+            timer.addRun(tracer.summarize(tracer.getSpans()[firstSpanIndex:]))
+    finally:
+        tracer.disable()
+
+    return timer.summarize(), outcome, [len(findings[0]), len(findings[1])]
+
+
+def preprocessingMs(stages):
+    return round(sum(stages[stage]['median'] for stage in PREPROCESSING_STAGES if stage in stages), 3)
+
+
+def maskDifference(mask1, mask2):
+    """
+    :return: Percentage of the pixels which differ between the two binary images
+    """
+    return round(100.0 * np.count_nonzero(mask1 != mask2) / mask1.size, 3)
+
+
+def compareModes(scenes, imageShapes, gradientFlags, rotationDegreeInc, repeat, settings):
+    """
+    Run every case in the default (color) mode and in the gray first mode, and compare the two
+    :param settings: The settings to run the cases with. Every case runs with a snapshot of them, where the fields
+    of the case are replaced, so the settings are never modified
+    :return: Dictionary of case name -> comparison
+    """
+    baseSettings = settings.snapshot().replace(objectRotationDegreeInc=rotationDegreeInc)
+    results = {}
+    for imageShape in imageShapes:
+        for isUsingGradient in gradientFlags:
+            for scenePath, obj1Path, obj2Path, isBrightBackground in scenes:
+                caseSettings = baseSettings.replace(imageShape=tuple(imageShape),
+                                                    isUsingGradientEdgeDetector=isUsingGradient,
+                                                    isBrightBackground=isBrightBackground)
+                caseName = '{}|{}x{}|{}'.format(os.path.basename(scenePath), imageShape[0], imageShape[1],
+                                                'gradient' if isUsingGradient else 'plain')
+                obj1 = readImage(obj1Path)
+                obj2 = readImage(obj2Path)
+                image = readImage(scenePath, shape=caseSettings.imageShape)
+
+                colorStages, colorOutcome, colorCounts = runMode(obj1, obj2, image,
+                                                                 caseSettings.replace(isGrayFirst=False), repeat)
+                grayStages, grayOutcome, grayCounts = runMode(obj1, obj2, image,
+                                                              caseSettings.replace(isGrayFirst=True), repeat)
+
+                colorPreprocessingMs = preprocessingMs(colorStages)
+                grayPreprocessingMs = preprocessingMs(grayStages)
+                results[caseName] = {
+                    'preprocessingMs': [colorPreprocessingMs, grayPreprocessingMs],
+                    'preprocessingSpeedup': round(colorPreprocessingMs / max(grayPreprocessingMs, 1e-3), 2),
+                    'totalMs': [colorStages['total']['median'], grayStages['total']['median']],
+                    # Outcome is (objsImg, objsBinaryImg, objsClosingImg, imgBinary, imgClosing, ...)
+                    'objsBinaryDiffPercent': maskDifference(colorOutcome[1], grayOutcome[1]),
+                    'imgBinaryDiffPercent': maskDifference(colorOutcome[3], grayOutcome[3]),
+                    'imgClosingDiffPercent': maskDifference(colorOutcome[4], grayOutcome[4]),
+                    'counts': [colorCounts, grayCounts]}
+
+                result = results[caseName]
+                print('INFO - {}: preprocessing {} ms -> {} ms (x{}), binary diff {}%, closing diff {}%, '
+                      'counts {} -> {}{}'.format(caseName, colorPreprocessingMs, grayPreprocessingMs,
+                                                 result['preprocessingSpeedup'], result['imgBinaryDiffPercent'],
+                                                 result['imgClosingDiffPercent'], colorCounts, grayCounts,
+                                                 '' if colorCounts == grayCounts else '  <-- COUNTS CHANGED'))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the gray first (fast) pre-processing with the default ' +
+                                                 'one: speedup, binary images and counts. Run it from the ' +
+                                                 'MorphOperators directory: python -m benchmark.grayfirstreport')
+    parser.add_argument('--shapes', nargs='+', type=parseShape, default=DEFAULT_IMAGE_SHAPES,
+                        help='Image shapes to compare, e.g. 200x200 400x400')
+    parser.add_argument('--rotation', type=int, default=DEFAULT_ROTATION_DEGREE_INC,
+                        help='Rotation degree increment. It affects the hit & miss only, not the pre-processing')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per case and mode')
+    parser.add_argument('--no-gradient', action='store_true', help='Skip the cases using gradient edge detector')
+    parser.add_argument('--out', help='Store the report as JSON to this file')
+    args = parser.parse_args()
+
+    results = compareModes(findScenes(), args.shapes, (False,) if args.no_gradient else (False, True),
+                           args.rotation, args.repeat, Settings())
+
+    speedups = [result['preprocessingSpeedup'] for result in results.values()]
+    changedCases = [caseName for caseName, result in results.items() if result['counts'][0] != result['counts'][1]]
+    print('INFO - Pre-processing speedup: median x{}, min x{}, max x{}'.format(
+        round(float(np.median(speedups)), 2), min(speedups), max(speedups)))
+    print('INFO - Counts changed in {} of {} cases{}'.format(len(changedCases), len(results),
+                                                             ': ' + ', '.join(changedCases) if changedCases else ''))
+
+    if args.out:
+        with open(args.out, 'w') as outFile:
+            json.dump({'environment': environmentDescription(), 'results': results}, outFile, indent=2)
+        print('INFO - Report stored to:', args.out)
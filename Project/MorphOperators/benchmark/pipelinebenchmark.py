@@ -0,0 +1,248 @@
+__author__ = "Haim Adrian"
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+from logic.objectdetectionlogic import runObjectDetection
+from logic.stagegraph import StageGraph
+from util.imageloader import readImage
+from util.settings import Settings
+from util.tracing import tracer
+
+IMAGES_DIR = 'images'
+TEMPLATE_SUFFIXES = ('coin', 'plate')
+DEFAULT_BASELINE_FILE = os.path.join('benchmark', 'baseline.json')
+DEFAULT_IMAGE_SHAPES = ((200, 200), (400, 400))
+DEFAULT_ROTATION_DEGREE_INCS = (30, 10)
+DEFAULT_REPEAT = 3
+DEFAULT_REGRESSION_TOLERANCE = 0.15  # 15% slower than the baseline median is a regression
+DEFAULT_REGRESSION_MIN_MS = 1.0  # Ignore differences smaller than that, they are noise
+PERCENTILES = (50, 90, 95, 99)
+
+# Stages in the order of the pipeline. These are the names of the tracer spans of the pipeline
+STAGES = ('validateSize', 'blur', 'contrast', 'grey', 'gradient', 'histogram', 'threshold', 'contrastThreshold',
+          'objClosing', 'imageClosing', 'hitMissScene', 'structuringElement', 'hitMissSweep', 'templateHitMiss',
+          'highlight', 'total')
+TOTAL_SPAN_NAME = 'runObjectDetection'
+
+
+class StageTimer(object):
+    """
+    Collects the durations (ms) of the pipeline stages, over several runs
+    """
+
+    def __init__(self):
+        self.durations = {}  # Stage name -> list of durations (ms) of that stage, one per run
+
+    def addRun(self, spansSummary):
+        """
+        Add the durations of a single run
+        :param spansSummary: Summary of the spans of a run, as returned by Tracer.summarize()
+        """
+        for stage in STAGES:
+            spanName = TOTAL_SPAN_NAME if stage == 'total' else stage
+            if spanName in spansSummary:
+                self.durations.setdefault(stage, []).append(spansSummary[spanName]['wallMs'])
+
+    def summarize(self):
+        """
+        :return: Dictionary of stage name -> statistics of the durations (ms) of that stage
+        """
+        summary = {}
+        for stage in STAGES:
+            if stage in self.durations:
+                durations = np.array(self.durations[stage])
+                statistics = {'p' + str(p): round(float(np.percentile(durations, p)), 3) for p in PERCENTILES}
+                statistics['median'] = statistics['p50']
+                statistics['min'] = round(float(durations.min()), 3)
+                statistics['max'] = round(float(durations.max()), 3)
+                statistics['runs'] = len(durations)
+                summary[stage] = statistics
+        return summary
+
+
+def runTimedObjectDetection(obj1Image, obj2Image, image, settings, timer):
+    """
+    Runs the object detection with tracing enabled, and adds the durations of its stages to the timer.
+    Spans of the same stage (e.g. structuring elements of all scales and templates) are summed up.
+    Stage outputs are not memoized, otherwise all runs but the first would measure cache hits.
+    :return: Tuple of the counts: (obj1Count, obj2Count)
+    """
+    findings = []
+    wasEnabled = tracer.isEnabled
+    if not wasEnabled:
+        tracer.enable(isTrackingMemory=False)
+    firstSpanIndex = len(tracer.getSpans())
+    try:
+        # The pipeline prints the structuring elements, we do not want them between the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            runObjectDetection(obj1Image, obj2Image, image, settings,
+                               lambda text: None,
+                               lambda progress: None,
+                               lambda obj1Centroids, obj2Centroids: findings.extend((obj1Centroids, obj2Centroids)),
+                               StageGraph())
+        timer.addRun(tracer.summarize(tracer.getSpans()[firstSpanIndex:]))
+    finally:
+        if not wasEnabled:
+            tracer.disable()
+
+    return len(findings[0]), len(findings[1])
+
+
+def findScenes(imagesDir=IMAGES_DIR):
+    """
+    Scenes are all of the images which are not templates. The templates of a scene are the images
+    sharing its prefix. e.g. bright_straight.jpg is detected using bright_coin.jpg and bright_plate.jpg
+    :return: List of tuples: (scene path, obj1 path, obj2 path, isBrightBackground)
+    """
+    scenes = []
+    for scenePath in sorted(glob.glob(os.path.join(imagesDir, '*.jpg'))):
+        name = os.path.splitext(os.path.basename(scenePath))[0]
+        prefix, _, suffix = name.partition('_')
+        if suffix in TEMPLATE_SUFFIXES:
+            continue
+
+        obj1Path, obj2Path = [os.path.join(imagesDir, '{}_{}.jpg'.format(prefix, templateSuffix))
+                              for templateSuffix in TEMPLATE_SUFFIXES]
+        if os.path.isfile(obj1Path) and os.path.isfile(obj2Path):
+            scenes.append((scenePath, obj1Path, obj2Path, prefix == 'bright'))
+
+    return scenes
+
+
+def runBenchmark(scenes, imageShapes, rotationDegreeIncs, repeat, settings):
+    """
+    Run the traced pipeline over all scenes, image shapes and rotation increments.
+    :param settings: The settings to run the cases with. Every case runs with a snapshot of them, where the image
+    shape, rotation increment and background of the case are replaced, so the settings are never modified
+    :return: Dictionary of case name -> {'counts': [obj1Count, obj2Count], 'stages': stage statistics}
+    """
+    baseSettings = settings.snapshot()
+    results = {}
+    for imageShape in imageShapes:
+        for rotationDegreeInc in rotationDegreeIncs:
+            for scenePath, obj1Path, obj2Path, isBrightBackground in scenes:
+                caseSettings = baseSettings.replace(imageShape=tuple(imageShape),
+                                                    objectRotationDegreeInc=rotationDegreeInc,
+                                                    isBrightBackground=isBrightBackground)
+                caseName = '{}|{}x{}|{}deg'.format(os.path.basename(scenePath), imageShape[0], imageShape[1],
+                                                   rotationDegreeInc)
+                obj1 = readImage(obj1Path)
+                obj2 = readImage(obj2Path)
+                image = readImage(scenePath, shape=caseSettings.imageShape)
+
+                timer = StageTimer()
+                counts = None
+                for _ in range(repeat):
+                    counts = runTimedObjectDetection(obj1, obj2, image, caseSettings, timer)
+
+                results[caseName] = {'counts': list(counts), 'stages': timer.summarize()}
+                print('INFO - {}: total median {} ms, counts {}'.format(
+                    caseName, results[caseName]['stages']['total']['median'], counts))
+
+    return results
+
+
+def findRegressions(results, baseline, tolerance=DEFAULT_REGRESSION_TOLERANCE, minimumMs=DEFAULT_REGRESSION_MIN_MS):
+    """
+    Compare the medians of the results with the medians of a stored baseline.
+    Cases or stages missing from the baseline are skipped.
+    :return: List of tuples (case name, stage, baseline median, current median)
+    """
+    regressions = []
+    baselineResults = baseline.get('results', {})
+    for caseName, caseResult in results.items():
+        baselineStages = baselineResults.get(caseName, {}).get('stages', {})
+        for stage, statistics in caseResult['stages'].items():
+            if stage not in baselineStages:
+                continue
+            baselineMedian = baselineStages[stage]['median']
+            currentMedian = statistics['median']
+            if currentMedian > baselineMedian * (1 + tolerance) and currentMedian - baselineMedian > minimumMs:
+                regressions.append((caseName, stage, baselineMedian, currentMedian))
+    return regressions
+
+
+def findCountChanges(results, baseline):
+    """
+    :return: List of tuples (case name, baseline counts, current counts) of cases whose counts changed
+    """
+    changes = []
+    for caseName, caseResult in results.items():
+        baselineCase = baseline.get('results', {}).get(caseName)
+        if baselineCase is not None and baselineCase['counts'] != caseResult['counts']:
+            changes.append((caseName, baselineCase['counts'], caseResult['counts']))
+    return changes
+
+
+def environmentDescription():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+
+def parseShape(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the object detection pipeline. ' +
+                                                 'Run it from the MorphOperators directory: ' +
+                                                 'python -m benchmark.pipelinebenchmark')
+    parser.add_argument('--shapes', nargs='+', type=parseShape, default=DEFAULT_IMAGE_SHAPES,
+                        help='Image shapes to benchmark, e.g. 200x200 400x400')
+    parser.add_argument('--rotations', nargs='+', type=int, default=DEFAULT_ROTATION_DEGREE_INCS,
+                        help='Rotation degree increments to benchmark')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per case')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE, help='Path of the JSON baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_REGRESSION_TOLERANCE,
+                        help='Relative slow-down of a median that is flagged as a regression')
+    parser.add_argument('--trace', help='Also record memory peaks and store the spans of all runs ' +
+                                        'as Chrome trace-event JSON to this file. Memory tracking slows ' +
+                                        'the pipeline down, so do not store a baseline together with it')
+    args = parser.parse_args()
+
+    if args.trace:
+        tracer.enable(isTrackingMemory=True)
+    results = runBenchmark(findScenes(), args.shapes, args.rotations, args.repeat, Settings())
+    if args.trace:
+        tracer.exportChromeTrace(args.trace)
+    exitCode = 0
+
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as inFile:
+            baseline = json.load(inFile)
+
+        for caseName, stage, baselineMedian, currentMedian in findRegressions(results, baseline, args.tolerance):
+            print('WARN - Regression in {} [{}]: median {} ms -> {} ms'.format(caseName, stage, baselineMedian,
+                                                                              currentMedian))
+            exitCode = 1
+        for caseName, baselineCounts, currentCounts in findCountChanges(results, baseline):
+            print('WARN - Counts changed in {}: {} -> {}'.format(caseName, baselineCounts, currentCounts))
+            exitCode = 1
+        if exitCode == 0:
+            print('INFO - No regressions against baseline:', args.baseline)
+    elif not args.save_baseline:
+        print('INFO - Baseline does not exist. Use --save-baseline to create it:', args.baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as outFile:
+            json.dump({'environment': environmentDescription(), 'results': results}, outFile, indent=2)
+        print('INFO - Baseline stored to:', args.baseline)
+        exitCode = 0
+
+    exit(exitCode)
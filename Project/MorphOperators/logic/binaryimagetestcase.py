@@ -0,0 +1,43 @@
+__author__ = "Haim Adrian"
+
+import unittest
+
+import numpy as np
+
+# Shapes of the images we test on. Single rows and columns leave every pixel at a border
+IMAGE_SHAPES = ((1, 1), (1, 2), (1, 17), (13, 1), (2, 2), (2, 3), (3, 3), (24, 31), (40, 40))
+# Shapes of kernels and structuring elements. Even sizes anchor off the center, as cv2 does
+ELEMENT_SHAPES = ((1, 1), (1, 4), (3, 3), (2, 5), (4, 4), (5, 2), (9, 3), (12, 12))
+
+
+def randomBinaryImage(randomState, shape, foregroundFraction=0.5):
+    """
+    :return: Image of 0 and 255 (uint8), where every pixel is foreground by the specified chance
+    """
+    return np.uint8(randomState.random_sample(shape) < foregroundFraction) * 255
+
+
+class BinaryImageTestCase(unittest.TestCase):
+    """
+    Base of the tests comparing a binary morphology backend against cv2, over the same random images
+    """
+    seed = 0
+    foregroundFractions = (0.1, 0.5, 0.9)
+
+    def setUp(self):
+        self.randomState = np.random.RandomState(self.seed)
+
+    def randomImages(self):
+        """
+        :return: Generator of random binary images of every shape and foreground fraction, followed by an all
+        black image and an all white one
+        """
+        for shape in IMAGE_SHAPES:
+            for fraction in self.foregroundFractions:
+                yield randomBinaryImage(self.randomState, shape, fraction)
+        yield np.zeros((10, 12), np.uint8)
+        yield np.full((10, 12), 255, np.uint8)
+
+    def assertImagesEqual(self, expected, actual, message=None):
+        self.assertEqual(expected.shape, actual.shape, message)
+        self.assertEqual(0, np.count_nonzero(expected != actual), message)
@@ -0,0 +1,320 @@
+__author__ = "Haim Adrian"
+
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from util.cancellation import CancellationToken, DetectionCancelledError, NEVER_CANCELLED
+
+# Messages sent over the pipe between the GUI process and the detection process. Each message is a tuple
+# (kind, value). Images are never sent through the pipe, only descriptors of the shared memory holding them
+DETECT_MESSAGE = 'detect'
+STOP_MESSAGE = 'stop'
+ACK_MESSAGE = 'ack'
+STATUS_MESSAGE = 'status'
+PROGRESS_MESSAGE = 'progress'
+OUTCOME_MESSAGE = 'outcome'
+PARTIAL_MESSAGE = 'partial'
+CANCELLED_MESSAGE = 'cancelled'
+ERROR_MESSAGE = 'error'
+
+# How long (seconds) to wait for a message before checking whether the detection was cancelled
+POLL_INTERVAL_SECONDS = 0.05
+
+# How long (seconds) an idle detection process gets to stop, before it is terminated
+STOP_TIMEOUT_SECONDS = 5.0
+
+# How long (seconds) an abandoned detection gets to report that it is over, before its process is terminated
+ABANDON_TIMEOUT_SECONDS = 5.0
+
+# Messages after which the detection process waits for the next request
+FINAL_MESSAGES = (OUTCOME_MESSAGE, CANCELLED_MESSAGE, ERROR_MESSAGE)
+
+
+class DetectionProcessError(Exception):
+    """
+    Raised when the detection process has failed, or it has exited unexpectedly
+    """
+    pass
+
+
+def writeSharedImage(image):
+    """
+    Copy an image into a new block of shared memory
+    :param image: The image (numpy.ndarray) to share
+    :return: Tuple (SharedMemory, descriptor). The descriptor (name, shape, dtype) lets another process read
+    the image. Close and unlink the SharedMemory once the other process has read it
+    """
+    image = np.ascontiguousarray(image)
+    sharedMemory = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+    np.ndarray(image.shape, image.dtype, buffer=sharedMemory.buf)[...] = image
+    return sharedMemory, (sharedMemory.name, image.shape, image.dtype.str)
+
+
+def readSharedImage(descriptor):
+    """
+    Copy an image out of shared memory, which was written by another process. See writeSharedImage
+    :param descriptor: Descriptor (name, shape, dtype) of the image
+    :return: The image (numpy.ndarray). It does not refer to the shared memory, which can be released
+    """
+    name, shape, dtype = descriptor
+    sharedMemory = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype, buffer=sharedMemory.buf).copy()
+    finally:
+        sharedMemory.close()
+
+
+def releaseSharedMemory(sharedMemories):
+    for sharedMemory in sharedMemories:
+        sharedMemory.close()
+        sharedMemory.unlink()
+
+
+def sendImages(connection, kind, images, value=None):
+    """
+    Send images to the other process through shared memory, and wait until it acknowledges that it has read them
+    :param connection: Our end of the pipe
+    :param kind: Kind of the message. e.g. OUTCOME_MESSAGE
+    :param images: The images to send. None entries are sent as None
+    :param value: Optional value to send along with the descriptors of the images
+    :return: None
+    """
+    sharedImages = [None if image is None else writeSharedImage(image) for image in images]
+    try:
+        connection.send((kind, ([None if shared is None else shared[1] for shared in sharedImages], value)))
+
+        # Keep the shared memory until the other process has copied the images out of it
+        connection.recv()
+    finally:
+        releaseSharedMemory([shared[0] for shared in sharedImages if shared is not None])
+
+
+def receiveImages(connection, descriptors):
+    """
+    Read the images sent by sendImages, and acknowledge them
+    :return: Tuple of the images
+    """
+    try:
+        return tuple(None if descriptor is None else readSharedImage(descriptor) for descriptor in descriptors)
+    finally:
+        connection.send((ACK_MESSAGE, None))
+
+
+def runDetectionProcess(connection, cancelEvent):
+    """
+    Main function of the detection process. Executes the detection requests received over the pipe, one after
+    the other, until it is asked to stop. The stage cache of this process outlives the requests, so running
+    again after a settings change recomputes only the affected stages, as it is in the GUI process.
+    :param connection: The child end of the pipe
+    :param cancelEvent: multiprocessing Event through which the GUI process cancels the running detection
+    :return: None
+    """
+    # Import here, so the GUI process does not pay for it when it is only starting this process
+    from logic.objectdetectionlogic import runObjectDetection
+
+    cancellationToken = CancellationToken(cancelEvent)
+    while True:
+        kind, value = connection.recv()
+        if kind == STOP_MESSAGE:
+            break
+
+        inputDescriptors, settings = value
+        try:
+            images = [readSharedImage(descriptor) for descriptor in inputDescriptors]
+            outcome = runObjectDetection(*images,
+                                         settings,
+                                         lambda text: connection.send((STATUS_MESSAGE, text)),
+                                         lambda progress: connection.send((PROGRESS_MESSAGE, progress)),
+                                         cancellationToken=cancellationToken,
+                                         partialResultConsumer=lambda partialImages, obj1Centroids: sendImages(
+                                             connection, PARTIAL_MESSAGE, partialImages, obj1Centroids))
+        except DetectionCancelledError:
+            connection.send((CANCELLED_MESSAGE, None))
+            continue
+        except Exception as e:
+            connection.send((ERROR_MESSAGE, str(e)))
+            continue
+
+        sendImages(connection, OUTCOME_MESSAGE, outcome)
+
+
+class DetectionProcess(object):
+    """
+    Runs object detections in a child process, so the Python loops of the detection do not compete with the
+    GUI over the GIL. The process is started on the first detection, and it is reused by the next ones.
+    Images are handed over through shared memory, while status and progress come back over a pipe.
+    Detections are executed one at a time. detect blocks the calling thread until its detection is over.
+    """
+
+    def __init__(self):
+        # Spawn rather than fork. Forking a process which runs Tk and some threads is not safe
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None  # multiprocessing.Process
+        self.connection = None  # Our end of the pipe
+        self.cancelEvent = None  # multiprocessing Event cancelling the running detection
+        self.lock = threading.Lock()
+        self.isShutDown = False
+
+    def start(self):
+        """
+        Start the detection process, unless it is already running
+        :return: None
+        """
+        if self.process is not None and self.process.is_alive():
+            return
+
+        if os.name == 'posix':
+            # Shared memory blocks are tracked by a resource tracker process. Start it before the detection process,
+            # so both processes share it. Otherwise each process tracks the blocks the other one has released
+            resource_tracker.ensure_running()
+
+        self.connection, childConnection = self.context.Pipe()
+        self.cancelEvent = self.context.Event()
+        self.process = self.context.Process(target=runDetectionProcess,
+                                            args=(childConnection, self.cancelEvent),
+                                            name='DetectionProcess',
+                                            daemon=True)
+        self.process.start()
+        childConnection.close()
+
+    def detect(self, obj1Image, obj2Image, image, settings, consoleConsumer, progressConsumer,
+               cancellationToken=None, partialResultConsumer=None):
+        """
+        Executes logic.objectdetectionlogic.runObjectDetection in the detection process.
+        Consumers are called from the calling thread
+        :param obj1Image: BGR image of the first object to look for
+        :param obj2Image: BGR image of the second object to look for
+        :param image: BGR image to look for the objects in
+        :param settings: The settings to use for the algorithm
+        :param consoleConsumer: Used to print messages at the UI layer
+        :param progressConsumer: Used to report progress [0, 100] to the UI layer
+        :param cancellationToken: Optional. Once it is cancelled, the detection process is asked to stop, and
+        this method raises DetectionCancelledError
+        :param partialResultConsumer: Optional. Receives the provisional results. See runObjectDetection
+        :return: The outcome of runObjectDetection
+        """
+        cancellationToken = cancellationToken or NEVER_CANCELLED
+        try:
+            with self.lock:
+                self.start()
+                self.cancelEvent.clear()
+
+                sharedImages = [writeSharedImage(inputImage) for inputImage in (obj1Image, obj2Image, image)]
+                try:
+                    self.connection.send((DETECT_MESSAGE, ([descriptor for _, descriptor in sharedImages],
+                                                           settings.snapshot())))
+                    isOver = False
+                    try:
+                        while True:
+                            kind, value = self.receive(cancellationToken)
+                            isOver = kind in FINAL_MESSAGES
+                            if kind == STATUS_MESSAGE:
+                                consoleConsumer(value)
+                            elif kind == PROGRESS_MESSAGE:
+                                progressConsumer(value)
+                            elif kind == CANCELLED_MESSAGE:
+                                raise DetectionCancelledError('Detection was cancelled')
+                            elif kind == ERROR_MESSAGE:
+                                raise DetectionProcessError(value)
+                            elif kind == PARTIAL_MESSAGE:
+                                descriptors, obj1Centroids = value
+                                partialImages = receiveImages(self.connection, descriptors)
+                                if partialResultConsumer is not None:
+                                    partialResultConsumer(partialImages, obj1Centroids)
+                            elif kind == OUTCOME_MESSAGE:
+                                descriptors, _ = value
+                                return receiveImages(self.connection, descriptors)
+                    finally:
+                        # A consumer has raised, or the process has died. Whatever the detection still sends
+                        # must not be received by the next one
+                        if not isOver:
+                            self.abandonDetection()
+                finally:
+                    releaseSharedMemory([sharedMemory for sharedMemory, _ in sharedImages])
+        finally:
+            # shutdown() does not wait for a running detection. The process is stopped once it is over
+            if self.isShutDown:
+                self.shutdown()
+
+    def receive(self, cancellationToken):
+        """
+        Wait for the next message of the detection process. Cancellation is forwarded to the process while
+        we are waiting
+        :return: The message (kind, value)
+        """
+        while True:
+            # Check on every message too. Progress messages might keep arriving faster than the poll interval
+            if cancellationToken.isCancelled():
+                self.cancelEvent.set()
+            if self.connection.poll(POLL_INTERVAL_SECONDS):
+                return self.connection.recv()
+            if not self.process.is_alive():
+                raise DetectionProcessError('Detection process has exited with code {}'.format(
+                    self.process.exitcode))
+
+    def abandonDetection(self):
+        """
+        Cancel the running detection, and skip the rest of its messages up to its final one, so the process is
+        ready for the next detection. A process which does not get there in time is terminated, and the next
+        detection starts a new one
+        :return: None
+        """
+        self.cancelEvent.set()
+        deadline = time.monotonic() + ABANDON_TIMEOUT_SECONDS
+        try:
+            while self.process.is_alive() and time.monotonic() < deadline:
+                if not self.connection.poll(POLL_INTERVAL_SECONDS):
+                    continue
+
+                kind, _ = self.connection.recv()
+                if kind in (PARTIAL_MESSAGE, OUTCOME_MESSAGE):
+                    # The process holds the images until we acknowledge them
+                    self.connection.send((ACK_MESSAGE, None))
+                if kind in FINAL_MESSAGES:
+                    return
+        except (OSError, EOFError):
+            pass
+
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+        self.process = None
+
+    def shutdown(self):
+        """
+        Stop the detection process. A running detection is cancelled, and the thread running it stops the
+        process once the detection is over, so this method does not wait for it
+        :return: None
+        """
+        self.isShutDown = True
+        if self.cancelEvent is not None:
+            self.cancelEvent.set()
+
+        if self.lock.acquire(blocking=False):
+            try:
+                self.stop()
+            finally:
+                self.lock.release()
+
+    def stop(self):
+        """
+        Ask the idle detection process to stop, and wait for it, so it releases its shared memory before we exit
+        :return: None
+        """
+        if self.process is not None and self.process.is_alive():
+            try:
+                self.connection.send((STOP_MESSAGE, None))
+            except OSError:
+                pass
+            self.process.join(STOP_TIMEOUT_SECONDS)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        if self.connection is not None:
+            self.connection.close()
+        self.process = self.connection = None
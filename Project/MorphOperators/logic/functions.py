@@ -4,8 +4,23 @@ import numpy as np
 import cv2
 from matplotlib import pyplot as plt
 
+from logic.pointwise import applyPointwise, gammaOperator
+
 DEFAULT_COLOR_MAP = "gray"
 
+# Ways to calculate gradient magnitude. See doGradientEdgeDetection
+GRADIENT_BACKEND_EXACT = 'exact'  # sqrt(dy^2 + dx^2) of np.gradient differences. The original behaviour
+GRADIENT_BACKEND_SOBEL = 'sobel'  # sqrt(dy^2 + dx^2) of 3x3 Sobel derivatives, in float32
+GRADIENT_BACKEND_L1 = 'l1'  # |dy| + |dx| of 3x3 Sobel derivatives. No square root at all
+GRADIENT_BACKENDS = (GRADIENT_BACKEND_EXACT, GRADIENT_BACKEND_SOBEL, GRADIENT_BACKEND_L1)
+
+# Ways to blur an image. See doBlur
+BLUR_BACKEND_MEDIAN = 'median'  # Median of the kernel. The original behaviour
+BLUR_BACKEND_GAUSSIAN = 'gaussian'  # Separable Gaussian, whose size is the kernel size
+BLUR_BACKEND_BOX = 'box'  # Mean of the kernel
+BLUR_BACKEND_DOWNSAMPLED = 'downsampled'  # Median of half the kernel, over half the resolution, upsampled back
+BLUR_BACKENDS = (BLUR_BACKEND_MEDIAN, BLUR_BACKEND_GAUSSIAN, BLUR_BACKEND_BOX, BLUR_BACKEND_DOWNSAMPLED)
+
 
 def log(consumer, *message):
     text = ' '.join(message)
@@ -151,20 +166,40 @@ def doImageContrastAdjustment(image, gamma=1.0):
     spectrum while gamma &gt; 1 will make the image appear lighter. gamma = 1 means no affect.
     :return: Adjusted image
     """
-    # Calculate the LUT once only and keep it as attribute of this function. (To fake a static var)
-    if not hasattr(doImageContrastAdjustment, 'LUT') or doImageContrastAdjustment.GAMMA != gamma:
-        # Build a lookup table mapping the pixel values [0, 255] to their adjusted gamma values
-        # Note that np.arange is faster than for loop over built-in range.
-        doImageContrastAdjustment.GAMMA = gamma
-        invGamma = 1.0 / gamma
-        doImageContrastAdjustment.LUT = \
-            np.array(((np.arange(256) / 255.0) ** invGamma) * 255.0, dtype=np.uint8)
+    # Apply gamma correction using a lookup table mapping the pixel values [0, 255] to their adjusted gamma
+    # values. Lookup tables are cached by gamma, so alternating gammas (and threads) do not recalculate them
+    return applyPointwise(image, [gammaOperator(gamma)])
+
+
+def doBlur(image, kernelSize, backend=BLUR_BACKEND_MEDIAN):
+    """
+    Blur an image, so we reduce the amount of sharp lines, and focus on objects as whole.
+    The cost of BLUR_BACKEND_MEDIAN grows with the kernel (OpenCV switches to its constant time, histogram based,
+    median for big kernels only), and it is paid per channel. The other backends approximate it:
+    Gaussian and box filters are separable (box is a running sum, so its cost does not depend on the kernel
+    size), and the downsampled median processes a quarter of the pixels with a smaller kernel.
+
+    :param image: The image to blur. (Gray or BGR, uint8)
+    :param kernelSize: Size of the kernel. Odd, positive number
+    :param backend: One of BLUR_BACKENDS
+    :return: The blurred image
+    """
+    if backend == BLUR_BACKEND_GAUSSIAN:
+        return cv2.GaussianBlur(image, (kernelSize, kernelSize), 0)
+
+    if backend == BLUR_BACKEND_BOX:
+        return cv2.blur(image, (kernelSize, kernelSize))
+
+    if backend == BLUR_BACKEND_DOWNSAMPLED and kernelSize > 3 and min(image.shape[:2]) > 1:
+        height, width = image.shape[:2]
+        downsampled = cv2.resize(image, ((width + 1) // 2, (height + 1) // 2), interpolation=cv2.INTER_AREA)
+        blur = cv2.medianBlur(downsampled, (kernelSize // 2) | 1)
+        return cv2.resize(blur, (width, height), interpolation=cv2.INTER_LINEAR)
 
-    # Now apply gamma correction using the lookup table
-    return cv2.LUT(image, doImageContrastAdjustment.LUT)
+    return cv2.medianBlur(image, kernelSize)
 
 
-def doGradientEdgeDetection(image, consoleConsumer=None):
+def doGradientEdgeDetection(image, consoleConsumer=None, backend=GRADIENT_BACKEND_EXACT):
     """
     Receives an image and return it after executing gradient edge detection.
 
@@ -173,6 +208,8 @@ def doGradientEdgeDetection(image, consoleConsumer=None):
 
     :param image: A gray-scale image to apply gradient edge detection on
     :param consoleConsumer: Used to print messages at the UI layer
+    :param backend: One of GRADIENT_BACKENDS. GRADIENT_BACKEND_EXACT has the same output as np.gradient,
+    while the Sobel based backends are faster, and smoother
     :return: The gradient edge detection result. (Image, not filtered by any threshold)
     """
     image = validateImage(image)
@@ -180,17 +217,61 @@ def doGradientEdgeDetection(image, consoleConsumer=None):
         log(consoleConsumer, 'ERROR - doGradientEdgeDetection: Image is missing.')
         return None
 
-    # img is a 2D array, so the result of gradient is two arrays ordered by axis
-    dy, dx = np.gradient(np.float64(image))
+    if backend == GRADIENT_BACKEND_SOBEL:
+        dx = np.float32(cv2.Sobel(image, cv2.CV_16S, 1, 0, ksize=3))
+        dy = np.float32(cv2.Sobel(image, cv2.CV_16S, 0, 1, ksize=3))
+        magnitude = cv2.magnitude(dx, dy)
+    elif backend == GRADIENT_BACKEND_L1:
+        # |dx| + |dy| <= 2040, so it fits int16
+        magnitude = np.abs(cv2.Sobel(image, cv2.CV_16S, 1, 0, ksize=3))
+        magnitude += np.abs(cv2.Sobel(image, cv2.CV_16S, 0, 1, ksize=3))
+    else:
+        return doExactGradientEdgeDetection(image)
 
-    # sqrt(dy^2 + dx^2)
-    newImage = (dy ** 2 + dx ** 2) ** 0.5
+    # Normalize the image to make sure we are within uint8 boundaries. (Done while converting to uint8)
+    return cv2.normalize(magnitude, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
 
-    # Normalize the image to make sure we are within uint8 boundaries
-    newImage = newImage - np.min(newImage)
-    newImage = np.round(newImage * 255 / np.max(newImage))
 
-    return np.uint8(newImage)
+def doExactGradientEdgeDetection(image):
+    """
+    Gradient magnitude of np.gradient, normalized to [0, 255], without the float64 temporaries.
+    np.gradient takes central differences (f[i+1] - f[i-1]) / 2, and one sided differences at the borders.
+    We calculate twice these differences, which are integers, so the sum of their squares (S) is an exact
+    integer, and the magnitude is sqrt(S / 4). The normalized gray level of every S in the image is calculated
+    once, into a lookup table, with the very same floating point operations np.gradient based code did.
+    :param image: A gray-scale image (uint8)
+    :return: The normalized gradient magnitude (uint8)
+    """
+    image = np.int32(image)
+    dy = np.empty(image.shape, dtype=np.int32)
+    dx = np.empty(image.shape, dtype=np.int32)
+    np.subtract(image[2:, :], image[:-2, :], out=dy[1:-1, :])
+    np.subtract(image[1, :], image[0, :], out=dy[0, :])
+    np.subtract(image[-1, :], image[-2, :], out=dy[-1, :])
+    dy[[0, -1], :] *= 2
+    np.subtract(image[:, 2:], image[:, :-2], out=dx[:, 1:-1])
+    np.subtract(image[:, 1], image[:, 0], out=dx[:, 0])
+    np.subtract(image[:, -1], image[:, -2], out=dx[:, -1])
+    dx[:, [0, -1]] *= 2
+
+    # S = (2dy)^2 + (2dx)^2, at most 2 * 510^2, so it fits int32
+    np.multiply(dy, dy, out=dy)
+    np.multiply(dx, dx, out=dx)
+    np.add(dy, dx, out=dy)
+
+    minSum, maxSum = int(dy.min()), int(dy.max())
+    output = np.zeros(image.shape, dtype=np.uint8)
+    if maxSum == minSum:
+        return output
+
+    # The magnitudes of all sums between the min and the max. Then normalize them to make sure we are
+    # within uint8 boundaries
+    magnitudes = np.sqrt(np.arange(minSum, maxSum + 1) * 0.25)
+    magnitudes -= magnitudes[0]
+    lut = np.uint8(np.round(magnitudes * 255 / magnitudes[-1]))
+
+    np.subtract(dy, minSum, out=dy)
+    return np.take(lut, dy, out=output)
 
 
 def fullyPrintArray(array, consoleConsumer=None):
@@ -0,0 +1,144 @@
+__author__ = "Haim Adrian"
+
+import cv2
+import numpy as np
+
+from logic.rlemask import RunLengthMask
+
+# Engines of the hit & miss of the templates. See Settings.hitMissBackend
+HIT_MISS_BACKEND_OPENCV = 'opencv'
+HIT_MISS_BACKEND_INTEGRAL = 'integral'  # Rectangles over a summed-area table. See integralHitMiss
+HIT_MISS_BACKEND_RLE = 'rle'  # Row runs of the structuring element over the runs of the image. See logic.rlemask
+HIT_MISS_BACKENDS = (HIT_MISS_BACKEND_OPENCV, HIT_MISS_BACKEND_INTEGRAL, HIT_MISS_BACKEND_RLE)
+
+# Once less than this fraction of the pixels are still candidates, the rest of the rectangles are tested at the
+# candidates only, instead of over the whole image
+SPARSE_CANDIDATES_FRACTION = 0.02
+
+# Foreground fractions are kept this far from 0 and 1, so even an empty or full image orders the rectangles
+MIN_FRACTION = 1e-6
+
+
+def computeForegroundIntegral(binary):
+    """
+    Summed-area table of the foreground of a binary image. Background counts are the area minus the foreground
+    counts, so a single table serves the hits and the misses
+    :param binary: Binary image. Non-zero pixels are foreground
+    :return: The table (int32), of shape (rows + 1, columns + 1)
+    """
+    return cv2.integral(np.uint8(binary > 0), sdepth=cv2.CV_32S)
+
+
+def padIntegral(integral, margin):
+    """
+    Pad a summed-area table by repeating its edges. Looking up a padded table is looking up the original one with
+    the indices clipped to it, so rectangles sticking out of the image count the pixels inside of it only
+    :return: The padded table
+    """
+    return np.pad(integral, margin, mode='edge')
+
+
+def decomposeIntoRectangles(mask):
+    """
+    Cover the cells of a mask by axis aligned rectangles: its row runs, where runs with the same columns in
+    consecutive rows are merged into a single rectangle
+    :param mask: 2D array. Non-zero cells are part of the mask
+    :return: Array of shape (n, 4) of rectangles (top, left, bottom, right). Bottom and right are exclusive
+    """
+    runs = RunLengthMask.fromDense(mask)
+    rectangles = []
+    openRectangles = {}  # (left, right) -> index of the rectangle which ends at the current row
+    for row, left, right in zip(runs.rows.tolist(), runs.starts.tolist(), runs.ends.tolist()):
+        index = openRectangles.get((left, right))
+        if index is not None and rectangles[index][2] == row:
+            rectangles[index][2] = row + 1
+        else:
+            openRectangles[(left, right)] = len(rectangles)
+            rectangles.append([row, left, row + 1, right])
+    return np.array(rectangles, dtype=np.int64).reshape(-1, 4)
+
+
+def structuringElementRectangles(structuringElement, foregroundFraction=0.5):
+    """
+    Decompose the hit and miss cells of a structuring element into rectangles, relative to its anchor (center).
+    Rectangles are ordered by the chance a pixel passes them, were the pixels of the image independent: a hit
+    rectangle is passed by foregroundFraction ^ area of the pixels, and a miss one by the rest of them ^ area.
+    Testing the pickiest rectangles first leaves the least candidates for the others
+    :param structuringElement: 2D array. 1 means hit, -1 means miss and 0 means don't care
+    :param foregroundFraction: Fraction of the pixels of the image which are foreground
+    :return: Tuple (rectangles (n, 4), whether every rectangle is of hits (n)), pickiest rectangles first
+    """
+    structuringElement = np.asarray(structuringElement)
+    anchor = np.array([structuringElement.shape[0] // 2, structuringElement.shape[1] // 2] * 2)
+    hitRectangles = decomposeIntoRectangles(structuringElement == 1)
+    missRectangles = decomposeIntoRectangles(structuringElement == -1)
+
+    if len(hitRectangles) + len(missRectangles) == 0:
+        # cv2 leaves the image as is when nothing is tested, which is testing the anchor as a hit
+        hitRectangles = np.array([anchor[:2].tolist() + (anchor[:2] + 1).tolist()])
+
+    rectangles = np.concatenate((hitRectangles, missRectangles)) - anchor
+    isHit = np.concatenate((np.ones(len(hitRectangles), dtype=bool), np.zeros(len(missRectangles), dtype=bool)))
+    areas = (rectangles[:, 2] - rectangles[:, 0]) * (rectangles[:, 3] - rectangles[:, 1])
+    foregroundFraction = np.clip(foregroundFraction, MIN_FRACTION, 1 - MIN_FRACTION)
+    logChances = areas * np.where(isHit, np.log(foregroundFraction), np.log(1 - foregroundFraction))
+    order = np.argsort(logChances, kind='stable')
+    return rectangles[order], isHit[order]
+
+
+def integralHitMiss(paddedIntegral, margin, shape, structuringElement):
+    """
+    Hit & miss by rectangles: a pixel is a hit when every hit rectangle around it is all foreground, and every miss
+    rectangle is all background. Every rectangle costs four lookups of the summed-area table, whatever its area.
+    The pickiest rectangles are tested first, over the whole image. Once they leave a few candidate pixels, the rest
+    of the rectangles are tested at those candidates only.
+    Identical to cv2.MORPH_HITMISS over a binary image of 0 and 255, including the border of the image
+
+    :param paddedIntegral: Summed-area table of the foreground, padded by margin. See padIntegral
+    :param margin: Margin of the table. Must not be less than the size of the structuring element
+    :param shape: Shape of the image
+    :param structuringElement: 2D array. 1 means hit, -1 means miss and 0 means don't care
+    :return: The hit & miss result (uint8, 0 and 255)
+    """
+    height, width = shape
+    foregroundFraction = paddedIntegral[-1, -1] / float(max(height * width, 1))
+    rectangles, isHit = structuringElementRectangles(structuringElement, foregroundFraction)
+    rows = np.arange(height)
+    columns = np.arange(width)
+
+    isCandidate = np.ones(shape, dtype=bool)
+    index = 0
+    while index < len(rectangles) and np.count_nonzero(isCandidate) > isCandidate.size * SPARSE_CANDIDATES_FRACTION:
+        top, left, bottom, right = (rectangles[index] + margin).tolist()
+        count = paddedIntegral[bottom: bottom + height, right: right + width] - \
+            paddedIntegral[top: top + height, right: right + width] - \
+            paddedIntegral[bottom: bottom + height, left: left + width] + \
+            paddedIntegral[top: top + height, left: left + width]
+        if isHit[index]:
+            top, left, bottom, right = rectangles[index].tolist()
+            rowCounts = np.clip(rows + bottom, 0, height) - np.clip(rows + top, 0, height)
+            columnCounts = np.clip(columns + right, 0, width) - np.clip(columns + left, 0, width)
+            isCandidate &= count == rowCounts[:, np.newaxis] * columnCounts[np.newaxis, :]
+        else:
+            isCandidate &= count == 0
+        index += 1
+
+    candidateRows, candidateColumns = np.nonzero(isCandidate)
+    for (top, left, bottom, right), isHitRectangle in zip(rectangles[index:].tolist(), isHit[index:].tolist()):
+        if candidateRows.size == 0:
+            break
+        tops, lefts = candidateRows + (top + margin), candidateColumns + (left + margin)
+        bottoms, rights = candidateRows + (bottom + margin), candidateColumns + (right + margin)
+        count = paddedIntegral[bottoms, rights] - paddedIntegral[tops, rights] - \
+            paddedIntegral[bottoms, lefts] + paddedIntegral[tops, lefts]
+        if isHitRectangle:
+            area = (np.clip(candidateRows + bottom, 0, height) - np.clip(candidateRows + top, 0, height)) * \
+                   (np.clip(candidateColumns + right, 0, width) - np.clip(candidateColumns + left, 0, width))
+            isKept = count == area
+        else:
+            isKept = count == 0
+        candidateRows, candidateColumns = candidateRows[isKept], candidateColumns[isKept]
+
+    result = np.zeros(shape, dtype=np.uint8)
+    result[candidateRows, candidateColumns] = 255
+    return result
@@ -0,0 +1,77 @@
+__author__ = "Haim Adrian"
+
+import unittest
+
+import cv2
+import numpy as np
+
+from logic.binaryimagetestcase import BinaryImageTestCase, ELEMENT_SHAPES, randomBinaryImage
+from logic.integralhitmiss import HIT_MISS_BACKENDS, computeForegroundIntegral, decomposeIntoRectangles, \
+    integralHitMiss, padIntegral
+from logic.objectdetectionlogic import createHitMissFunction, prepareHitMissScene
+from util.settings import Settings
+
+# Elements bigger than the images too
+HIT_MISS_ELEMENT_SHAPES = ELEMENT_SHAPES + ((45, 45),)
+CASES_PER_SHAPE = 3
+
+
+def hitMiss(image, structuringElement):
+    margin = int(np.ceil(np.hypot(*structuringElement.shape))) + 1
+    paddedIntegral = padIntegral(computeForegroundIntegral(image), margin)
+    return integralHitMiss(paddedIntegral, margin, image.shape, structuringElement)
+
+
+class IntegralHitMissTest(BinaryImageTestCase):
+    seed = 50
+    # Nearly empty images leave a few candidates after the first rectangles
+    foregroundFractions = (0.01, 0.1, 0.5, 0.9, 0.99)
+
+    def testDecomposeIntoRectangles(self):
+        for shape in HIT_MISS_ELEMENT_SHAPES:
+            mask = self.randomState.random_sample(shape) < 0.5
+            covered = np.zeros(shape, dtype=int)
+            for top, left, bottom, right in decomposeIntoRectangles(mask).tolist():
+                covered[top:bottom, left:right] += 1
+            # Every cell of the mask is covered exactly once
+            self.assertImagesEqual(np.int64(mask), covered)
+
+    def testHitMiss(self):
+        for image in self.randomImages():
+            for elementShape in HIT_MISS_ELEMENT_SHAPES:
+                for _ in range(CASES_PER_SHAPE):
+                    structuringElement = self.randomState.randint(-1, 2, size=elementShape)
+                    self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                           hitMiss(image, structuringElement),
+                                           'image {}, element\n{}'.format(image.shape, structuringElement))
+
+    def testSolidElements(self):
+        # Few big rectangles. Sparse images leave a few candidates after the first of them
+        for image in self.randomImages():
+            for elementShape in HIT_MISS_ELEMENT_SHAPES:
+                for value in (1, -1):
+                    structuringElement = np.full(elementShape, value, dtype=int)
+                    self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                           hitMiss(image, structuringElement))
+
+    def testHitMissWithoutCells(self):
+        # Nothing is tested, and cv2 leaves the image as is
+        for image in self.randomImages():
+            for elementShape in ((3, 3), (2, 4)):
+                structuringElement = np.zeros(elementShape, int)
+                self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                       hitMiss(image, structuringElement))
+
+    def testBackends(self):
+        image = randomBinaryImage(self.randomState, (40, 40), 0.7)
+        structuringElement = self.randomState.randint(-1, 2, size=(7, 6))
+        expected = cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement)
+        for backend in HIT_MISS_BACKENDS:
+            settings = Settings().snapshot().replace(hitMissBackend=backend)
+            hitMissFunction = createHitMissFunction(image, structuringElement, settings,
+                                                    prepareHitMissScene(image, settings))
+            self.assertImagesEqual(expected, hitMissFunction(structuringElement), backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+__author__ = "Haim Adrian"
+
+import cv2
+import numpy as np
+
+from util.lrucache import LruCache
+
+# Kinds of 3x3 binary operations. An operation is a hashable tuple: (kind, *parameters)
+ERODE_OPERATION = 'erode'
+DILATE_OPERATION = 'dilate'
+HIT_MISS_OPERATION = 'hitMiss'
+
+# Bit of every cell of a 3x3 neighbourhood in its code. Cell (row, column) is bit row * 3 + column
+NEIGHBOURHOOD_WEIGHTS = np.float32([[1, 2, 4], [8, 16, 32], [64, 128, 256]])
+NEIGHBOURHOOD_CODES = 512
+
+# Bits of the cells which are outside of the image, for pixels at the borders of the image
+TOP_BITS = 0b000000111
+BOTTOM_BITS = 0b111000000
+LEFT_BITS = 0b001001001
+RIGHT_BITS = 0b100100100
+
+# Lookup tables of operations, keyed by (operation, bits of the cells outside of the image)
+neighbourhoodLutCache = LruCache(maxEntries=256)
+
+
+def erodeOperation():
+    return (ERODE_OPERATION,)
+
+
+def dilateOperation():
+    return (DILATE_OPERATION,)
+
+
+def hitMissOperation(structuringElement):
+    """
+    :param structuringElement: 3x3 structuring element, as cv2.MORPH_HITMISS gets it: 1 means the pixel must be
+    foreground, -1 means it must be background and 0 means don't care
+    :return: The operation
+    """
+    return HIT_MISS_OPERATION, tuple(int(value) for value in np.ravel(structuringElement))
+
+
+def createNeighbourhoodLut(operation, outsideBits=0):
+    """
+    Evaluate an operation over all of the 512 neighbourhoods. Cells outside of the image are ignored, as cv2
+    ignores them when eroding and dilating
+    :param operation: The operation. e.g. erodeOperation()
+    :param outsideBits: Bits of the cells which are outside of the image
+    :return: Lookup table (512 values of 0 or 1) from neighbourhood code to the value of the pixel
+    """
+    codes = np.arange(NEIGHBOURHOOD_CODES)
+    cells = (codes[:, np.newaxis] >> np.arange(9)) & 1
+    isInside = ((outsideBits >> np.arange(9)) & 1) == 0
+
+    kind = operation[0]
+    if kind == DILATE_OPERATION:
+        lut = np.any(cells[:, isInside] == 1, axis=1)
+    else:
+        structuringElement = np.ones(9, dtype=int) if kind == ERODE_OPERATION else np.array(operation[1])
+        if kind not in (ERODE_OPERATION, HIT_MISS_OPERATION):
+            raise ValueError('Unknown neighbourhood operation: {}'.format(operation))
+        if not np.any(structuringElement):
+            # cv2 leaves the image as is when nothing is tested, which is testing the anchor as a hit
+            structuringElement = np.uint8(np.arange(9) == 4)
+        isHit = np.all((cells == 1) | (structuringElement != 1) | ~isInside, axis=1)
+        isMiss = np.all((cells == 0) | (structuringElement != -1) | ~isInside, axis=1)
+        lut = isHit & isMiss
+
+    return lut.astype(np.uint8)
+
+
+def getNeighbourhoodLut(operation, outsideBits=0):
+    key = (operation, outsideBits)
+    lut = neighbourhoodLutCache.get(key)
+    if lut is None:
+        lut = createNeighbourhoodLut(operation, outsideBits)
+        lut.flags.writeable = False
+        neighbourhoodLutCache.put(key, lut)
+    return lut
+
+
+def computeNeighbourhoodCodes(bits):
+    """
+    Pack the 3x3 neighbourhood of every pixel into a 9 bits code, in a single pass. Cells outside of the image
+    are packed as 0. See getOutsideBits
+    :param bits: Binary image of 0 and 1 (uint8)
+    :return: The codes (int16)
+    """
+    return cv2.filter2D(bits, cv2.CV_16S, NEIGHBOURHOOD_WEIGHTS, borderType=cv2.BORDER_CONSTANT)
+
+
+def getOutsideBits(length, lowBits, highBits):
+    """
+    :return: Bits of the cells outside of the image, along an axis of the specified length
+    """
+    outsideBits = np.zeros(length, dtype=np.int64)
+    outsideBits[0] |= lowBits
+    outsideBits[-1] |= highBits
+    return outsideBits
+
+
+def applyNeighbourhoodLut(codes, operation):
+    """
+    Look the codes up. Pixels at the borders of the image look up the tables which ignore the cells outside
+    :param codes: Neighbourhood codes. See computeNeighbourhoodCodes
+    :param operation: The operation
+    :return: The outcome (0 and 1, uint8)
+    """
+    bits = np.take(getNeighbourhoodLut(operation), codes)
+
+    height, width = codes.shape
+    rowOutsideBits = getOutsideBits(height, TOP_BITS, BOTTOM_BITS)
+    columnOutsideBits = getOutsideBits(width, LEFT_BITS, RIGHT_BITS)
+    # First and last rows, then first and last columns
+    for rows, columns in ((np.array([0, height - 1]), np.arange(width)),
+                          (np.arange(height), np.array([0, width - 1]))):
+        region = np.ix_(rows, columns)
+        outsideBits = rowOutsideBits[rows][:, np.newaxis] | columnOutsideBits[columns][np.newaxis, :]
+        borderCodes = codes[region]
+        border = bits[region]
+        for outside in np.unique(outsideBits):
+            isOutside = outsideBits == outside
+            border[isOutside] = getNeighbourhoodLut(operation, int(outside))[borderCodes[isOutside]]
+        bits[region] = border
+
+    return bits
+
+
+def runLutMorphology(binary, operations):
+    """
+    Execute a chain of 3x3 binary operations with lookup tables: every operation packs the neighbourhoods
+    once, and looks their codes up in a 512 entries table. The chain passes 0/1 images between the operations,
+    and scales the outcome back only once it is over.
+    Erosion and dilation are identical to cv2.erode and cv2.dilate with a 3x3 rectangle, and hit & miss is
+    identical to cv2.MORPH_HITMISS.
+    :param binary: Binary image: 0 and a single foreground value
+    :param operations: Sequence of operations. e.g. [dilateOperation(), erodeOperation()]
+    :return: A new binary image, using the foreground value of the image (255 when the image is all black)
+    """
+    foreground = int(binary.max()) or 255
+    bits = np.uint8(binary > 0)
+    for operation in operations:
+        bits = applyNeighbourhoodLut(computeNeighbourhoodCodes(bits), operation)
+
+    return bits * np.uint8(foreground)
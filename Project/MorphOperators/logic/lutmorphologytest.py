@@ -0,0 +1,63 @@
+__author__ = "Haim Adrian"
+
+import unittest
+
+import cv2
+import numpy as np
+
+from logic.binaryimagetestcase import BinaryImageTestCase, randomBinaryImage
+from logic.lutmorphology import dilateOperation, erodeOperation, hitMissOperation, runLutMorphology
+from logic.morphology import MORPHOLOGY_BACKEND_LUT, MORPHOLOGY_BACKEND_OPENCV, runMorphology
+
+# The lookup tables serve 3x3 elements only
+KERNEL = np.ones((3, 3), np.uint8)
+HIT_MISS_CASES = 300
+
+
+class LutMorphologyTest(BinaryImageTestCase):
+    seed = 47
+
+    def testErodeAndDilate(self):
+        for image in self.randomImages():
+            self.assertImagesEqual(cv2.erode(image, KERNEL), runLutMorphology(image, [erodeOperation()]))
+            self.assertImagesEqual(cv2.dilate(image, KERNEL), runLutMorphology(image, [dilateOperation()]))
+
+    def testChains(self):
+        operations = [dilateOperation(), dilateOperation(), erodeOperation(), erodeOperation(), erodeOperation()]
+        for image in self.randomImages():
+            expected = cv2.erode(cv2.dilate(image, KERNEL, iterations=2), KERNEL, iterations=3)
+            self.assertImagesEqual(expected, runLutMorphology(image, operations))
+
+    def testHitMiss(self):
+        images = list(self.randomImages())
+        for _ in range(HIT_MISS_CASES):
+            structuringElement = self.randomState.randint(-1, 2, size=(3, 3))
+            for image in images:
+                self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                       runLutMorphology(image, [hitMissOperation(structuringElement)]),
+                                       'image {}, element\n{}'.format(image.shape, structuringElement))
+
+    def testHitMissWithoutCells(self):
+        # Nothing is tested, and cv2 leaves the image as is
+        structuringElement = np.zeros((3, 3), int)
+        for image in self.randomImages():
+            self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                   runLutMorphology(image, [hitMissOperation(structuringElement)]))
+
+    def testForegroundValue(self):
+        image = randomBinaryImage(self.randomState, (20, 20)) // 255 * 128
+        outcome = runLutMorphology(image, [dilateOperation()])
+        self.assertEqual({0, 128}, set(np.unique(outcome).tolist()))
+        self.assertImagesEqual(cv2.dilate(image, KERNEL), outcome)
+
+    def testRunMorphology(self):
+        operations = [(cv2.MORPH_CLOSE, 3), (cv2.MORPH_OPEN, 2), (cv2.MORPH_ERODE, 1), (cv2.MORPH_DILATE, 0)]
+        for image in self.randomImages():
+            # Other kernel shapes fall back to opencv, so they must match too
+            for kernelShape in ((3, 3), (2, 4), (5, 5)):
+                self.assertImagesEqual(runMorphology(image, operations, kernelShape, MORPHOLOGY_BACKEND_OPENCV),
+                                       runMorphology(image, operations, kernelShape, MORPHOLOGY_BACKEND_LUT))
+
+
+if __name__ == '__main__':
+    unittest.main()
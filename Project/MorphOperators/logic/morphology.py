@@ -0,0 +1,137 @@
+__author__ = "Haim Adrian"
+
+import cv2
+import numpy as np
+
+from logic.lutmorphology import dilateOperation, erodeOperation, runLutMorphology
+from logic.rlemask import RunLengthMask
+
+# Engines of runMorphology. 'lut' handles binary images with a 3x3 kernel, and falls back to 'opencv' otherwise.
+# 'rle' handles binary images, as runs of their foreground pixels. See logic.rlemask
+MORPHOLOGY_BACKEND_OPENCV = 'opencv'
+MORPHOLOGY_BACKEND_LUT = 'lut'
+MORPHOLOGY_BACKEND_RLE = 'rle'
+MORPHOLOGY_BACKENDS = (MORPHOLOGY_BACKEND_OPENCV, MORPHOLOGY_BACKEND_LUT, MORPHOLOGY_BACKEND_RLE)
+
+# Ways to fill the holes inside objects. 'closing' is the original behaviour: many closing iterations.
+# 'reconstruction' closes a little, to bridge gaps in edges, and then fills the holes. See fillHoles
+HOLE_FILL_CLOSING = 'closing'
+HOLE_FILL_RECONSTRUCTION = 'reconstruction'
+HOLE_FILL_METHODS = (HOLE_FILL_CLOSING, HOLE_FILL_RECONSTRUCTION)
+
+# The erosions and dilations each operation is made of, in order
+OPERATION_STEPS = {cv2.MORPH_ERODE: (cv2.MORPH_ERODE,),
+                   cv2.MORPH_DILATE: (cv2.MORPH_DILATE,),
+                   cv2.MORPH_OPEN: (cv2.MORPH_ERODE, cv2.MORPH_DILATE),
+                   cv2.MORPH_CLOSE: (cv2.MORPH_DILATE, cv2.MORPH_ERODE)}
+
+
+def planMorphology(operations, kernelShape):
+    """
+    Rewrite a sequence of morphological operations with a rectangular kernel into the shortest sequence of single
+    pass erosions and dilations.
+    Pixels outside of the image are ignored by cv2 erosions and dilations, so eroding (dilating) a rectangle
+    after another is eroding (dilating) once with a rectangle, whose size is their sizes summed (minus one)
+    and whose anchor is their anchors summed. This holds for iterations of an operation, and for consecutive
+    operations of the same kind, e.g. the erosion closing ends with and the erosion opening starts with.
+
+    :param operations: Sequence of (operation, iterations) tuples. Operation is one of cv2.MORPH_ERODE,
+    cv2.MORPH_DILATE, cv2.MORPH_OPEN and cv2.MORPH_CLOSE
+    :param kernelShape: Shape (rows, columns) of the rectangular kernel of all operations
+    :return: List of steps (cv2.MORPH_ERODE or cv2.MORPH_DILATE, kernel shape (rows, columns), anchor (x, y))
+    """
+    rows, columns = kernelShape
+    steps = []
+    for operation, iterations in operations:
+        if iterations <= 0 or rows * columns == 1:
+            continue
+
+        # The size and anchor of the rectangle of all of the iterations. cv2 anchors a kernel at its center
+        shape = (rows + (iterations - 1) * (rows - 1), columns + (iterations - 1) * (columns - 1))
+        anchor = ((columns // 2) * iterations, (rows // 2) * iterations)
+        for stepOperation in OPERATION_STEPS[operation]:
+            if steps and steps[-1][0] == stepOperation:
+                _, lastShape, lastAnchor = steps.pop()
+                steps.append((stepOperation,
+                              (lastShape[0] + shape[0] - 1, lastShape[1] + shape[1] - 1),
+                              (lastAnchor[0] + anchor[0], lastAnchor[1] + anchor[1])))
+            else:
+                steps.append((stepOperation, shape, anchor))
+
+    return steps
+
+
+def toLutOperations(operations):
+    """
+    :param operations: Sequence of (operation, iterations) tuples. See planMorphology
+    :return: List of the 3x3 erosions and dilations the operations are made of. See logic.lutmorphology
+    """
+    lutOperations = []
+    for operation, iterations in operations:
+        for stepOperation in OPERATION_STEPS[operation]:
+            lutOperation = erodeOperation() if stepOperation == cv2.MORPH_ERODE else dilateOperation()
+            lutOperations.extend([lutOperation] * max(iterations, 0))
+    return lutOperations
+
+
+def runMorphology(image, operations, kernelShape, backend=MORPHOLOGY_BACKEND_OPENCV):
+    """
+    Execute a sequence of morphological operations with a rectangular kernel. See planMorphology.
+    The outcome is identical to executing the operations one by one, with cv2.morphologyEx and their iterations.
+    cv2 filters a rectangle by its rows and then by its columns, so every step is a single pass (per axis),
+    whatever the size of its rectangle.
+    The 'lut' backend chains 3x3 lookup table passes over a binary image instead. See logic.lutmorphology
+    The 'rle' backend executes the same steps over the runs of a binary image. See logic.rlemask
+
+    :param image: The image (uint8)
+    :param operations: Sequence of (operation, iterations) tuples. See planMorphology
+    :param kernelShape: Shape (rows, columns) of the rectangular kernel
+    :param backend: One of MORPHOLOGY_BACKENDS
+    :return: A new image
+    """
+    if backend == MORPHOLOGY_BACKEND_LUT and tuple(kernelShape) == (3, 3):
+        lutOperations = toLutOperations(operations)
+        return runLutMorphology(image, lutOperations) if lutOperations else image.copy()
+
+    steps = planMorphology(operations, kernelShape)
+    if not steps:
+        return image.copy()
+
+    if backend == MORPHOLOGY_BACKEND_RLE:
+        mask = RunLengthMask.fromDense(image)
+        for operation, shape, anchor in steps:
+            kernel = np.ones(shape, np.uint8)
+            mask = mask.erode(kernel, anchor) if operation == cv2.MORPH_ERODE else mask.dilate(kernel, anchor)
+        return mask.toDense(int(image.max()) or 255, image.dtype)
+
+    for operation, shape, anchor in steps:
+        kernel = np.ones(shape, np.uint8)
+        if operation == cv2.MORPH_ERODE:
+            image = cv2.erode(image, kernel, anchor=anchor)
+        else:
+            image = cv2.dilate(image, kernel, anchor=anchor)
+    return image
+
+
+def fillHoles(binary):
+    """
+    Fill the holes of the objects in a binary image, by morphological reconstruction of the background out of
+    the image border: a flood fill from the border marks the background, and whatever it did not reach is
+    either foreground or a hole. The flood fill is 4-connected, so the holes of 8-connected objects are filled.
+    Unlike closing, it passes over the image about twice, whatever the size of the holes, and it does not merge
+    objects touching each other.
+
+    :param binary: Binary image: 0 and a single foreground value
+    :return: A new binary image, using the foreground value of the image
+    """
+    foreground = int(binary.max())
+    if foreground == 0:
+        return binary.copy()
+
+    # Pad with background, so the background touching the border is a single connected region
+    background = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    cv2.floodFill(background, None, (0, 0), foreground)
+
+    filled = binary.copy()
+    filled[background[1:-1, 1:-1] == 0] = foreground
+    return filled
@@ -1,69 +1,304 @@
 __author__ = "Haim Adrian"
 
+import time
+
 from logic.functions import *
 import cv2
 import numpy as np
 import imutils
+from logic.integralhitmiss import HIT_MISS_BACKEND_INTEGRAL, HIT_MISS_BACKEND_OPENCV, computeForegroundIntegral, \
+    integralHitMiss, padIntegral
+from logic.morphology import HOLE_FILL_RECONSTRUCTION, fillHoles, runMorphology
+from logic.pointwise import gammaOperator, getLut
+from logic.rlemask import RunLengthMask
+from logic.stagegraph import Stage, StageGraph
+from logic.thresholding import THRESHOLD_METHOD_FIXED, applyThresholds, computeTileHistograms, findThresholds, \
+    remapHistograms
+from util.cancellation import NEVER_CANCELLED
+from util.lrucache import LruCache
+from util.tracing import tracer
+
+# Stage outputs of all runs are memoized here, so re-running after a settings change recomputes only the
+# stages affected by that change
+STAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+stageCache = LruCache(maxBytes=STAGE_CACHE_MAX_BYTES)
+
+# Longest side of the images we preview. See runPreview
+PREVIEW_MAX_SIDE = 200
+
+# Percentage of the pixels of the binary images a blur backend may change, compared to the median.
+# See selectBlurBackend
+DEFAULT_BLUR_TOLERANCE_PERCENT = 0.2
+DEFAULT_BLUR_BENCHMARK_REPEAT = 5
+
+
+def runObjectDetection(obj1Image, obj2Image, image, settings, consoleConsumer, progressConsumer,
+                       findingsConsumer=None, stageGraph=None, cancellationToken=None, partialResultConsumer=None):
+    """
+    Detects the two objects in the specified image, using morphological operators.
+    Each step of the pipeline is a stage (see logic.stagegraph), whose output is memoized by its inputs
+    and the settings it depends on. Running again after a settings change recomputes only the stages
+    affected by that change.
+
+    :param obj1Image: BGR image of the first object to look for
+    :param obj2Image: BGR image of the second object to look for
+    :param image: BGR image to look for the objects in
+    :param settings: The settings to use for the algorithm. Settings are snapshotted when the detection
+    starts, so modifying them during the detection does not affect it
+    :param consoleConsumer: Used to print messages at the UI layer
+    :param progressConsumer: Used to report progress [0, 100] to the UI layer
+    :param findingsConsumer: Optional. Receives the centroids (x, y) of the detected objects, as two
+    lists: (obj1Centroids, obj2Centroids). Centroids are in the coordinates of the specified image.
+    See computeCentroid
+    :param stageGraph: Optional. The StageGraph to execute the stages with. Default memoizes the stage
+    outputs in stageCache. Use StageGraph() to execute without memoization
+    :param cancellationToken: Optional. util.cancellation.CancellationToken checked between stages, scales
+    and angles. Once it is cancelled, the detection raises DetectionCancelledError
+    :param partialResultConsumer: Optional. Receives provisional results once the first object was swept, while
+    the second one is still being swept: (images, obj1Centroids). images is a tuple as the one we return, where
+    hitMissObj2 is None and imgMarks highlights the first object only. Findings of the first object are final,
+    as a contour which matches the first object is never counted as the second one
+    :return: A tuple of the images produced by the algorithm:
+    (objsImg, objsBinaryImg, objsClosingImg, imgBinary, imgClosing, hitMissObj1, hitMissObj2, imgMarks)
+    """
+    consoleConsumer('Running Object Detection using Morphological Operators...')
+    settings = settings.snapshot()
+    graph = stageGraph if stageGraph is not None else StageGraph(stageCache)
+    cancellationToken = cancellationToken or NEVER_CANCELLED
+
+    with tracer.span('runObjectDetection'):
+        obj1Image, obj1Binary, obj1Closing = preprocessImage(graph, graph.source(obj1Image), settings,
+                                                             OBJ_CLOSING_STAGE, consoleConsumer, cancellationToken)
+        obj2Image, obj2Binary, obj2Closing = preprocessImage(graph, graph.source(obj2Image), settings,
+                                                             OBJ_CLOSING_STAGE, consoleConsumer, cancellationToken)
+        image, imgBinary, imgClosing = preprocessImage(graph, graph.source(image), settings,
+                                                       IMAGE_CLOSING_STAGE, consoleConsumer, cancellationToken)
+
+        # We use findContours to detect objects.
+        # Then we make our array regular with the grab_contours method
+        contours = cv2.findContours(imgClosing.value.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = imutils.grab_contours(contours)
 
+        objsImg = concatenateImages3D(obj1Image.value, obj2Image.value)
+        objsBinaryImg = concatenateImages2D(obj1Binary.value, obj2Binary.value)
+        objsClosingImg = concatenateImages2D(obj1Closing.value, obj2Closing.value)
+
+        def onTemplateSwept(templateIndex, hitMissObj):
+            # Publish what we know once the first object was swept. The second one is published with the outcome
+            if partialResultConsumer is None or templateIndex != 0:
+                return
+            with tracer.span('partialHighlight'):
+                partialMarks = image.value.copy()
+                partialCentroids, _ = highlightObjectsInImage(contours, hitMissObj, None, partialMarks, settings,
+                                                              lambda text: None, lambda progress: None, 0)
+            consoleConsumer('First Object Count: ' + str(len(partialCentroids)) + ' (Second Object is pending)')
+            partialResultConsumer((objsImg, objsBinaryImg, objsClosingImg, imgBinary.value, imgClosing.value,
+                                   hitMissObj, None, partialMarks), partialCentroids)
+
+        # This method will iteratively try looking up for the objects in the given image, using
+        # multiple sizes of the objects, depend on settings
+        # Once we gather objects using findNonZero, we can filter them based on hit & miss results
+        with tracer.span('hitMiss'):
+            hitMissObj1, hitMissObj2, progress = doHitMissInStageGraph(graph, imgClosing, obj1Closing, obj2Closing,
+                                                                       settings, consoleConsumer, progressConsumer,
+                                                                       cancellationToken, onTemplateSwept)
+        cancellationToken.raiseIfCancelled()
+
+        image, imgBinary, imgClosing = image.value, imgBinary.value, imgClosing.value
+
+        with tracer.span('highlight'):
+            # And now, the finale, highlight findings in the source image
+            imgMarks = image.copy()
+            obj1Centroids, obj2Centroids = highlightObjectsInImage(contours, hitMissObj1, hitMissObj2, imgMarks,
+                                                                   settings, consoleConsumer, progressConsumer,
+                                                                   progress)
+        if findingsConsumer is not None:
+            findingsConsumer(obj1Centroids, obj2Centroids)
+
+    return objsImg, objsBinaryImg, objsClosingImg, imgBinary, imgClosing, hitMissObj1, hitMissObj2, imgMarks
 
-def runObjectDetection(obj1Image, obj2Image, image, settings, consoleConsumer, progressConsumer):
-    consoleConsumer('Running Object Detection using Morphological Operators...')
+
+def preprocessImage(graph, source, settings, closingStage, consoleConsumer, cancellationToken=NEVER_CANCELLED):
+    """
+    Executes the stages preparing an image for hit & miss: from resizing up to closing
+    :param graph: The StageGraph to execute the stages with
+    :param source: StageOutput of the BGR image
+    :param settings: The settings to use for the algorithm
+    :param closingStage: OBJ_CLOSING_STAGE for objects, IMAGE_CLOSING_STAGE for the image we look in
+    :param consoleConsumer: Used to print messages at the UI layer
+    :param cancellationToken: Checked before the stages. See runObjectDetection
+    :return: StageOutputs of the resized image, the binary image and the closing image
+    """
+    cancellationToken.raiseIfCancelled()
 
     # Make sure objects do not exceed image size
-    obj1Image, obj2Image, image = validateImagesSize(obj1Image, obj2Image, image, settings)
+    resized = graph.run(VALIDATE_SIZE_STAGE, settings, [source])
 
-    # Pre-Processing: Image Contrast Adjustment is done so we can ease edge detection
-    # by gradient, when object edges color is similar to the background color.
-    contrastAdjustmentObj1, contrastAdjustmentObj2, contrastAdjustmentImage = \
-        doImagesContrastAdjustment(obj1Image, obj2Image, image, 1.3)
+    if settings.isGrayFirst:
+        binary = preprocessGrayFirst(graph, resized, settings, consoleConsumer)
+    else:
+        binary = preprocessColor(graph, resized, settings, consoleConsumer)
+
+    # Use Closing, so first we will use Dilation, to fill in the shapes, and then Erosion, to reduce
+    # the shapes to their original size. This way we try to fill in little holes inside objects.
+    closing = graph.run(closingStage, settings, [binary])
 
+    return resized, binary, closing
+
+
+def preprocessColor(graph, resized, settings, consoleConsumer):
+    """
+    Executes the stages from blurring the BGR image up to thresholding it
+    :return: StageOutput of the binary image
+    """
     # Blur image so we will reduce amount of sharp lines, to make it easier for us
     # focusing on objects as whole
-    obj1Blur, obj2Blur, imageBlur = blurImages(contrastAdjustmentObj1,
-                                               contrastAdjustmentObj2,
-                                               contrastAdjustmentImage,
-                                               settings)
+    blur = graph.run(BLUR_STAGE, settings, [resized])
+
+    # Pre-Processing: Image Contrast Adjustment is done so we can ease edge detection
+    # by gradient, when object edges color is similar to the background color.
+    # Gamma is a monotonic pointwise operator, so it commutes with the median blur. Applying it after the
+    # blur has the same outcome, and editing the gamma does not blur again.
+    contrastAdjustment = graph.run(CONTRAST_STAGE, settings, [blur])
 
     # Now convert images to gray, cause object detection is going to be as binary. (black/white)
-    obj1Gray, obj2Gray, imageGray = convertImagesToGray(obj1Blur, obj2Blur, imageBlur)
+    gray = graph.run(GRAY_STAGE, settings, [contrastAdjustment])
 
     # Optional:
     # Perform gradient on the image, so we will transform the image into image of contours,
     # which makes it easier for us to concentrate on objects in an image.
     if settings.isUsingGradientEdgeDetector:
-        obj1Gray, obj2Gray, imageGray = \
-            doImagesGradientEdgeDetection(obj1Gray, obj2Gray, imageGray, consoleConsumer)
+        gray = graph.run(GRADIENT_STAGE, settings, [gray], consoleConsumer=consoleConsumer)
 
     # After the gradient, we get image with contours. Background is black and contours in white.
     # Use threshold to remove non-interesting contours, and leave only those we are interested in,
     # those are the objects.
-    obj1Binary, obj2Binary, imgBinary = doImagesThresholding(obj1Gray, obj2Gray, imageGray, settings)
-
-    # Use Closing, so first we will use Dilation, to fill in the shapes, and then Erosion, to reduce
-    # the shapes to their original size. This way we try to fill in little holes inside objects.
-    obj1Closing, obj2Closing, imgClosing = doImagesClosing(obj1Binary, obj2Binary, imgBinary, settings)
-
-    # This method will iteratively try looking up for the objects in the given image, using
-    # multiple sizes of the objects, depend on settings
-    # Once we gather objects using findNonZero, we can filter them based on hit & miss results
-    hitMissObj1, hitMissObj2, progress = \
-        doHitMiss(imgClosing, obj1Closing, obj2Closing, settings, consoleConsumer, progressConsumer)
-
-    # We use findContours to detect objects.
-    # Then we make our array regular with the grab_contours method
-    contours = cv2.findContours(imgClosing.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    contours = imutils.grab_contours(contours)
-
-    # And now, the finale, highlight findings in the source image
-    imgMarks = image.copy()
-    highlightObjectsInImage(contours, hitMissObj1, hitMissObj2, imgMarks, settings, consoleConsumer,
-                            progressConsumer, progress)
-
-    objsImg = concatenateImages3D(obj1Image, obj2Image)
-    objsBinaryImg = concatenateImages2D(obj1Binary, obj2Binary)
-    objsClosingImg = concatenateImages2D(obj1Closing, obj2Closing)
-
-    return objsImg, objsBinaryImg, objsClosingImg, imgBinary, imgClosing, hitMissObj1, hitMissObj2, imgMarks
+    return runThresholdStage(graph, THRESHOLD_STAGE, gray, settings)
+
+
+def preprocessGrayFirst(graph, resized, settings, consoleConsumer):
+    """
+    Fast mode of preprocessColor (see Settings.isGrayFirst): Convert to gray first, so we blur a single
+    channel rather than three. Without gradient, gamma correction and threshold are applied in a single pass
+    :return: StageOutput of the binary image
+    """
+    gray = graph.run(GRAY_STAGE, settings, [resized])
+    blur = graph.run(BLUR_STAGE, settings, [gray])
+
+    if not settings.isUsingGradientEdgeDetector:
+        return runThresholdStage(graph, CONTRAST_THRESHOLD_STAGE, blur, settings)
+
+    contrastAdjustment = graph.run(CONTRAST_STAGE, settings, [blur])
+    gradient = graph.run(GRADIENT_STAGE, settings, [contrastAdjustment], consoleConsumer=consoleConsumer)
+    return runThresholdStage(graph, THRESHOLD_STAGE, gradient, settings)
+
+
+def runThresholdStage(graph, stage, image, settings):
+    """
+    Executes a threshold stage. Automatic threshold methods select the threshold out of the histograms of the
+    image. Histograms are a stage of their own, so changing the threshold settings costs a lookup table pass only
+    :param graph: The StageGraph to execute the stages with
+    :param stage: THRESHOLD_STAGE or CONTRAST_THRESHOLD_STAGE
+    :param image: StageOutput of the gray-scale image to threshold
+    :param settings: The settings to use for the algorithm
+    :return: StageOutput of the binary image
+    """
+    tileHistograms = None
+    if settings.thresholdMethod != THRESHOLD_METHOD_FIXED:
+        tileHistograms = graph.run(HISTOGRAM_STAGE, settings, [image]).value
+
+    # Histograms are derived from the image, so they are not part of the key of the stage
+    return graph.run(stage, settings, [image], tileHistograms=tileHistograms)
+
+
+def getPreviewShape(imageShape, maxSide=PREVIEW_MAX_SIDE):
+    """
+    :return: imageShape, scaled down (keeping aspect ratio) so its longest side is at most maxSide
+    """
+    scale = min(1.0, maxSide / float(max(imageShape)))
+    return max(1, int(round(imageShape[0] * scale))), max(1, int(round(imageShape[1] * scale)))
+
+
+def runPreview(obj1Image, obj2Image, image, settings, previewShape=None):
+    """
+    Runs the cheap stages of the detection (blur, contrast, grey, gradient, threshold and closing) over
+    a downsampled image, so the effect of the settings can be seen while they are being edited.
+    The hit & miss sweep is skipped. Stage outputs are memoized like in runObjectDetection, so editing a
+    field recomputes the stages depending on it only.
+
+    :param obj1Image: BGR image of the first object
+    :param obj2Image: BGR image of the second object
+    :param image: BGR image to look for the objects in
+    :param settings: The settings to preview
+    :param previewShape: Optional (width, height) to downsample the image to. Default is getPreviewShape
+    :return: A tuple of the images: (objsBinaryImg, objsClosingImg, imgBinary, imgClosing)
+    """
+    settings = settings.snapshot()
+    previewShape = tuple(previewShape or getPreviewShape(settings.imageShape))
+    settings = settings.replace(imageShape=previewShape)
+    graph = StageGraph(stageCache)
+    silent = lambda text: None
+
+    with tracer.span('runPreview'):
+        _, obj1Binary, obj1Closing = preprocessImage(graph, graph.source(obj1Image), settings, OBJ_CLOSING_STAGE,
+                                                     silent)
+        _, obj2Binary, obj2Closing = preprocessImage(graph, graph.source(obj2Image), settings, OBJ_CLOSING_STAGE,
+                                                     silent)
+        image = cv2.resize(image, previewShape, interpolation=cv2.INTER_AREA)
+        _, imgBinary, imgClosing = preprocessImage(graph, graph.source(image), settings, IMAGE_CLOSING_STAGE, silent)
+
+    return concatenateImages2D(obj1Binary.value, obj2Binary.value), \
+           concatenateImages2D(obj1Closing.value, obj2Closing.value), \
+           imgBinary.value, \
+           imgClosing.value
+
+
+def selectBlurBackend(obj1Image, obj2Image, image, settings, tolerancePercent=DEFAULT_BLUR_TOLERANCE_PERCENT,
+                      repeat=DEFAULT_BLUR_BENCHMARK_REPEAT):
+    """
+    Micro-benchmark of the blur backends (see logic.functions.BLUR_BACKENDS) over the specified images.
+    Selects the fastest backend whose binary images stay within the tolerance of those of the median.
+    :param obj1Image: BGR image of the first object
+    :param obj2Image: BGR image of the second object
+    :param image: BGR image to look for the objects in
+    :param settings: The settings to benchmark with. Its blurBackend is ignored
+    :param tolerancePercent: Percentage of the pixels of the binary images a backend may change
+    :param repeat: How many times to time each backend. The median duration is used
+    :return: Tuple (selected backend, list of tuples (backend, median duration in ms, difference percentage))
+    """
+    settings = settings.snapshot()
+    sources = [validateImageSizeCopy(source, settings) for source in (obj1Image, obj2Image, image)]
+    if settings.isGrayFirst:
+        sources = [convertImageToGray(source) for source in sources]
+
+    graph = StageGraph()
+    silent = lambda text: None
+    medianBinaries = None
+    report = []
+    for backend in BLUR_BACKENDS:
+        durations = []
+        for _ in range(repeat):
+            startTime = time.perf_counter()
+            for source in sources:
+                doBlur(source, settings.blurKernelSize, backend)
+            durations.append((time.perf_counter() - startTime) * 1000.0)
+
+        backendSettings = settings.replace(blurBackend=backend)
+        binaries = [preprocessImage(graph, graph.source(original), backendSettings, closingStage, silent)[1].value
+                    for original, closingStage in ((obj1Image, OBJ_CLOSING_STAGE), (obj2Image, OBJ_CLOSING_STAGE),
+                                                   (image, IMAGE_CLOSING_STAGE))]
+
+        # Median is the first backend, it is the one we compare the others with
+        if medianBinaries is None:
+            medianBinaries = binaries
+        differentPixels = sum(np.count_nonzero(binary != medianBinary)
+                              for binary, medianBinary in zip(binaries, medianBinaries))
+        difference = 100.0 * differentPixels / sum(binary.size for binary in binaries)
+        report.append((backend, float(np.median(durations)), difference))
+
+    selected = min((durationMs, backend) for backend, durationMs, difference in report
+                   if difference <= tolerancePercent)[1]
+    return selected, report
 
 
 def validateImageSize(image, settings):
@@ -92,6 +327,12 @@ def validateImagesSize(obj1Image, obj2Image, image, settings):
     return obj1Image, obj2Image, image
 
 
+def validateImageSizeCopy(image, settings):
+    # Stage outputs are kept read-only in the cache, so never return the (caller's) input image itself
+    validImage = validateImageSize(image, settings)
+    return validImage.copy() if validImage is image else validImage
+
+
 def doImagesContrastAdjustment(obj1Image, obj2Image, image, gamma):
     contrastAdjustmentObj1 = doImageContrastAdjustment(obj1Image, gamma)
     contrastAdjustmentObj2 = doImageContrastAdjustment(obj2Image, gamma)
@@ -100,72 +341,127 @@ def doImagesContrastAdjustment(obj1Image, obj2Image, image, gamma):
 
 
 def blurImages(obj1Image, obj2Image, image, settings):
-    obj1Blur = cv2.medianBlur(obj1Image, settings.blurKernelSize)
-    obj2Blur = cv2.medianBlur(obj2Image, settings.blurKernelSize)
-    imageBlur = cv2.medianBlur(image, settings.blurKernelSize)
+    obj1Blur = blurImage(obj1Image, settings)
+    obj2Blur = blurImage(obj2Image, settings)
+    imageBlur = blurImage(image, settings)
     return obj1Blur, obj2Blur, imageBlur
 
 
+def blurImage(image, settings):
+    return doBlur(image, settings.blurKernelSize, settings.blurBackend)
+
+
 def convertImagesToGray(obj1Image, obj2Image, image):
-    obj1Gray = cv2.cvtColor(obj1Image, cv2.COLOR_BGR2GRAY)
-    obj2Gray = cv2.cvtColor(obj2Image, cv2.COLOR_BGR2GRAY)
-    imageGray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    obj1Gray = convertImageToGray(obj1Image)
+    obj2Gray = convertImageToGray(obj2Image)
+    imageGray = convertImageToGray(image)
     return obj1Gray, obj2Gray, imageGray
 
 
-def doImagesGradientEdgeDetection(obj1Image, obj2Image, image, consoleConsumer):
-    obj1Gradient = doGradientEdgeDetection(obj1Image, consoleConsumer)
-    obj2Gradient = doGradientEdgeDetection(obj2Image, consoleConsumer)
-    imageGradient = doGradientEdgeDetection(image, consoleConsumer)
+def convertImageToGray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def doImagesGradientEdgeDetection(obj1Image, obj2Image, image, consoleConsumer, backend=GRADIENT_BACKEND_EXACT):
+    obj1Gradient = doGradientEdgeDetection(obj1Image, consoleConsumer, backend)
+    obj2Gradient = doGradientEdgeDetection(obj2Image, consoleConsumer, backend)
+    imageGradient = doGradientEdgeDetection(image, consoleConsumer, backend)
     return obj1Gradient, obj2Gradient, imageGradient
 
 
 def doImagesThresholding(obj1Image, obj2Image, image, settings):
-    thresholdingType = cv2.THRESH_BINARY
+    obj1Binary = doImageThresholding(obj1Image, settings)
+    obj2Binary = doImageThresholding(obj2Image, settings)
+    imageBinary = doImageThresholding(image, settings)
+    return obj1Binary, obj2Binary, imageBinary
 
-    if settings.isBrightBackground and not settings.isUsingGradientEdgeDetector:
-        thresholdingType = cv2.THRESH_BINARY_INV
 
-    _, obj1Binary = cv2.threshold(obj1Image, settings.threshold1, settings.threshold2, thresholdingType)
-    _, obj2Binary = cv2.threshold(obj2Image, settings.threshold1, settings.threshold2, thresholdingType)
-    _, imageBinary = cv2.threshold(image, settings.threshold1, settings.threshold2, thresholdingType)
+def doImageThresholding(image, settings, tileHistograms=None):
+    return applyThresholdMethod(image, [], settings, tileHistograms)
 
-    return obj1Binary, obj2Binary, imageBinary
+
+def doImageContrastThresholding(image, settings, tileHistograms=None):
+    # Both are pointwise, so they compose into a single lookup table
+    return applyThresholdMethod(image, [gammaOperator(settings.gammaCorrectionValue)], settings, tileHistograms)
+
+
+def applyThresholdMethod(image, operators, settings, tileHistograms=None):
+    """
+    Apply pointwise operators and then the threshold of settings.thresholdMethod, in a single lookup table pass
+    :param image: Gray-scale image
+    :param operators: Pointwise operators to apply before the threshold. See logic.pointwise
+    :param settings: The settings to use for the algorithm
+    :param tileHistograms: Optional. Histograms of the image (before the operators), for the automatic threshold
+    methods. See logic.thresholding.computeTileHistograms. Default builds them
+    :return: The binary image
+    """
+    thresholds = settings.threshold1
+    if settings.thresholdMethod != THRESHOLD_METHOD_FIXED:
+        if tileHistograms is None:
+            tileHistograms = computeTileHistograms(image)
+        tileHistograms = remapHistograms(tileHistograms, getLut(operators))
+        thresholds = findThresholds(tileHistograms, settings.thresholdMethod, settings.threshold1)
+
+    # When background is bright we keep the dark colors, so the background becomes black and objects are white
+    isInverted = settings.isBrightBackground and not settings.isUsingGradientEdgeDetector
+    return applyThresholds(image, operators, thresholds, settings.threshold2, isInverted)
 
 
 def doImagesClosing(obj1Image, obj2Image, image, settings):
-    kernel = np.ones(settings.morphologicalMaskShape, np.uint8)
     obj1Closing = doObjsClosing(obj1Image, settings)
     obj2Closing = doObjsClosing(obj2Image, settings)
-    imageClosing = \
-        cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel, iterations=settings.morphCloseIterationsCount)
+    imageClosing = doImageClosing(image, settings)
+    return obj1Closing, obj2Closing, imageClosing
 
-    # Now use OPEN to discard little noise (1-3 pixels wide elements here and there)
-    imageClosing = \
-        cv2.morphologyEx(imageClosing, cv2.MORPH_OPEN, kernel, iterations=settings.morphOpenIterationsCount)
 
-    return obj1Closing, obj2Closing, imageClosing
+def getClosingIterationsCount(settings):
+    """
+    :return: Iterations of the closing of the binary images. When the holes are filled by reconstruction, the
+    closing only has to bridge little gaps in the edges of the objects
+    """
+    if settings.holeFillMethod == HOLE_FILL_RECONSTRUCTION:
+        return settings.holeFillClosingRadius
+    return settings.morphCloseIterationsCount
 
 
-def doObjsClosing(objImage, settings):
-    kernel = np.ones(settings.morphologicalMaskShape, np.uint8)
+def closeAndFillHoles(image, settings):
+    image = runMorphology(image, [(cv2.MORPH_CLOSE, getClosingIterationsCount(settings))],
+                          settings.morphologicalMaskShape, settings.morphologyBackend)
+    if settings.holeFillMethod == HOLE_FILL_RECONSTRUCTION:
+        image = fillHoles(image)
+    return image
+
+
+def doImageClosing(image, settings):
+    if settings.holeFillMethod == HOLE_FILL_RECONSTRUCTION:
+        # Fill the holes, and then use OPEN to discard little noise
+        return runMorphology(closeAndFillHoles(image, settings),
+                             [(cv2.MORPH_OPEN, settings.morphOpenIterationsCount)],
+                             settings.morphologicalMaskShape, settings.morphologyBackend)
+
+    # Close, and then use OPEN to discard little noise (1-3 pixels wide elements here and there).
+    # The erosion closing ends with and the erosion opening starts with are executed as a single erosion
+    return runMorphology(image,
+                         [(cv2.MORPH_CLOSE, settings.morphCloseIterationsCount),
+                          (cv2.MORPH_OPEN, settings.morphOpenIterationsCount)],
+                         settings.morphologicalMaskShape, settings.morphologyBackend)
 
+
+def doObjsClosing(objImage, settings):
     if not settings.isUsingGradientEdgeDetector and not settings.isBrightBackground:
         # Use OPEN to discard little noise (1-3 pixels wide elements here and there)
-        objImage = \
-            cv2.morphologyEx(objImage, cv2.MORPH_OPEN, kernel, iterations=settings.morphOpenIterationsCount)
+        objImage = runMorphology(objImage, [(cv2.MORPH_OPEN, settings.morphOpenIterationsCount)],
+                                 settings.morphologicalMaskShape, settings.morphologyBackend)
 
     # Before we can dilate the object, we must copy it to a container which has a bigger background area
     # so we will avoid of having the object filling up all of its array bounds.
     objShape = objImage.shape
-    padWidth = settings.morphCloseIterationsCount + 2
+    padWidth = getClosingIterationsCount(settings) + 2
     objImagePadded = np.pad(objImage, padWidth)
 
-    # Now it is safe to do Closing (Dilate & Erode)
-    objClosing = cv2.morphologyEx(objImagePadded,
-                                  cv2.MORPH_CLOSE,
-                                  kernel,
-                                  iterations=settings.morphCloseIterationsCount)
+    # Now it is safe to do Closing (Dilate & Erode). Objects are filled the same way the image is, so their
+    # structuring elements match the objects in the image
+    objClosing = closeAndFillHoles(objImagePadded, settings)
 
     # Now revert back to normal shape
     result = objClosing[padWidth: padWidth + objShape[0], padWidth: padWidth + objShape[1]]
@@ -173,40 +469,28 @@ def doObjsClosing(objImage, settings):
     return result
 
 
-def objectsToHitMissStructuringElement(obj1Closing, obj2Closing, settings, dilateOrErodeWidth):
-    structuringElement1 = objectToHitMissStructuringElement(obj1Closing, settings, dilateOrErodeWidth)
-    structuringElement2 = objectToHitMissStructuringElement(obj2Closing, settings, dilateOrErodeWidth)
-
-    print('\n############### Structuring Element 1 ###############')
-    fullyPrintArray(structuringElement1)
-    print('\n############### Structuring Element 2 ###############')
-    fullyPrintArray(structuringElement2)
-
-    return structuringElement1, structuringElement2
-
-
 def objectToHitMissStructuringElement(obj, settings, dilateOrErodeWidth):
-    kernel = np.ones(settings.morphologicalMaskShape, np.uint8)
+    kernelShape = settings.morphologicalMaskShape
     pad = abs(dilateOrErodeWidth)
 
     # Resizing the object - Decrease
     if dilateOrErodeWidth < 0:
-        obj = cv2.erode(obj, kernel, iterations=pad)
+        obj = runMorphology(obj, [(cv2.MORPH_ERODE, pad)], kernelShape)
         obj = obj[pad: obj.shape[0] - pad, pad: obj.shape[1] - pad]
     # Resizing the object - Increase
     elif dilateOrErodeWidth > 0:
         obj = np.pad(obj, pad)
-        obj = cv2.dilate(obj, kernel, iterations=pad)
+        obj = runMorphology(obj, [(cv2.MORPH_DILATE, pad)], kernelShape)
 
     structuringElementDontCareWidth = settings.structuringElementDontCareWidth
     structuringElement = np.zeros((1, 2))
     while np.count_nonzero(structuringElement >= 127) < 5:
-        structuringElement = cv2.erode(obj, kernel, iterations=structuringElementDontCareWidth)
+        structuringElement = runMorphology(obj, [(cv2.MORPH_ERODE, structuringElementDontCareWidth)], kernelShape)
         structuringElement = np.array(structuringElement, dtype=np.int16)
 
         # In order to avoid of infinite loop, use this check
         if structuringElementDontCareWidth == 1 and np.count_nonzero(structuringElement >= 127) < 5:
-            structuringElement = obj
+            structuringElement = obj.copy()
             break
 
         structuringElementDontCareWidth = int(structuringElementDontCareWidth / 2)
@@ -225,10 +509,36 @@ def objectToHitMissStructuringElement(obj, settings, dilateOrErodeWidth):
 
 
 def doHitMiss(imgClosing, obj1Closing, obj2Closing, settings, consoleConsumer, progressConsumer):
-    # Arrays that will sum up all findings. (Might exceed 255 in case we find an object several times)
-    hitMissObj1 = np.zeros(imgClosing.shape, dtype=np.int64)
-    hitMissObj2 = np.zeros(imgClosing.shape, dtype=np.int64)
-
+    graph = StageGraph()
+    return doHitMissInStageGraph(graph,
+                                 graph.source(imgClosing),
+                                 graph.source(obj1Closing),
+                                 graph.source(obj2Closing),
+                                 settings,
+                                 consoleConsumer,
+                                 progressConsumer)
+
+
+def doHitMissInStageGraph(graph, imgClosing, obj1Closing, obj2Closing, settings, consoleConsumer, progressConsumer,
+                          cancellationToken=NEVER_CANCELLED, templateConsumer=None):
+    """
+    Looks up the objects in the image using hit & miss, with several sizes (scales) and rotations of
+    the objects. The sweep of each object at each scale is a stage, so changing the erode/dilate ranges
+    or one of the objects reuses the sweeps that were not affected.
+    Objects are swept one after the other (all scales of the first object, then the second), so the results
+    of the first object are ready before the second one is swept.
+
+    :param graph: The StageGraph to execute the stages with
+    :param imgClosing: StageOutput of the closing of the image
+    :param obj1Closing: StageOutput of the closing of the first object
+    :param obj2Closing: StageOutput of the closing of the second object
+    :param settings: The settings to use for the algorithm
+    :param consoleConsumer: Used to print messages at the UI layer
+    :param progressConsumer: Used to report progress [0, 100] to the UI layer
+    :param cancellationToken: Checked between scales and angles. See runObjectDetection
+    :param templateConsumer: Optional. Called with (objectIndex, hit & miss result) once an object was swept
+    :return: Tuple of the hit & miss results of both objects (uint8) and the progress
+    """
     consoleConsumer('Running Hit & Miss to detect objects in image...')
 
     # Prepare progress calculation
@@ -237,76 +547,162 @@ def doHitMiss(imgClosing, obj1Closing, obj2Closing, settings, consoleConsumer, p
     totalMorphIterations = float(settings.morphErodeIterationsCount + settings.morphDilateIterationsCount)
     totalSteps = totalMorphIterations * (360.0 / float(settings.objectRotationDegreeInc))
     progressStep = 92 / totalSteps
-
-    for i in range(settings.morphErodeIterationsCount):
-        # Prepare structuring elements out of the objects
-        structuringElement1, structuringElement2 = \
-            objectsToHitMissStructuringElement(obj1Closing, obj2Closing, settings, -i)
-        hitMissObj1Inner, hitMissObj2Inner, progress = doHitMissWithRotation(hitMissObj1,
-                                                                             hitMissObj2,
-                                                                             imgClosing,
-                                                                             settings,
-                                                                             structuringElement1,
-                                                                             structuringElement2,
-                                                                             progressConsumer,
-                                                                             progress,
-                                                                             progressStep)
-        hitMissObj1 += hitMissObj1Inner
-        hitMissObj2 += hitMissObj2Inner
-
-    for i in range(settings.morphDilateIterationsCount):
-        # Prepare structuring elements out of the objects
-        structuringElement1, structuringElement2 = \
-            objectsToHitMissStructuringElement(obj1Closing, obj2Closing, settings, i)
-        hitMissObj1Inner, hitMissObj2Inner, progress = doHitMissWithRotation(hitMissObj1,
-                                                                             hitMissObj2,
-                                                                             imgClosing,
-                                                                             settings,
-                                                                             structuringElement1,
-                                                                             structuringElement2,
-                                                                             progressConsumer,
-                                                                             progress,
-                                                                             progressStep)
-        hitMissObj1 += hitMissObj1Inner
-        hitMissObj2 += hitMissObj2Inner
-
-    hitMissObj1[hitMissObj1 > 255] = 255
-    hitMissObj2[hitMissObj2 > 255] = 255
-    return np.uint8(hitMissObj1), np.uint8(hitMissObj2), progress
-
-
-def doHitMissWithRotation(hitMissObj1,
-                          hitMissObj2,
-                          imgClosing,
-                          settings,
-                          structuringElement1,
-                          structuringElement2,
-                          progressConsumer,
-                          startingProgress,
-                          progressStep):
+    anglesCount = len(np.arange(0, 360, settings.objectRotationDegreeInc))
+
+    # The image is the same for all of the templates, so whatever the backend needs of it is prepared once
+    hitMissScene = None
+    if settings.hitMissBackend != HIT_MISS_BACKEND_OPENCV:
+        hitMissScene = graph.run(HIT_MISS_SCENE_STAGE, settings, [imgClosing]).value
+
+    hitMissResults = []
+    for objectIndex, objClosing in enumerate((obj1Closing, obj2Closing)):
+        perScaleHitMiss = []
+        for scale in getHitMissScales(settings):
+            with tracer.span('hitMissScale', scale=scale, objectIndex=objectIndex):
+                cancellationToken.raiseIfCancelled()
+                hitMiss = graph.run(TEMPLATE_HIT_MISS_STAGE, settings, [imgClosing, objClosing], (scale,),
+                                    progressConsumer=progressConsumer,
+                                    startingProgress=progress,
+                                    progressStep=progressStep / 2,
+                                    cancellationToken=cancellationToken,
+                                    hitMissScene=hitMissScene)
+                perScaleHitMiss.append(hitMiss.value)
+
+                # Each object advances half of the progress step for every angle. (At once when cached)
+                progress += anglesCount * progressStep / 2
+                progressConsumer(progress)
+
+        hitMissResults.append(accumulateHitMiss(perScaleHitMiss))
+        if templateConsumer is not None:
+            templateConsumer(objectIndex, hitMissResults[-1])
+
+    return hitMissResults[0], hitMissResults[1], progress
+
+
+def getHitMissScales(settings):
+    """
+    Scales of the objects to look for. Negative scale means eroded object, positive means dilated.
+    :return: List of scales, in the order of the accumulation
+    """
+    return [-i for i in range(settings.morphErodeIterationsCount)] + \
+           [i for i in range(settings.morphDilateIterationsCount)]
+
+
+def accumulateHitMiss(perScaleHitMiss):
+    """
+    Sum up the hit & miss results of all scales. (Might exceed 255 in case we find an object several times)
+    Every scale adds the findings so far on top of themselves, together with the findings of the scale.
+    :param perScaleHitMiss: List of the hit & miss results of the scales, ordered as getHitMissScales
+    :return: The accumulated results, clipped to uint8
+    """
+    hitMissObj = np.zeros(perScaleHitMiss[0].shape, dtype=np.int64)
+    for scaleHitMiss in perScaleHitMiss:
+        hitMissObj += hitMissObj + scaleHitMiss
+
+    hitMissObj[hitMissObj > 255] = 255
+    return np.uint8(hitMissObj)
+
+
+def prepareHitMissScene(imgClosing, settings):
+    """
+    Prepare the image for the hit & miss backend: the summed-area table of its foreground for 'integral', and its
+    runs for 'rle'. See Settings.hitMissBackend
+    :param imgClosing: The closing of the image to look in
+    :param settings: The settings to use for the algorithm
+    :return: The prepared image
+    """
+    if settings.hitMissBackend == HIT_MISS_BACKEND_INTEGRAL:
+        return computeForegroundIntegral(imgClosing)
+    return RunLengthMask.fromDense(imgClosing)
+
+
+def createHitMissFunction(imgClosing, structuringElement, settings, hitMissScene=None):
+    """
+    :param imgClosing: The closing of the image to look in
+    :param structuringElement: The structuring element, before rotating it
+    :param settings: The settings to use for the algorithm
+    :param hitMissScene: The image, prepared for the backend. See prepareHitMissScene
+    :return: Function from a rotation of the structuring element to the hit & miss result (uint8)
+    """
+    # The backends are identical to cv2 over images of 0 and 255. (cv2 mixes the bits of other foreground values)
+    isSupported = hitMissScene is not None and int(imgClosing.max()) in (0, 255)
+    if not isSupported or settings.hitMissBackend == HIT_MISS_BACKEND_OPENCV:
+        return lambda structuringElementRotated: cv2.morphologyEx(imgClosing, cv2.MORPH_HITMISS,
+                                                                  structuringElementRotated)
+
+    if settings.hitMissBackend == HIT_MISS_BACKEND_INTEGRAL:
+        # A rotation is never bigger than the diagonal of the structuring element
+        margin = int(np.ceil(np.hypot(*structuringElement.shape))) + 1
+        paddedIntegral = padIntegral(hitMissScene, margin)
+        return lambda structuringElementRotated: integralHitMiss(paddedIntegral, margin, imgClosing.shape,
+                                                                 structuringElementRotated)
+
+    return lambda structuringElementRotated: hitMissScene.hitMiss(structuringElementRotated).toDense()
+
+
+def doTemplateHitMiss(imgClosing, objClosing, scale, settings, progressConsumer=None, startingProgress=0,
+                      progressStep=0, cancellationToken=NEVER_CANCELLED, hitMissScene=None):
+    """
+    Hit & miss of a single object at a single scale, over all rotations of the object
+    :param imgClosing: The closing of the image to look in
+    :param objClosing: The closing of the object to look for
+    :param scale: Negative to erode the object, positive to dilate it. See objectToHitMissStructuringElement
+    :param settings: The settings to use for the algorithm
+    :param progressConsumer: Optional. Used to report progress after each rotation
+    :param startingProgress: Progress to start reporting from
+    :param progressStep: Progress of a single rotation
+    :param cancellationToken: Checked before every rotation. See runObjectDetection
+    :param hitMissScene: The image, prepared for the hit & miss backend. See prepareHitMissScene
+    :return: Sum of the hit & miss results of all rotations (int64)
+    """
+    with tracer.span('structuringElement', scale=scale):
+        structuringElement = objectToHitMissStructuringElement(objClosing, settings, scale)
+
+    print('\n############### Structuring Element (Scale {}) ###############'.format(scale))
+    fullyPrintArray(structuringElement)
+
+    with tracer.span('hitMissSweep', scale=scale):
+        hitMissObj, _ = doTemplateHitMissWithRotation(np.zeros(imgClosing.shape, dtype=np.int64),
+                                                      imgClosing,
+                                                      settings,
+                                                      structuringElement,
+                                                      progressConsumer or (lambda progress: None),
+                                                      startingProgress,
+                                                      progressStep,
+                                                      cancellationToken,
+                                                      createHitMissFunction(imgClosing, structuringElement,
+                                                                            settings, hitMissScene))
+    return hitMissObj
+
+
+def doTemplateHitMissWithRotation(hitMissObj,
+                                  imgClosing,
+                                  settings,
+                                  structuringElement,
+                                  progressConsumer,
+                                  startingProgress,
+                                  progressStep,
+                                  cancellationToken=NEVER_CANCELLED,
+                                  hitMissFunction=None):
     progress = startingProgress
+    if hitMissFunction is None:
+        hitMissFunction = createHitMissFunction(imgClosing, structuringElement, settings)
 
     # We might get an empty, or very little structure element when user plays with the erode, using
     # a big erosion
-    checkStructure1 = np.count_nonzero(structuringElement1 == 1) > 4
-    checkStructure2 = np.count_nonzero(structuringElement2 == 1) > 4
+    checkStructure = np.count_nonzero(structuringElement == 1) > 4
 
     # Loop over the rotation angles, ensuring no part of the image is cut off
     for angle in np.arange(0, 360, settings.objectRotationDegreeInc):
-        if checkStructure1:
-            structuringElement1Rotated = imutils.rotate_bound(structuringElement1, angle)
-            hitMissObj1 = \
-                hitMissObj1 + cv2.morphologyEx(imgClosing, cv2.MORPH_HITMISS, structuringElement1Rotated)
-
-        if checkStructure2:
-            structuringElement2Rotated = imutils.rotate_bound(structuringElement2, angle)
-            hitMissObj2 = \
-                hitMissObj2 + cv2.morphologyEx(imgClosing, cv2.MORPH_HITMISS, structuringElement2Rotated)
+        cancellationToken.raiseIfCancelled()
+        if checkStructure:
+            structuringElementRotated = imutils.rotate_bound(structuringElement, angle)
+            hitMissObj = hitMissObj + hitMissFunction(structuringElementRotated)
 
         progress += progressStep
         progressConsumer(progress)
 
-    return hitMissObj1, hitMissObj2, progress
+    return hitMissObj, progress
 
 
 def highlightObjectsInImage(objectContours,
@@ -323,13 +719,15 @@ def highlightObjectsInImage(objectContours,
     hitMissObj2Locations = extractLocations(hitMissObj2, settings)
     obj1Count = 0
     obj2Count = 0
+    obj1Centroids = []
+    obj2Centroids = []
 
     # Prepare progress calculation
     progress = startingProgress
     progressConsumer(progress)
     maxLocations = max(len(hitMissObj1Locations) if hitMissObj1Locations is not None else 1,
                        len(hitMissObj2Locations) if hitMissObj2Locations is not None else 1)
-    totalSteps = len(objectContours) * maxLocations
+    totalSteps = max(1, len(objectContours) * maxLocations)
     progressStep = (100 - startingProgress) / totalSteps
 
     for contour in objectContours:
@@ -351,6 +749,7 @@ def highlightObjectsInImage(objectContours,
             # Get coordinates of minimal enclosing circle so we can get the center point
             ((x, y), _) = cv2.minEnclosingCircle(contour)
             objNumStr = "{}".format(obj1Count if isObj1 else obj2Count)
+            (obj1Centroids if isObj1 else obj2Centroids).append(computeCentroid(contour))
 
             cv2.drawContours(imageToHighlight, [contour], -1, settings.markColor, settings.markThickness)
             cv2.putText(imageToHighlight,
@@ -363,13 +762,27 @@ def highlightObjectsInImage(objectContours,
 
     consoleConsumer('First Object Count: ' + str(obj1Count) + ',  Second Object Count: ' + str(obj2Count))
 
+    return obj1Centroids, obj2Centroids
+
+
+def computeCentroid(contour):
+    """
+    :param contour: Contour of an object
+    :return: The centroid (x, y) of the area of the contour, using moments. Contours with no area (lines)
+    get the center of their minimal enclosing circle
+    """
+    moments = cv2.moments(contour)
+    if moments["m00"] == 0:
+        ((x, y), _) = cv2.minEnclosingCircle(contour)
+        return float(x), float(y)
+    return moments["m10"] / moments["m00"], moments["m01"] / moments["m00"]
+
 
 def extractLocations(hitMissObjResult, settings):
     locations = []
 
     if hitMissObjResult is not None:
-        kernel = np.ones(settings.morphologicalMaskShape, np.uint8)
-        dilated = cv2.dilate(hitMissObjResult, kernel, iterations=2)
+        dilated = runMorphology(hitMissObjResult, [(cv2.MORPH_DILATE, 2)], settings.morphologicalMaskShape)
         contours = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         contours = imutils.grab_contours(contours)
 
@@ -424,3 +837,38 @@ def concatenateImages3D(image1, image2):
     result[rows1 + 20: rows1 + 20 + rows2, : cols2, :] = image2
 
     return result
+
+
+# Stages of the pipeline, with the Settings fields each of them depends on
+VALIDATE_SIZE_STAGE = Stage('validateSize', ('imageShape',), validateImageSizeCopy)
+CONTRAST_STAGE = Stage('contrast',
+                       ('gammaCorrectionValue',),
+                       lambda image, settings: doImageContrastAdjustment(image, settings.gammaCorrectionValue))
+BLUR_STAGE = Stage('blur', ('blurKernelSize', 'blurBackend'), blurImage)
+GRAY_STAGE = Stage('grey', (), lambda image, settings: convertImageToGray(image))
+GRADIENT_STAGE = Stage('gradient',
+                       ('gradientBackend',),
+                       lambda image, settings, consoleConsumer=None: doGradientEdgeDetection(
+                           image, consoleConsumer, settings.gradientBackend))
+HISTOGRAM_STAGE = Stage('histogram', (), lambda image, settings: computeTileHistograms(image))
+THRESHOLD_STAGE = Stage('threshold',
+                        ('threshold1', 'threshold2', 'isBrightBackground', 'isUsingGradientEdgeDetector',
+                         'thresholdMethod'),
+                        doImageThresholding)
+CONTRAST_THRESHOLD_STAGE = Stage('contrastThreshold',
+                                 ('gammaCorrectionValue',) + THRESHOLD_STAGE.settingsFields,
+                                 doImageContrastThresholding)
+OBJ_CLOSING_STAGE = Stage('objClosing',
+                          ('morphologicalMaskShape', 'morphOpenIterationsCount', 'morphCloseIterationsCount',
+                           'isUsingGradientEdgeDetector', 'isBrightBackground', 'morphologyBackend',
+                           'holeFillMethod', 'holeFillClosingRadius'),
+                          doObjsClosing)
+IMAGE_CLOSING_STAGE = Stage('imageClosing',
+                            ('morphologicalMaskShape', 'morphCloseIterationsCount', 'morphOpenIterationsCount',
+                             'morphologyBackend', 'holeFillMethod', 'holeFillClosingRadius'),
+                            doImageClosing)
+HIT_MISS_SCENE_STAGE = Stage('hitMissScene', ('hitMissBackend',), prepareHitMissScene)
+TEMPLATE_HIT_MISS_STAGE = Stage('templateHitMiss',
+                                ('morphologicalMaskShape', 'structuringElementDontCareWidth',
+                                 'objectRotationDegreeInc', 'hitMissBackend'),
+                                doTemplateHitMiss)
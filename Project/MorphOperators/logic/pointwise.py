@@ -0,0 +1,97 @@
+__author__ = "Haim Adrian"
+
+import cv2
+import numpy as np
+
+from util.lrucache import LruCache
+
+# Kinds of pointwise operators. An operator is a hashable tuple: (kind, *parameters)
+GAMMA_OPERATOR = 'gamma'
+THRESHOLD_OPERATOR = 'threshold'
+
+# Lookup tables are 256 bytes each, so we can afford keeping plenty of them
+LUT_CACHE_MAX_ENTRIES = 256
+
+IDENTITY_LUT = np.arange(256, dtype=np.uint8)
+IDENTITY_LUT.flags.writeable = False
+
+# Lookup tables of operators and of chains of operators, keyed by the operators. Shared by all threads
+lutCache = LruCache(maxEntries=LUT_CACHE_MAX_ENTRIES)
+
+
+def gammaOperator(gamma):
+    """
+    Gamma correction. gamma < 1 shifts the image towards the darker end of the spectrum, while gamma > 1
+    makes it lighter. gamma = 1 (or a non positive gamma, which has no meaning) means no affect.
+    :param gamma: The gamma value
+    :return: The operator
+    """
+    return GAMMA_OPERATOR, float(gamma)
+
+
+def thresholdOperator(threshold, maxValue, isInverted=False):
+    """
+    Binary thresholding, as cv2.threshold with THRESH_BINARY (or THRESH_BINARY_INV) does it
+    :param threshold: Values bigger than the threshold are set to maxValue, others to 0. (Opposite when inverted)
+    :param maxValue: The value to set
+    :param isInverted: Whether to use THRESH_BINARY_INV
+    :return: The operator
+    """
+    return THRESHOLD_OPERATOR, int(threshold), int(maxValue), bool(isInverted)
+
+
+def createOperatorLut(operator):
+    """
+    :param operator: A single operator. e.g. gammaOperator(1.3)
+    :return: Lookup table (256 uint8 values) of the operator
+    """
+    kind = operator[0]
+    if kind == GAMMA_OPERATOR:
+        gamma = operator[1]
+        if gamma <= 0 or gamma == 1:
+            return IDENTITY_LUT
+        invGamma = 1.0 / gamma
+        return np.array(((np.arange(256) / 255.0) ** invGamma) * 255.0, dtype=np.uint8)
+
+    if kind == THRESHOLD_OPERATOR:
+        _, threshold, maxValue, isInverted = operator
+        isAbove = np.arange(256) > threshold
+        return np.where(isAbove != isInverted, min(255, maxValue), 0).astype(np.uint8)
+
+    raise ValueError('Unknown pointwise operator: {}'.format(operator))
+
+
+def getLut(operators):
+    """
+    Get the lookup table of a chain of operators. Consecutive pointwise operators compose into a single lookup
+    table, so the whole chain is applied in one pass over the image.
+    :param operators: Sequence of operators, applied first to last
+    :return: The lookup table (read-only)
+    """
+    operators = tuple(operators)
+    if not operators:
+        return IDENTITY_LUT
+
+    lut = lutCache.get(operators)
+    if lut is None:
+        if len(operators) == 1:
+            lut = createOperatorLut(operators[0]).copy()
+        else:
+            # Apply the last operator on the outcome of the others
+            lut = getLut(operators[-1:])[getLut(operators[:-1])]
+        lut.flags.writeable = False
+
+        # Two threads might calculate the same table at once. It is the same table, so it does not matter
+        lutCache.put(operators, lut)
+
+    return lut
+
+
+def applyPointwise(image, operators):
+    """
+    Apply a chain of pointwise operators on an image, in a single cv2.LUT pass
+    :param image: uint8 image. (Any amount of channels)
+    :param operators: Sequence of operators, applied first to last
+    :return: The new image
+    """
+    return cv2.LUT(image, getLut(operators))
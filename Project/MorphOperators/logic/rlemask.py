@@ -0,0 +1,309 @@
+__author__ = "Haim Adrian"
+
+import numpy as np
+
+# Rectangles of that many rows or more are dilated by their row and then by their column. Shorter kernels are
+# cheaper to dilate by all of their rows at once
+SEPARABLE_MIN_ROWS = 8
+
+
+def runsToGlobal(rows, starts, ends, stride):
+    """
+    Place the runs of all rows on a single axis, where row r starts at r * stride. A stride bigger than the
+    width keeps a gap between the rows, so runs of different rows never touch each other
+    :return: Tuple (global starts, global ends)
+    """
+    offsets = rows * stride
+    return offsets + starts, offsets + ends
+
+
+def mergeRuns(shape, rows, starts, ends):
+    """
+    Clip runs to the bounds of an image, and merge runs which overlap or touch each other
+    :param shape: Shape of the image (rows, columns)
+    :param rows: Row of every run
+    :param starts: First column of every run
+    :param ends: Column after the last one of every run
+    :return: Tuple (rows, starts, ends), sorted by row and then by start
+    """
+    height, width = shape
+    starts = np.maximum(starts, 0)
+    ends = np.minimum(ends, width)
+    isValid = (rows >= 0) & (rows < height) & (starts < ends)
+    if not np.all(isValid):
+        rows, starts, ends = rows[isValid], starts[isValid], ends[isValid]
+    if rows.size == 0:
+        return rows, starts, ends
+
+    stride = width + 1
+    globalStarts, globalEnds = runsToGlobal(rows, starts, ends, stride)
+    order = np.argsort(globalStarts, kind='stable')
+    globalStarts = globalStarts[order]
+    globalEnds = np.maximum.accumulate(globalEnds[order])
+
+    # A run opens a new group unless it starts before (or where) the runs before it end
+    isFirst = np.empty(globalStarts.size, dtype=bool)
+    isFirst[0] = True
+    isFirst[1:] = globalStarts[1:] > globalEnds[:-1]
+    isLast = np.empty_like(isFirst)
+    isLast[:-1] = isFirst[1:]
+    isLast[-1] = True
+
+    globalStarts = globalStarts[isFirst]
+    globalEnds = globalEnds[isLast]
+    rows = globalStarts // stride
+    return rows, globalStarts - rows * stride, globalEnds - rows * stride
+
+
+def kernelSegments(kernel, anchor=None):
+    """
+    Decompose a kernel into horizontal segments of its non-zero cells
+    :param kernel: The kernel (2D array). Non-zero cells are part of it
+    :param anchor: Anchor (x, y) of the kernel. None means its center, as cv2 does
+    :return: Tuple (row offsets, first column offsets, last column offsets), relative to the anchor
+    """
+    kernel = np.asarray(kernel)
+    if anchor is None or anchor == (-1, -1):
+        anchor = (kernel.shape[1] // 2, kernel.shape[0] // 2)
+    segments = RunLengthMask.fromDense(kernel)
+    return segments.rows - anchor[1], segments.starts - anchor[0], segments.ends - 1 - anchor[0]
+
+
+class RunLengthMask(object):
+    """
+    A binary image, stored as the runs of its foreground pixels along the rows. Every run is (row, start, end),
+    where end is the column after the last pixel of the run. Runs are sorted, and never touch each other.
+    Operations cost in proportion to the amount of runs, and not to the area of the image, so masks of a few
+    objects over a big background are cheap. Morphology follows the border semantics of cv2: pixels outside of
+    the image are ignored by erosions and dilations.
+    """
+
+    def __init__(self, shape, rows=None, starts=None, ends=None, isMerged=False):
+        """
+        Constructs a new RunLengthMask
+        :param shape: Shape of the image (rows, columns)
+        :param rows: Row of every run. None means an empty mask
+        :param starts: First column of every run
+        :param ends: Column after the last one of every run
+        :param isMerged: Whether the runs are already clipped, sorted and merged. See mergeRuns
+        """
+        self.shape = (int(shape[0]), int(shape[1]))
+        if rows is None:
+            rows = starts = ends = np.zeros(0, dtype=np.int64)
+        rows, starts, ends = (np.asarray(values, dtype=np.int64) for values in (rows, starts, ends))
+        if not isMerged:
+            rows, starts, ends = mergeRuns(self.shape, rows, starts, ends)
+        self.rows = rows
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return self.rows.size
+
+    def __eq__(self, other):
+        return isinstance(other, RunLengthMask) and self.shape == other.shape and \
+               np.array_equal(self.rows, other.rows) and np.array_equal(self.starts, other.starts) and \
+               np.array_equal(self.ends, other.ends)
+
+    def __repr__(self):
+        return 'RunLengthMask(shape={}, runs={}, area={})'.format(self.shape, len(self), self.area)
+
+    @property
+    def lengths(self):
+        return self.ends - self.starts
+
+    @property
+    def nbytes(self):
+        """
+        :return: Size (bytes) of the buffers of the runs. See util.lrucache.sizeOf
+        """
+        return self.rows.nbytes + self.starts.nbytes + self.ends.nbytes
+
+    @property
+    def area(self):
+        """
+        :return: Amount of foreground pixels
+        """
+        return int(self.lengths.sum())
+
+    @staticmethod
+    def fromDense(binary):
+        """
+        Encode a dense image. This is the only operation which passes over the whole image
+        :param binary: 2D image. Non-zero pixels are foreground
+        :return: The mask
+        """
+        height, width = np.shape(binary)
+        # Background columns around every row, so every run starts and ends with a change between two pixels,
+        # and the changes alternate: start, end, start, end...
+        stride = width + 2
+        isForeground = np.zeros((height, stride), dtype=bool)
+        np.not_equal(binary, 0, out=isForeground[:, 1:-1])
+        flat = isForeground.ravel()
+        changes = np.flatnonzero(flat[1:] != flat[:-1])
+
+        rows = changes[0::2] // stride
+        rowOffsets = rows * stride
+        return RunLengthMask((height, width), rows, changes[0::2] - rowOffsets, changes[1::2] - rowOffsets,
+                             isMerged=True)
+
+    def toDense(self, values=255, dtype=np.uint8):
+        """
+        Decode the mask into a dense image. Only the foreground pixels are written, besides clearing the image
+        :param values: Value of the foreground pixels. A single value, or a value per run (e.g. labels)
+        :param dtype: Type of the image
+        :return: The image
+        """
+        dense = np.zeros(self.shape, dtype=dtype)
+        runValues = np.broadcast_to(values, self.rows.shape).tolist()
+        for row, start, end, value in zip(self.rows.tolist(), self.starts.tolist(), self.ends.tolist(), runValues):
+            dense[row, start:end] = value
+        return dense
+
+    def complement(self):
+        """
+        :return: Mask of the background pixels. It has at most one run per row more than this mask has
+        """
+        height, width = self.shape
+        # Every row gets an empty run at its end, so the gap after its last run (or the whole row) is included
+        rows = np.concatenate((self.rows, np.arange(height, dtype=np.int64)))
+        starts = np.concatenate((self.starts, np.full(height, width, dtype=np.int64)))
+        ends = np.concatenate((self.ends, np.full(height, width, dtype=np.int64)))
+        order = np.argsort(rows * (width + 1) + starts, kind='stable')
+        rows, starts, ends = rows[order], starts[order], ends[order]
+
+        # A gap spans from the end of the previous run in the row (or the start of the row) to the next run
+        gapStarts = np.zeros_like(starts)
+        isSameRow = rows[1:] == rows[:-1]
+        gapStarts[1:][isSameRow] = ends[:-1][isSameRow]
+        isGap = gapStarts < starts
+        return RunLengthMask(self.shape, rows[isGap], gapStarts[isGap], starts[isGap], isMerged=True)
+
+    def union(self, other):
+        return RunLengthMask(self.shape,
+                             np.concatenate((self.rows, other.rows)),
+                             np.concatenate((self.starts, other.starts)),
+                             np.concatenate((self.ends, other.ends)))
+
+    def intersection(self, other):
+        return self.complement().union(other.complement()).complement()
+
+    def difference(self, other):
+        """
+        :return: Mask of the pixels of this mask, which are not in the other mask
+        """
+        return self.complement().union(other).complement()
+
+    def dilateSegments(self, rowOffsets, firstColumnOffsets, lastColumnOffsets):
+        """
+        Dilate by a kernel made of horizontal segments: pixel (y, x) is set when pixel (y + dy, x + dx) is set,
+        for any segment (dy, first dx, last dx) and any dx in between
+        :return: The dilated mask
+        """
+        if len(rowOffsets) == 0:
+            return RunLengthMask(self.shape)
+
+        # Every run is shifted by every segment, and stretched by its length
+        rows = (self.rows[np.newaxis, :] - np.asarray(rowOffsets)[:, np.newaxis]).ravel()
+        starts = (self.starts[np.newaxis, :] - np.asarray(lastColumnOffsets)[:, np.newaxis]).ravel()
+        ends = (self.ends[np.newaxis, :] - np.asarray(firstColumnOffsets)[:, np.newaxis]).ravel()
+        return RunLengthMask(self.shape, rows, starts, ends)
+
+    def dilateRows(self, firstRowOffset, lastRowOffset):
+        """
+        Dilate by a single column: pixel (y, x) is set when pixel (y + dy, x) is set, for any dy in the range.
+        Every union doubles the offsets covered, so it takes a logarithmic amount of unions, and not one per row
+        :return: The dilated mask
+        """
+        # Rows are shifted down from the lowest offset. Rows above the image may still be shifted into it, so
+        # the mask has a margin of span rows above the image meanwhile
+        span = lastRowOffset - firstRowOffset
+        height, width = self.shape
+        mask = RunLengthMask((height + span, width), self.rows - lastRowOffset + span, self.starts, self.ends)
+        coveredOffsets = 1
+        while coveredOffsets <= span:
+            step = min(coveredOffsets, span + 1 - coveredOffsets)
+            mask = mask.union(RunLengthMask(mask.shape, mask.rows + step, mask.starts, mask.ends, isMerged=True))
+            coveredOffsets += step
+        return RunLengthMask(self.shape, mask.rows - span, mask.starts, mask.ends)
+
+    def dilate(self, kernel, anchor=None):
+        """
+        Same as cv2.dilate with a single iteration. A tall rectangle is dilated by its row, and then by its column
+        :param kernel: The kernel (2D array). Non-zero cells are part of it
+        :param anchor: Anchor (x, y) of the kernel. None means its center
+        :return: The dilated mask
+        """
+        kernel = np.asarray(kernel)
+        if kernel.shape[0] >= SEPARABLE_MIN_ROWS and np.all(kernel):
+            rowOffsets, firstColumnOffsets, lastColumnOffsets = kernelSegments(kernel, anchor)
+            return self.dilateSegments(rowOffsets[:1] * 0, firstColumnOffsets[:1], lastColumnOffsets[:1]) \
+                .dilateRows(rowOffsets[0], rowOffsets[-1])
+        return self.dilateSegments(*kernelSegments(kernel, anchor))
+
+    def erode(self, kernel, anchor=None):
+        """
+        Same as cv2.erode with a single iteration. Eroding the foreground is dilating the background, and pixels
+        outside of the image are background of the complement, so they are ignored as cv2 ignores them
+        :param kernel: The kernel (2D array). Non-zero cells are part of it
+        :param anchor: Anchor (x, y) of the kernel. None means its center
+        :return: The eroded mask
+        """
+        return self.complement().dilate(kernel, anchor).complement()
+
+    def hitMiss(self, structuringElement):
+        """
+        Same as cv2.MORPH_HITMISS: the foreground must cover the hit cells, and must not touch the miss cells
+        :param structuringElement: 2D array. 1 means hit, -1 means miss and 0 means don't care
+        :return: Mask of the pixels where the structuring element fits
+        """
+        structuringElement = np.asarray(structuringElement)
+        if not np.any(structuringElement):
+            # cv2 leaves the image as is when nothing is tested
+            return self
+        hits = self.erode(structuringElement == 1)
+        return hits.difference(self.dilate(structuringElement == -1))
+
+    def findOverlappingRuns(self, connectivity):
+        """
+        :param connectivity: 8 or 4, as cv2 gets it
+        :return: Tuple of two arrays (run indices, run indices in the next row which touch them)
+        """
+        # With a stride of width + 2, stretching a run by one pixel never reaches the runs of another row
+        stride = self.shape[1] + 2
+        reach = 1 if connectivity == 8 else 0
+        globalStarts, globalEnds = runsToGlobal(self.rows, self.starts, self.ends, stride)
+        nextRowOffsets = (self.rows + 1) * stride
+
+        # Runs of the next row which end after this run starts and start before this run ends
+        first = np.searchsorted(globalEnds, nextRowOffsets + self.starts - reach, side='right')
+        last = np.searchsorted(globalStarts, nextRowOffsets + self.ends + reach, side='left')
+        counts = np.maximum(last - first, 0)
+        runs = np.repeat(np.arange(len(self)), counts)
+        firstOfRuns = np.repeat(first - (np.cumsum(counts) - counts), counts)
+        return runs, firstOfRuns + np.arange(int(counts.sum()))
+
+    def labelComponents(self, connectivity=8):
+        """
+        Label the connected components. The components are those of cv2.connectedComponents, numbered by their
+        first pixel in raster order (as cv2 numbers 4-connected components. Its 8-connected numbering may differ)
+        :param connectivity: 8 or 4
+        :return: Tuple (amount of components, label of every run). Labels start at 1, 0 is the background
+        """
+        runs, touchingRuns = self.findOverlappingRuns(connectivity)
+
+        # Every run takes the smallest run index of its component. Runs are in raster order, so the smallest
+        # index is the first run of the component
+        labels = np.arange(len(self))
+        while True:
+            smallest = np.minimum(labels[runs], labels[touchingRuns])
+            newLabels = labels.copy()
+            np.minimum.at(newLabels, runs, smallest)
+            np.minimum.at(newLabels, touchingRuns, smallest)
+            newLabels = newLabels[newLabels]
+            if np.array_equal(newLabels, labels):
+                break
+            labels = newLabels
+
+        roots, labels = np.unique(labels, return_inverse=True)
+        return roots.size, labels + 1
@@ -0,0 +1,119 @@
+__author__ = "Haim Adrian"
+
+import unittest
+
+import cv2
+import numpy as np
+
+from logic.binaryimagetestcase import BinaryImageTestCase, ELEMENT_SHAPES, IMAGE_SHAPES, randomBinaryImage
+from logic.morphology import MORPHOLOGY_BACKEND_OPENCV, MORPHOLOGY_BACKEND_RLE, runMorphology
+from logic.rlemask import RunLengthMask
+
+CASES_PER_SHAPE = 3
+
+
+def randomKernel(randomState, shape):
+    """
+    :return: A kernel of 0 and 1 with at least one cell. cv2 replaces empty kernels by a default one
+    """
+    kernel = np.uint8(randomState.random_sample(shape) < 0.6)
+    kernel[randomState.randint(shape[0]), randomState.randint(shape[1])] = 1
+    return kernel
+
+
+def randomStructuringElement(randomState, shape):
+    return randomState.randint(-1, 2, size=shape)
+
+
+class RunLengthMaskTest(BinaryImageTestCase):
+    seed = 49
+
+    def testDenseRoundTrip(self):
+        for image in self.randomImages():
+            mask = RunLengthMask.fromDense(image)
+            self.assertImagesEqual(image, mask.toDense())
+            self.assertEqual(np.count_nonzero(image), mask.area)
+
+    def testSetOperations(self):
+        for shape in IMAGE_SHAPES:
+            first = randomBinaryImage(self.randomState, shape)
+            second = randomBinaryImage(self.randomState, shape)
+            firstMask, secondMask = RunLengthMask.fromDense(first), RunLengthMask.fromDense(second)
+            self.assertImagesEqual(cv2.bitwise_not(first), firstMask.complement().toDense())
+            self.assertImagesEqual(cv2.bitwise_or(first, second), firstMask.union(secondMask).toDense())
+            self.assertImagesEqual(cv2.bitwise_and(first, second), firstMask.intersection(secondMask).toDense())
+            self.assertImagesEqual(cv2.bitwise_and(first, cv2.bitwise_not(second)),
+                                   firstMask.difference(secondMask).toDense())
+
+    def testErodeAndDilate(self):
+        for image in self.randomImages():
+            mask = RunLengthMask.fromDense(image)
+            for kernelShape in ELEMENT_SHAPES:
+                for _ in range(CASES_PER_SHAPE):
+                    kernel = randomKernel(self.randomState, kernelShape)
+                    message = 'image {}, kernel\n{}'.format(image.shape, kernel)
+                    self.assertImagesEqual(cv2.erode(image, kernel), mask.erode(kernel).toDense(), message)
+                    self.assertImagesEqual(cv2.dilate(image, kernel), mask.dilate(kernel).toDense(), message)
+
+    def testSeparableRectangles(self):
+        # Tall rectangles are dilated by their row and then by their column
+        for image in self.randomImages():
+            mask = RunLengthMask.fromDense(image)
+            for kernelShape in ((8, 1), (8, 5), (11, 4), (20, 20)):
+                kernel = np.ones(kernelShape, np.uint8)
+                self.assertImagesEqual(cv2.erode(image, kernel), mask.erode(kernel).toDense())
+                self.assertImagesEqual(cv2.dilate(image, kernel), mask.dilate(kernel).toDense())
+
+    def testAnchors(self):
+        image = randomBinaryImage(self.randomState, (30, 30))
+        mask = RunLengthMask.fromDense(image)
+        kernel = np.ones((4, 6), np.uint8)
+        for anchor in ((0, 0), (5, 3), (2, 1)):
+            self.assertImagesEqual(cv2.erode(image, kernel, anchor=anchor), mask.erode(kernel, anchor).toDense())
+            self.assertImagesEqual(cv2.dilate(image, kernel, anchor=anchor), mask.dilate(kernel, anchor).toDense())
+
+    def testHitMiss(self):
+        for image in self.randomImages():
+            mask = RunLengthMask.fromDense(image)
+            for elementShape in ELEMENT_SHAPES + ((45, 45),):
+                for _ in range(CASES_PER_SHAPE):
+                    structuringElement = randomStructuringElement(self.randomState, elementShape)
+                    self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                           mask.hitMiss(structuringElement).toDense(),
+                                           'image {}, element\n{}'.format(image.shape, structuringElement))
+
+    def testHitMissWithoutCells(self):
+        # Nothing is tested, and cv2 leaves the image as is
+        for image in self.randomImages():
+            structuringElement = np.zeros((3, 4), int)
+            self.assertImagesEqual(cv2.morphologyEx(image, cv2.MORPH_HITMISS, structuringElement),
+                                   RunLengthMask.fromDense(image).hitMiss(structuringElement).toDense())
+
+    def testLabelComponents(self):
+        for image in self.randomImages():
+            mask = RunLengthMask.fromDense(image)
+            for connectivity in (4, 8):
+                expectedCount, expectedLabels = cv2.connectedComponents(image, connectivity=connectivity)
+                count, runLabels = mask.labelComponents(connectivity)
+                labels = mask.toDense(runLabels, np.int32)
+                self.assertEqual(expectedCount - 1, count)
+
+                # Same partition of the foreground, whatever the numbering
+                pairs = set(zip(expectedLabels[image > 0].tolist(), labels[image > 0].tolist()))
+                self.assertEqual(count, len(pairs))
+                self.assertEqual(count, len(set(label for _, label in pairs)))
+
+    def testRunMorphology(self):
+        operations = [(cv2.MORPH_CLOSE, 3), (cv2.MORPH_OPEN, 2), (cv2.MORPH_DILATE, 1)]
+        for image in self.randomImages():
+            for kernelShape in ((3, 3), (2, 4), (5, 5)):
+                self.assertImagesEqual(runMorphology(image, operations, kernelShape, MORPHOLOGY_BACKEND_OPENCV),
+                                       runMorphology(image, operations, kernelShape, MORPHOLOGY_BACKEND_RLE))
+
+    def testNbytes(self):
+        mask = RunLengthMask.fromDense(randomBinaryImage(self.randomState, (40, 40)))
+        self.assertEqual(3 * len(mask) * 8, mask.nbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+__author__ = "Haim Adrian"
+
+import hashlib
+
+import numpy as np
+
+from util.tracing import tracer
+
+
+class Stage(object):
+    """
+    A step of the pipeline. A stage declares which Settings fields its output depends on, so we can
+    memoize the output by its inputs and those fields only.
+    """
+
+    def __init__(self, name, settingsFields, function):
+        """
+        Constructs a new Stage
+        :param name: Name of the stage. Used in the memoization key and as the name of its tracer span,
+        so it must be unique
+        :param settingsFields: Names of the Settings fields the output of the stage depends on
+        :param function: The function of the stage. It is called with the values of the inputs, then the
+        arguments, then the settings, then the side arguments. See StageGraph.run
+        """
+        self.name = name
+        self.settingsFields = tuple(settingsFields)
+        self.function = function
+
+    def settingsKey(self, settings):
+        """
+        :param settings: util.settings.SettingsSnapshot (or Settings, which is snapshotted first)
+        :return: Fingerprint of the settings fields of the stage
+        """
+        return settings.snapshot().subFingerprint(self.settingsFields)
+
+
+class StageOutput(object):
+    """
+    Output of a stage (or a source image), along with the key identifying it.
+    The key of an output is derived from the keys of its inputs, so we hash source images only.
+    """
+    __slots__ = ('key', 'value')
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+
+def imageHash(image):
+    """
+    :return: A digest identifying the content, shape and type of an image
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(image.data, digest_size=16).hexdigest()
+    return digest, image.shape, image.dtype.str
+
+
+def makeReadOnly(value):
+    """
+    Cached outputs are shared between runs, so we make sure nobody modifies them by mistake
+    """
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        for element in value:
+            makeReadOnly(element)
+    return value
+
+
+class StageGraph(object):
+    """
+    Executes stages, memoizing their outputs in a cache keyed by (stage, input keys, arguments, settings
+    fields of the stage). Re-running after a settings change recomputes the stages depending on the
+    changed fields, and everything downstream of them, only.
+    A graph without a cache executes every stage, and does not hash its sources.
+    """
+
+    def __init__(self, cache=None):
+        """
+        :param cache: util.lrucache.LruCache used to memoize stage outputs. None disables memoization
+        """
+        self.cache = cache
+
+    def source(self, image):
+        """
+        Wrap an input image so it can be used as an input of stages
+        :param image: The image
+        :return: StageOutput of the image
+        """
+        return StageOutput(('source', imageHash(image)) if self.cache is not None else None, image)
+
+    @staticmethod
+    def createKey(stage, settings, inputs, arguments=()):
+        """
+        :return: The key the output of a stage is memoized by. See run
+        """
+        return stage.name, tuple(i.key for i in inputs), tuple(arguments), stage.settingsKey(settings)
+
+    def run(self, stage, settings, inputs, arguments=(), **sideArguments):
+        """
+        Execute a stage, or fetch its output from the cache
+        :param stage: The Stage to execute
+        :param settings: The settings to execute the stage with
+        :param inputs: List of StageOutput, whose values are the first arguments of the stage function
+        :param arguments: Hashable arguments passed after the inputs. They are part of the key
+        :param sideArguments: Keyword arguments that do not affect the output. e.g. progress consumers
+        :return: StageOutput of the stage
+        """
+        if self.cache is None:
+            with tracer.span(stage.name):
+                value = stage.function(*[i.value for i in inputs], *arguments, settings, **sideArguments)
+            return StageOutput(None, value)
+
+        key = self.createKey(stage, settings, inputs, arguments)
+        value = self.cache.get(key)
+        if value is None:
+            with tracer.span(stage.name):
+                value = stage.function(*[i.value for i in inputs], *arguments, settings, **sideArguments)
+            self.cache.put(key, makeReadOnly(value))
+
+        return StageOutput(key, value)
@@ -0,0 +1,180 @@
+__author__ = "Haim Adrian"
+
+import cv2
+import numpy as np
+
+from logic.pointwise import IDENTITY_LUT, getLut, thresholdOperator
+
+# Ways to select the threshold. See findThresholds
+THRESHOLD_METHOD_FIXED = 'fixed'  # Settings.threshold1. The original behaviour
+THRESHOLD_METHOD_OTSU = 'otsu'  # Maximal variance between the two classes, as cv2.THRESH_OTSU
+THRESHOLD_METHOD_TRIANGLE = 'triangle'  # Farthest level from the peak-to-tail line, as cv2.THRESH_TRIANGLE
+THRESHOLD_METHOD_ADAPTIVE = 'adaptive'  # Otsu of every tile, so lighting may change across the image
+THRESHOLD_METHODS = (THRESHOLD_METHOD_FIXED, THRESHOLD_METHOD_OTSU, THRESHOLD_METHOD_TRIANGLE,
+                     THRESHOLD_METHOD_ADAPTIVE)
+
+# Grid of tiles (rows, columns) we keep histograms of
+HISTOGRAM_TILES = (4, 4)
+
+# A tile whose two Otsu classes are closer than that (gray levels) holds a single class, e.g. background only.
+# Splitting it would turn its noise into objects, so it uses the threshold of the whole image
+ADAPTIVE_MIN_CONTRAST = 24
+
+
+def getTileBounds(shape, tiles=HISTOGRAM_TILES):
+    """
+    :param shape: Shape of the image
+    :param tiles: Amount of tiles (rows, columns)
+    :return: Two lists of (start, end) tuples: bounds of the rows and bounds of the columns
+    """
+    rowEdges = np.linspace(0, shape[0], min(tiles[0], shape[0]) + 1).astype(int)
+    columnEdges = np.linspace(0, shape[1], min(tiles[1], shape[1]) + 1).astype(int)
+    return list(zip(rowEdges[:-1], rowEdges[1:])), list(zip(columnEdges[:-1], columnEdges[1:]))
+
+
+def computeTileHistograms(image, tiles=HISTOGRAM_TILES):
+    """
+    Build the gray level histograms of the tiles of an image, in a single pass over the image.
+    The histogram of the whole image is the sum of those of the tiles.
+    :param image: Gray-scale image (uint8)
+    :param tiles: Amount of tiles (rows, columns). Small images have less tiles
+    :return: Array of shape (tile rows, tile columns, 256)
+    """
+    rowBounds, columnBounds = getTileBounds(image.shape, tiles)
+    histograms = np.empty((len(rowBounds), len(columnBounds), 256), dtype=np.int64)
+    for row, (top, bottom) in enumerate(rowBounds):
+        for column, (left, right) in enumerate(columnBounds):
+            histograms[row, column] = np.bincount(image[top:bottom, left:right].ravel(), minlength=256)
+    return histograms
+
+
+def remapHistograms(histograms, lut):
+    """
+    Histograms of the image after applying a lookup table on it, without passing over the image again
+    :param histograms: Array of histograms. The last axis is the gray levels (256)
+    :param lut: The lookup table (256 uint8 values)
+    :return: The remapped histograms
+    """
+    if lut is IDENTITY_LUT:
+        return histograms
+    mapping = np.zeros((256, 256), dtype=np.int64)
+    mapping[np.arange(256), lut] = 1
+    return histograms @ mapping
+
+
+def otsuThreshold(histogram):
+    """
+    Otsu's threshold: the one maximizing the variance between the two classes. Same as cv2.THRESH_OTSU
+    :param histogram: Histogram (256 counts)
+    :return: Tuple (threshold, contrast). Contrast is the distance between the means of the two classes
+    """
+    total = histogram.sum()
+    if total == 0:
+        return 0, 0.0
+
+    levels = np.arange(256)
+    probabilities = histogram / total
+    q1 = np.cumsum(probabilities)
+    q2 = 1.0 - q1
+    m1 = np.cumsum(levels * probabilities)
+    mean = m1[-1]
+
+    # Thresholds leaving one of the classes empty are skipped, as OpenCV does
+    epsilon = np.finfo(np.float32).eps
+    isValid = (np.minimum(q1, q2) >= epsilon) & (np.maximum(q1, q2) <= 1 - epsilon)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu1 = m1 / q1
+        mu2 = (mean - m1) / q2
+        sigma = np.where(isValid, q1 * q2 * (mu1 - mu2) ** 2, 0)
+
+    threshold = int(np.argmax(sigma))
+    if sigma[threshold] <= 0:
+        return 0, 0.0
+    return threshold, float(mu2[threshold] - mu1[threshold])
+
+
+def triangleThreshold(histogram):
+    """
+    Triangle threshold: the level farthest from the line between the peak of the histogram and its longer
+    tail. Suits histograms of a single dominant class, e.g. a big background. Same as cv2.THRESH_TRIANGLE
+    :param histogram: Histogram (256 counts)
+    :return: The threshold
+    """
+    nonZero = np.flatnonzero(histogram)
+    if nonZero.size == 0:
+        return 0
+
+    leftBound = max(0, int(nonZero[0]) - 1)
+    rightBound = min(255, int(nonZero[-1]) + 1)
+    maxIndex = int(np.argmax(histogram))
+
+    # Work on the side of the longer tail. Flip the histogram when the tail is to the right of the peak
+    isFlipped = maxIndex - leftBound < rightBound - maxIndex
+    if isFlipped:
+        histogram = histogram[::-1]
+        leftBound = 255 - rightBound
+        maxIndex = 255 - maxIndex
+
+    threshold = leftBound
+    if maxIndex > leftBound:
+        levels = np.arange(leftBound + 1, maxIndex + 1)
+        # Proportional to the distance of every (level, count) from the line between the tail and the peak
+        distances = int(histogram[maxIndex]) * levels + (leftBound - maxIndex) * histogram[levels].astype(np.int64)
+        best = int(np.argmax(distances))
+        if distances[best] > 0:
+            threshold = int(levels[best])
+    threshold -= 1
+
+    return 255 - threshold if isFlipped else threshold
+
+
+def findThresholds(histograms, method, fixedThreshold):
+    """
+    Select the thresholds of an image, out of the histograms of its tiles
+    :param histograms: Tile histograms. See computeTileHistograms
+    :param method: One of THRESHOLD_METHODS
+    :param fixedThreshold: The threshold of THRESHOLD_METHOD_FIXED
+    :return: A single threshold, or an array of thresholds, one per tile, for THRESHOLD_METHOD_ADAPTIVE
+    """
+    if method == THRESHOLD_METHOD_FIXED:
+        return fixedThreshold
+
+    histogram = histograms.sum(axis=(0, 1))
+    if method == THRESHOLD_METHOD_TRIANGLE:
+        return triangleThreshold(histogram)
+
+    threshold, _ = otsuThreshold(histogram)
+    if method != THRESHOLD_METHOD_ADAPTIVE:
+        return threshold
+
+    thresholds = np.full(histograms.shape[:2], threshold, dtype=np.int32)
+    for row in range(histograms.shape[0]):
+        for column in range(histograms.shape[1]):
+            tileThreshold, contrast = otsuThreshold(histograms[row, column])
+            if contrast >= ADAPTIVE_MIN_CONTRAST:
+                thresholds[row, column] = tileThreshold
+    return thresholds
+
+
+def applyThresholds(image, operators, thresholds, maxValue, isInverted=False):
+    """
+    Apply pointwise operators and then a binary threshold, in a single lookup table pass
+    :param image: Gray-scale image (uint8)
+    :param operators: Pointwise operators to apply before the threshold. See logic.pointwise
+    :param thresholds: A single threshold, or an array of thresholds of the tiles. See findThresholds
+    :param maxValue: Value of the pixels passing the threshold
+    :param isInverted: Whether to use THRESH_BINARY_INV
+    :return: The binary image
+    """
+    operators = list(operators)
+    if np.ndim(thresholds) == 0:
+        return cv2.LUT(image, getLut(operators + [thresholdOperator(thresholds, maxValue, isInverted)]))
+
+    # Every tile has its own lookup table
+    binary = np.empty_like(image)
+    rowBounds, columnBounds = getTileBounds(image.shape, thresholds.shape)
+    for row, (top, bottom) in enumerate(rowBounds):
+        for column, (left, right) in enumerate(columnBounds):
+            lut = getLut(operators + [thresholdOperator(thresholds[row, column], maxValue, isInverted)])
+            binary[top:bottom, left:right] = cv2.LUT(image[top:bottom, left:right], lut)
+    return binary
@@ -0,0 +1,30 @@
+__author__ = "Haim Adrian"
+
+import argparse
+
+from service.detectionservice import *
+from util.settings import Settings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local HTTP service running object detection')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS_COUNT)
+    parser.add_argument('--max-concurrent-requests', type=int, default=DEFAULT_MAX_CONCURRENT_REQUESTS)
+    parser.add_argument('--queue-timeout', type=float, default=DEFAULT_QUEUE_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+
+    service = DetectionService(Settings().load(),
+                               workersCount=args.workers,
+                               maxConcurrentRequests=args.max_concurrent_requests,
+                               queueTimeout=args.queue_timeout)
+    server = createServer(service, args.host, args.port)
+    print('INFO - Detection service is listening on http://{}:{}'.format(*server.server_address))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,68 @@
+__author__ = "Haim Adrian"
+
+import http.client
+import json
+from urllib.parse import quote, urlencode
+
+from service.detectionservice import DEFAULT_HOST, DEFAULT_PORT
+
+
+class DetectionClientError(Exception):
+    def __init__(self, status, message):
+        super(DetectionClientError, self).__init__('{}: {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class DetectionClient(object):
+    """
+    A minimal client of the detection service, using the standard library only.
+    Each call opens its own connection, so a client can be shared between threads.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=300):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def health(self):
+        return self.request('GET', '/health')
+
+    def metrics(self):
+        return self.request('GET', '/metrics')
+
+    def templates(self):
+        return self.request('GET', '/templates')['templates']
+
+    def registerTemplate(self, templateId, encodedImage):
+        return self.request('PUT', '/templates/' + quote(templateId, safe=''), encodedImage)
+
+    def registerTemplateFile(self, templateId, filePath):
+        with open(filePath, 'rb') as inFile:
+            return self.registerTemplate(templateId, inFile.read())
+
+    def unregisterTemplate(self, templateId):
+        return self.request('DELETE', '/templates/' + quote(templateId, safe=''))
+
+    def detect(self, obj1TemplateId, obj2TemplateId, encodedScene):
+        query = urlencode({'obj1': obj1TemplateId, 'obj2': obj2TemplateId})
+        return self.request('POST', '/detect?' + query, encodedScene)
+
+    def detectFile(self, obj1TemplateId, obj2TemplateId, filePath):
+        with open(filePath, 'rb') as inFile:
+            return self.detect(obj1TemplateId, obj2TemplateId, inFile.read())
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            headers = {'Content-Type': 'application/octet-stream'} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            content = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+        if response.status >= 400:
+            raise DetectionClientError(response.status, content.get('error'))
+
+        return content
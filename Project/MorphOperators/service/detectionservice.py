@@ -0,0 +1,356 @@
+__author__ = "Haim Adrian"
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+import cv2
+import numpy as np
+
+from logic.objectdetectionlogic import runObjectDetection
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS_COUNT = 2
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+DEFAULT_QUEUE_TIMEOUT_SECONDS = 5.0
+MAX_UPLOAD_SIZE_BYTES = 64 * 1024 * 1024
+
+
+class DetectionServiceError(Exception):
+    """
+    An error which is reported back to the client with the specified HTTP status
+    """
+
+    def __init__(self, status, message):
+        super(DetectionServiceError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class DetectionService(object):
+    """
+    Keeps the state of the detection service: registered templates, a warm pool of workers executing
+    the object detection, and some metrics.
+    Templates are decoded once, when they are registered, so detection requests refer to them by id
+    and upload the scene only.
+    """
+
+    def __init__(self,
+                 settings,
+                 workersCount=DEFAULT_WORKERS_COUNT,
+                 maxConcurrentRequests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 queueTimeout=DEFAULT_QUEUE_TIMEOUT_SECONDS):
+        """
+        Constructs a new DetectionService
+
+        :param settings: The settings to run the object detection with
+        :param workersCount: How many detections can be executed in parallel
+        :param maxConcurrentRequests: How many detection requests can be accepted (running or waiting
+        for a worker) before we start rejecting requests with 503
+        :param queueTimeout: How many seconds a request waits for a free slot before it is rejected
+        """
+        self.settings = settings
+        self.workersCount = workersCount
+        self.maxConcurrentRequests = maxConcurrentRequests
+        self.queueTimeout = queueTimeout
+        self.templates = {}  # Template id -> BGR image (numpy.ndarray)
+        self.templatesLock = threading.Lock()
+        self.requestsSemaphore = threading.BoundedSemaphore(maxConcurrentRequests)
+        self.executor = ThreadPoolExecutor(max_workers=workersCount, thread_name_prefix='DetectionWorker')
+        self.metricsLock = threading.Lock()
+        self.startTime = time.time()
+        self.inFlightCount = 0
+        self.detectionsCount = 0
+        self.failuresCount = 0
+        self.rejectedCount = 0
+        self.totalDetectionSeconds = 0.0
+        self.maxDetectionSeconds = 0.0
+
+        self.warmUp()
+
+    def warmUp(self):
+        """
+        Start all of the worker threads up front, so the first requests will not pay for it
+        :return: None
+        """
+        barrier = threading.Barrier(self.workersCount)
+        futures = [self.executor.submit(barrier.wait) for _ in range(self.workersCount)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def registerTemplate(self, templateId, encodedImage):
+        """
+        Decode an uploaded template image and keep it under the specified id.
+        Registering an existing id replaces the template.
+
+        :param templateId: Identifier of the template, used by detection requests
+        :param encodedImage: The encoded (jpg, png, ...) image bytes
+        :return: Shape of the decoded template
+        """
+        template = decodeImage(encodedImage)
+        template.flags.writeable = False
+        with self.templatesLock:
+            self.templates[templateId] = template
+        return template.shape
+
+    def unregisterTemplate(self, templateId):
+        with self.templatesLock:
+            if self.templates.pop(templateId, None) is None:
+                raise DetectionServiceError(404, 'Unknown template: {}'.format(templateId))
+
+    def getTemplateIds(self):
+        with self.templatesLock:
+            return sorted(self.templates.keys())
+
+    def getTemplate(self, templateId):
+        with self.templatesLock:
+            template = self.templates.get(templateId)
+        if template is None:
+            raise DetectionServiceError(404, 'Unknown template: {}'.format(templateId))
+        return template
+
+    def detect(self, obj1TemplateId, obj2TemplateId, encodedScene):
+        """
+        Detect the two registered templates in an uploaded scene.
+        The request waits for a free slot up to queueTimeout seconds, and then for a worker.
+
+        :param obj1TemplateId: Id of the template to use as the first object
+        :param obj2TemplateId: Id of the template to use as the second object
+        :param encodedScene: The encoded (jpg, png, ...) scene image bytes
+        :return: A dictionary with the counts and centroids of the objects, in scene coordinates
+        """
+        obj1 = self.getTemplate(obj1TemplateId)
+        obj2 = self.getTemplate(obj2TemplateId)
+
+        if not self.requestsSemaphore.acquire(timeout=self.queueTimeout):
+            with self.metricsLock:
+                self.rejectedCount += 1
+            raise DetectionServiceError(503, 'Too many concurrent detection requests')
+
+        try:
+            with self.metricsLock:
+                self.inFlightCount += 1
+
+            scene = decodeImage(encodedScene)
+            return self.executor.submit(self.executeDetection, obj1, obj2, scene).result()
+        finally:
+            with self.metricsLock:
+                self.inFlightCount -= 1
+            self.requestsSemaphore.release()
+
+    def executeDetection(self, obj1, obj2, scene):
+        """
+        The job executed by a worker. Resize the scene the same way the GUI does, run the detection and
+        translate the centroids back to the coordinates of the uploaded scene.
+        """
+        startTime = time.perf_counter()
+        findings = []
+        try:
+            settings = self.settings.snapshot()
+            image = cv2.resize(scene, settings.imageShape)
+            runObjectDetection(obj1, obj2, image, settings,
+                               lambda text: None,
+                               lambda progress: None,
+                               lambda obj1Centroids, obj2Centroids: findings.extend((obj1Centroids, obj2Centroids)))
+        except Exception:
+            with self.metricsLock:
+                self.failuresCount += 1
+            raise
+
+        elapsed = time.perf_counter() - startTime
+        with self.metricsLock:
+            self.detectionsCount += 1
+            self.totalDetectionSeconds += elapsed
+            self.maxDetectionSeconds = max(self.maxDetectionSeconds, elapsed)
+
+        scaleX = scene.shape[1] / float(image.shape[1])
+        scaleY = scene.shape[0] / float(image.shape[0])
+
+        def toSceneCoordinates(centroids):
+            return [[int(round(x * scaleX)), int(round(y * scaleY))] for (x, y) in centroids]
+
+        obj1Centroids, obj2Centroids = findings
+        return {'obj1': {'count': len(obj1Centroids), 'centroids': toSceneCoordinates(obj1Centroids)},
+                'obj2': {'count': len(obj2Centroids), 'centroids': toSceneCoordinates(obj2Centroids)},
+                'elapsedMs': round(elapsed * 1000.0, 3)}
+
+    def getHealth(self):
+        return {'status': 'ok',
+                'workers': self.workersCount,
+                'templates': len(self.getTemplateIds())}
+
+    def getMetrics(self):
+        with self.metricsLock:
+            return {'uptimeSeconds': round(time.time() - self.startTime, 3),
+                    'workers': self.workersCount,
+                    'maxConcurrentRequests': self.maxConcurrentRequests,
+                    'inFlight': self.inFlightCount,
+                    'detections': self.detectionsCount,
+                    'failures': self.failuresCount,
+                    'rejected': self.rejectedCount,
+                    'averageDetectionMs': round(self.totalDetectionSeconds * 1000.0 / self.detectionsCount, 3)
+                    if self.detectionsCount > 0 else 0.0,
+                    'maxDetectionMs': round(self.maxDetectionSeconds * 1000.0, 3)}
+
+
+def decodeImage(encodedImage):
+    """
+    Decode image bytes (as uploaded by a client) into a BGR image
+    :param encodedImage: The encoded (jpg, png, ...) image bytes
+    :return: BGR image
+    """
+    if not encodedImage:
+        raise DetectionServiceError(400, 'Missing image content')
+
+    image = cv2.imdecode(np.frombuffer(encodedImage, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise DetectionServiceError(400, 'Uploaded content is not a supported image')
+
+    return image
+
+
+class DetectionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes:
+        GET    /health                            Liveness of the service
+        GET    /metrics                           Counters and timings of the detections
+        GET    /templates                         Ids of the registered templates
+        PUT    /templates/<id>                    Register a template. Body: encoded image
+        DELETE /templates/<id>                    Unregister a template
+        POST   /detect?obj1=<id>&obj2=<id>        Detect templates in a scene. Body: encoded image
+    """
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        self.handleRequest(self.routeGet)
+
+    def do_PUT(self):
+        self.handleRequest(self.routePut)
+
+    def do_POST(self):
+        self.handleRequest(self.routePost)
+
+    def do_DELETE(self):
+        self.handleRequest(self.routeDelete)
+
+    def routeGet(self, path, query):
+        if path == '/health':
+            return 200, self.service.getHealth()
+        if path == '/metrics':
+            return 200, self.service.getMetrics()
+        if path == '/templates':
+            return 200, {'templates': self.service.getTemplateIds()}
+        raise DetectionServiceError(404, 'Not found: {}'.format(path))
+
+    def routePut(self, path, query):
+        templateId = self.parseTemplateId(path)
+        shape = self.service.registerTemplate(templateId, self.readBody())
+        return 201, {'id': templateId, 'shape': list(shape)}
+
+    def routeDelete(self, path, query):
+        templateId = self.parseTemplateId(path)
+        self.service.unregisterTemplate(templateId)
+        return 200, {'id': templateId}
+
+    def routePost(self, path, query):
+        if path != '/detect':
+            raise DetectionServiceError(404, 'Not found: {}'.format(path))
+
+        # Read the scene first, so a request failing on its ids leaves nothing unread on the connection
+        encodedScene = self.readBody()
+        obj1TemplateId = query.get('obj1', [None])[0]
+        obj2TemplateId = query.get('obj2', [None])[0]
+        if not obj1TemplateId or not obj2TemplateId:
+            raise DetectionServiceError(400, 'Both obj1 and obj2 template ids are required')
+
+        return 200, self.service.detect(obj1TemplateId, obj2TemplateId, encodedScene)
+
+    @staticmethod
+    def parseTemplateId(path):
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'templates' or not parts[1]:
+            raise DetectionServiceError(404, 'Not found: {}'.format(path))
+        # Clients quote the id into the path, while query ids arrive decoded by parse_qs
+        return unquote(parts[1])
+
+    def readBody(self):
+        """
+        Read the content of a PUT or POST request. Content-Length is required, and it is limited to
+        MAX_UPLOAD_SIZE_BYTES
+        :return: The content bytes
+        """
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise DetectionServiceError(411, 'Content-Length is required')
+
+        try:
+            length = int(length)
+        except ValueError:
+            raise DetectionServiceError(400, 'Invalid Content-Length: {}'.format(length))
+        if length < 0:
+            raise DetectionServiceError(400, 'Invalid Content-Length: {}'.format(length))
+        if length > MAX_UPLOAD_SIZE_BYTES:
+            raise DetectionServiceError(413, 'Upload exceeds {} bytes'.format(MAX_UPLOAD_SIZE_BYTES))
+
+        self.isBodyRead = True
+        return self.rfile.read(length)
+
+    def hasUnreadBody(self):
+        """
+        :return: Whether the request might have content we did not read. Connections are kept alive between
+        requests, so unread content would be parsed as the next request
+        """
+        if self.isBodyRead:
+            return False
+        return self.command in ('PUT', 'POST') or \
+            self.headers.get('Content-Length', '0') != '0' or 'Transfer-Encoding' in self.headers
+
+    def handleRequest(self, route):
+        url = urlparse(self.path)
+        self.isBodyRead = False
+        try:
+            status, body = route(url.path, parse_qs(url.query))
+        except DetectionServiceError as e:
+            status, body = e.status, {'error': e.message}
+        except Exception as e:
+            print('ERROR - Error has occurred while handling request:', self.path, str(e))
+            status, body = 500, {'error': str(e)}
+
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if self.hasUnreadBody():
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        print('INFO - ' + (format % args))
+
+
+def createServer(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Create an HTTP server (not started yet) handling requests using the specified service.
+    Use serve_forever() to start it, and shutdown() to stop it.
+    :param service: The DetectionService handling the requests
+    :param host: Host to bind to. We bind to the loopback interface by default, for local clients only
+    :param port: Port to listen on. Use 0 to pick a free port. (See server.server_address)
+    :return: The server
+    """
+    server = ThreadingHTTPServer((host, port), DetectionRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
@@ -0,0 +1,157 @@
+__author__ = "Haim Adrian"
+
+import http.client
+import json
+import socket
+import threading
+import unittest
+
+import cv2
+import numpy as np
+
+from service.detectionclient import DetectionClient
+from service.detectionservice import DetectionService, createServer
+from util.settings import Settings
+
+# Small scenes keep every detection request fast
+TEST_IMAGE_SHAPE = (160, 160)
+# Distance (pixels) of a detected centroid from the center of its shape
+CENTROID_TOLERANCE = 3
+
+
+def encodePng(image):
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def createScene():
+    """
+    :return: Dark scene holding two bright discs and a bright square
+    """
+    scene = np.zeros(TEST_IMAGE_SHAPE + (3,), dtype=np.uint8)
+    cv2.circle(scene, (40, 40), 12, (255, 255, 255), -1)
+    cv2.circle(scene, (120, 50), 12, (255, 255, 255), -1)
+    cv2.rectangle(scene, (60, 100), (100, 140), (255, 255, 255), -1)
+    return scene
+
+
+class DetectionServiceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = Settings().snapshot().replace(imageShape=TEST_IMAGE_SHAPE, objectRotationDegreeInc=90)
+        cls.service = DetectionService(settings, workersCount=1, maxConcurrentRequests=2)
+        cls.server = createServer(cls.service, port=0)
+        cls.host, cls.port = cls.server.server_address
+        cls.serverThread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.serverThread.start()
+
+        scene = createScene()
+        cls.sceneContent = encodePng(scene)
+        cls.discContent = encodePng(scene[24:57, 24:57])
+        cls.squareContent = encodePng(scene[92:149, 52:109])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.service.shutdown()
+
+    def setUp(self):
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        self.connection.request(method, path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        return response, json.loads(response.read().decode('utf-8'))
+
+    def sendRaw(self, requestText):
+        """
+        Send a request as is, for requests http.client would not send
+        :return: Everything the server sent, up to closing the connection
+        """
+        with socket.create_connection((self.host, self.port), timeout=10) as rawSocket:
+            rawSocket.sendall(requestText.encode('latin-1'))
+            chunks = []
+            while True:
+                chunk = rawSocket.recv(65536)
+                if not chunk:
+                    return b''.join(chunks).decode('latin-1')
+                chunks.append(chunk)
+
+    def assertCentroidsNear(self, expected, actual):
+        """
+        The contours of the objects pass through blurring and closing, so they are a few pixels off the shapes
+        """
+        self.assertEqual(len(expected), len(actual))
+        for (expectedX, expectedY), (x, y) in zip(sorted(expected), sorted(actual)):
+            self.assertLessEqual(abs(expectedX - x), CENTROID_TOLERANCE, actual)
+            self.assertLessEqual(abs(expectedY - y), CENTROID_TOLERANCE, actual)
+
+    def testHealth(self):
+        response, body = self.request('GET', '/health')
+        self.assertEqual(200, response.status)
+        self.assertEqual('ok', body['status'])
+
+    def testRegisterAndDetect(self):
+        response, body = self.request('PUT', '/templates/disc', self.discContent)
+        self.assertEqual(201, response.status)
+        self.assertEqual([33, 33, 3], body['shape'])
+        response, _ = self.request('PUT', '/templates/square', self.squareContent)
+        self.assertEqual(201, response.status)
+
+        response, body = self.request('POST', '/detect?obj1=disc&obj2=square', self.sceneContent)
+        self.assertEqual(200, response.status)
+        self.assertEqual(2, body['obj1']['count'])
+        self.assertEqual(1, body['obj2']['count'])
+        self.assertCentroidsNear([(40, 40), (120, 50)], body['obj1']['centroids'])
+        self.assertCentroidsNear([(80, 120)], body['obj2']['centroids'])
+
+    def testQuotedTemplateIds(self):
+        # The client quotes ids into the path, and passes them in the query of detect
+        client = DetectionClient(self.host, self.port, timeout=60)
+        client.registerTemplate('coin 1/a', self.discContent)
+        client.registerTemplate('bill 1/a', self.squareContent)
+        self.assertIn('coin 1/a', client.templates())
+
+        body = client.detect('coin 1/a', 'bill 1/a', self.sceneContent)
+        self.assertEqual(2, body['obj1']['count'])
+        self.assertEqual(1, body['obj2']['count'])
+
+        client.unregisterTemplate('coin 1/a')
+        client.unregisterTemplate('bill 1/a')
+        self.assertNotIn('coin 1/a', client.templates())
+
+    def testUnknownTemplateKeepsConnectionUsable(self):
+        # The scene is read before the templates are looked up, so the connection can serve the next request
+        response, _ = self.request('POST', '/detect?obj1=missing&obj2=missing', self.sceneContent)
+        self.assertEqual(404, response.status)
+        response, _ = self.request('GET', '/health')
+        self.assertEqual(200, response.status)
+
+    def testErrorBeforeReadingBodyClosesConnection(self):
+        reply = self.sendRaw('POST /unknown HTTP/1.1\r\nHost: test\r\nContent-Length: 4\r\n\r\n'
+                             'GET /health HTTP/1.1\r\nHost: test\r\n\r\n')
+        self.assertTrue(reply.startswith('HTTP/1.1 404'))
+        self.assertIn('Connection: close', reply)
+        self.assertEqual(1, reply.count('HTTP/1.1 '))
+
+    def testMissingContentLength(self):
+        reply = self.sendRaw('PUT /templates/empty HTTP/1.1\r\nHost: test\r\n\r\n')
+        self.assertTrue(reply.startswith('HTTP/1.1 411'))
+
+    def testInvalidContentLength(self):
+        for length in ('abc', '-1'):
+            reply = self.sendRaw('PUT /templates/bad HTTP/1.1\r\nHost: test\r\nContent-Length: {}\r\n\r\n'.format(length))
+            self.assertTrue(reply.startswith('HTTP/1.1 400'), reply)
+            self.assertIn('Connection: close', reply)
+
+    def testUndecodableImage(self):
+        response, body = self.request('PUT', '/templates/text', b'not an image')
+        self.assertEqual(400, response.status)
+        self.assertIn('error', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
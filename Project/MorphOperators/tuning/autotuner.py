@@ -0,0 +1,220 @@
+__author__ = "Haim Adrian"
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logic.objectdetectionlogic import runObjectDetection, stageCache
+from logic.stagegraph import StageGraph
+from util.imageloader import readImage
+from util.settings import Settings, SettingsSnapshot
+
+# Parameters we search over, grouped by the pipeline stage that depends on them. Stages are ordered
+# as in the pipeline, so a candidate shares all of the stages before the first parameter it changes.
+BLUR_PARAMETERS = ('blurKernelSize', 'blurBackend')
+THRESHOLD_PARAMETERS = ('threshold1',)
+CLOSING_PARAMETERS = ('morphCloseIterationsCount', 'morphOpenIterationsCount')
+HIT_MISS_PARAMETERS = ('morphErodeIterationsCount', 'morphDilateIterationsCount')
+PARAMETERS = BLUR_PARAMETERS + THRESHOLD_PARAMETERS + CLOSING_PARAMETERS + HIT_MISS_PARAMETERS
+
+DEFAULT_SEARCH_SPACE = {'blurKernelSize': [9, 13, 17],
+                        'threshold1': [72, 92, 112],
+                        'morphCloseIterationsCount': [6, 8],
+                        'morphOpenIterationsCount': [1, 2],
+                        'morphErodeIterationsCount': [2, 4],
+                        'morphDilateIterationsCount': [3, 6]}
+
+
+class LabelledScene(object):
+    """
+    A scene with its two templates and the amount of objects of each template we expect to find in it
+    """
+
+    def __init__(self, scenePath, obj1Path, obj2Path, expectedCounts, settingsOverrides=None):
+        self.scenePath = scenePath
+        self.obj1Path = obj1Path
+        self.obj2Path = obj2Path
+        self.expectedCounts = tuple(expectedCounts)
+        self.settingsOverrides = settingsOverrides or {}  # e.g. {"isBrightBackground": true}
+
+
+def loadLabelledScenes(filePath):
+    """
+    Load labelled scenes from a JSON file in the following format. (Paths are relative to the file)
+    {"scenes": [{"scene": "bright_straight.jpg", "obj1": "bright_coin.jpg", "obj2": "bright_plate.jpg",
+                 "expected": [6, 2], "settings": {"isBrightBackground": true}}]}
+    :param filePath: Path of the JSON file
+    :return: List of LabelledScene
+    """
+    baseDir = os.path.dirname(os.path.abspath(filePath))
+    with open(filePath, 'r') as inFile:
+        content = json.load(inFile)
+
+    return [LabelledScene(os.path.join(baseDir, scene['scene']),
+                          os.path.join(baseDir, scene['obj1']),
+                          os.path.join(baseDir, scene['obj2']),
+                          scene['expected'],
+                          scene.get('settings')) for scene in content['scenes']]
+
+
+# Stage output key -> how long (ms) it took to compute it. Outputs are shared through the stage cache of the
+# worker process, so candidates estimate their duration out of what their cached stages once cost
+stageDurations = {}
+
+
+class TimedStageGraph(StageGraph):
+    """
+    A StageGraph which accounts for what every stage of a run would cost without the cache: computed stages by
+    their duration, and cached ones by the duration they were computed in
+    """
+
+    def __init__(self, cache):
+        super(TimedStageGraph, self).__init__(cache)
+        self.stagesMs = 0.0  # Time spent inside run()
+        self.standaloneStagesMs = 0.0  # Time the stages would have taken without the cache
+
+    def run(self, stage, settings, inputs, arguments=(), **sideArguments):
+        key = self.createKey(stage, settings, inputs, arguments)
+        isCached = key in self.cache and key in stageDurations
+
+        startTime = time.perf_counter()
+        output = super(TimedStageGraph, self).run(stage, settings, inputs, arguments, **sideArguments)
+        durationMs = (time.perf_counter() - startTime) * 1000.0
+
+        if not isCached:
+            stageDurations[key] = durationMs
+        self.stagesMs += durationMs
+        self.standaloneStagesMs += stageDurations[key]
+        return output
+
+    def estimateStandaloneMs(self, wallMs):
+        """
+        :param wallMs: Duration of the run, as it was measured
+        :return: Estimated duration of the run, had none of its stages been cached
+        """
+        return wallMs - self.stagesMs + self.standaloneStagesMs
+
+
+def evaluateSceneBlurGroup(labelledScene, baseSettings, blurValues, searchSpace):
+    """
+    Evaluate all candidates sharing a scene and blur parameters. This is the unit of work of a worker
+    process. Every candidate is a runObjectDetection, as the GUI runs it. Stage outputs are memoized in the
+    stage cache of the worker, so a candidate recomputes only the stages depending on the parameters that
+    differ from a previously evaluated candidate. e.g. the hit & miss sweep of a scale is shared between all
+    erode/dilate ranges that contain that scale.
+
+    :param labelledScene: The scene to evaluate
+    :param baseSettings: Dictionary of the settings to start from (Settings fields)
+    :param blurValues: Values of BLUR_PARAMETERS, shared by all candidates of this group
+    :param searchSpace: Dictionary of parameter name -> list of values
+    :return: Dictionary of candidate (tuple of PARAMETERS values) -> (counts, estimated duration in ms)
+    """
+    settings = SettingsSnapshot(dict(baseSettings, **labelledScene.settingsOverrides))
+
+    # Workers evaluate several blur groups of the same scene, so the decoded images are shared
+    obj1Image = readImage(labelledScene.obj1Path)
+    obj2Image = readImage(labelledScene.obj2Path)
+    image = readImage(labelledScene.scenePath, shape=settings.imageShape)
+
+    results = {}
+    silent = lambda *args: None
+    otherParameters = PARAMETERS[len(BLUR_PARAMETERS):]
+    for otherValues in itertools.product(*[searchSpace[name] for name in otherParameters]):
+        candidate = tuple(blurValues) + otherValues
+        findings = []
+        graph = TimedStageGraph(stageCache)
+
+        startTime = time.perf_counter()
+        runObjectDetection(obj1Image, obj2Image, image, settings.replace(**dict(zip(PARAMETERS, candidate))),
+                           silent, silent,
+                           findingsConsumer=lambda obj1Centroids, obj2Centroids: findings.extend(
+                               (obj1Centroids, obj2Centroids)),
+                           stageGraph=graph)
+        wallMs = (time.perf_counter() - startTime) * 1000.0
+
+        obj1Centroids, obj2Centroids = findings
+        results[candidate] = ((len(obj1Centroids), len(obj2Centroids)), graph.estimateStandaloneMs(wallMs))
+
+    return results
+
+
+def evaluateSceneBlurGroupSilently(*args):
+    # The pipeline prints the structuring elements. Keep the output of the workers clean.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return evaluateSceneBlurGroup(*args)
+
+
+def tune(labelledScenes, baseSettings, searchSpace=None, workersCount=None):
+    """
+    Search the settings space for the fastest settings which detect the expected counts in all scenes.
+    Scenes and blur values are evaluated in parallel, by worker processes.
+
+    :param labelledScenes: List of LabelledScene
+    :param baseSettings: Dictionary of the settings to start from (Settings fields)
+    :param searchSpace: Dictionary of parameter name -> list of values. Missing parameters keep the
+    value of the base settings
+    :param workersCount: Amount of worker processes. Default is the amount of CPUs
+    :return: List of tuples (settings dictionary, estimated duration in ms) of all candidates which hit the
+    expected counts, fastest first
+    """
+    searchSpace = dict(searchSpace or DEFAULT_SEARCH_SPACE)
+    for name in PARAMETERS:
+        searchSpace.setdefault(name, [baseSettings[name]])
+
+    blurCandidates = list(itertools.product(*[searchSpace[name] for name in BLUR_PARAMETERS]))
+    candidatesCount = int(np.prod([len(searchSpace[name]) for name in PARAMETERS]))
+    print('INFO - Evaluating {} candidates over {} scenes'.format(candidatesCount, len(labelledScenes)))
+
+    durations = {}  # Candidate -> total estimated duration over all scenes
+    failed = set()  # Candidates which missed the expected counts in at least one scene
+    with ProcessPoolExecutor(max_workers=workersCount) as executor:
+        futures = {executor.submit(evaluateSceneBlurGroupSilently, scene, baseSettings, blurValues,
+                                   searchSpace): scene
+                   for scene in labelledScenes for blurValues in blurCandidates}
+        for future, scene in futures.items():
+            for candidate, (counts, durationMs) in future.result().items():
+                durations[candidate] = durations.get(candidate, 0.0) + durationMs
+                if counts != scene.expectedCounts:
+                    failed.add(candidate)
+
+    passed = sorted((durationMs, candidate) for candidate, durationMs in durations.items() if candidate not in failed)
+    return [(dict(baseSettings, **dict(zip(PARAMETERS, candidate))), durationMs) for durationMs, candidate in passed]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search for the fastest settings which detect the expected ' +
+                                                 'counts in labelled scenes. Run it from the MorphOperators ' +
+                                                 'directory: python -m tuning.autotuner labels.json')
+    parser.add_argument('labels', help='JSON file of labelled scenes. See loadLabelledScenes')
+    parser.add_argument('--space', help='JSON file of the search space: {"threshold1": [80, 92], ...}')
+    parser.add_argument('--workers', type=int, default=None, help='Amount of worker processes')
+    parser.add_argument('--top', type=int, default=5, help='How many of the fastest candidates to print')
+    parser.add_argument('--save', action='store_true', help='Store the fastest settings to the settings file')
+    args = parser.parse_args()
+
+    space = None
+    if args.space:
+        with open(args.space, 'r') as spaceFile:
+            space = json.load(spaceFile)
+
+    settingsInstance = Settings().load()
+    candidates = tune(loadLabelledScenes(args.labels), settingsInstance.snapshot().toDictionary(), space,
+                      args.workers)
+    if not candidates:
+        print('WARN - None of the candidates detected the expected counts')
+        exit(1)
+
+    for candidateSettings, durationMs in candidates[:args.top]:
+        print('{:10.1f} ms  {}'.format(durationMs, {name: candidateSettings[name] for name in PARAMETERS}))
+
+    if args.save:
+        for name, value in candidates[0][0].items():
+            setattr(settingsInstance, name, value)
+        settingsInstance.save()
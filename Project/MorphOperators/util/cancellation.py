@@ -0,0 +1,52 @@
+__author__ = "Haim Adrian"
+
+import threading
+
+
+class DetectionCancelledError(Exception):
+    """
+    Raised by a detection which noticed that its CancellationToken was cancelled
+    """
+    pass
+
+
+class CancellationToken(object):
+    """
+    Lets one thread ask a running detection (in another thread) to stop. Cancellation is cooperative:
+    the detection checks the token between its steps (stages, scales and angles), and raises
+    DetectionCancelledError once it is cancelled.
+    """
+
+    def __init__(self, event=None):
+        """
+        Constructs a new CancellationToken
+        :param event: Optional. The event to signal cancellation with. Default is a threading.Event. Use a
+        multiprocessing Event to cancel a detection running in another process
+        """
+        self.event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def isCancelled(self):
+        return self.event.is_set()
+
+    def raiseIfCancelled(self):
+        if self.event.is_set():
+            raise DetectionCancelledError('Detection was cancelled')
+
+
+class NeverCancelledToken(object):
+    """
+    The token we use when a caller does not need cancellation, so we do not have to check for None
+    """
+    __slots__ = ()
+
+    def isCancelled(self):
+        return False
+
+    def raiseIfCancelled(self):
+        pass
+
+
+NEVER_CANCELLED = NeverCancelledToken()
@@ -0,0 +1,177 @@
+__author__ = "Haim Adrian"
+
+import os
+import struct
+
+import cv2
+
+from util.lrucache import LruCache
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Flags decoding a JPEG at 1/2, 1/4 and 1/8 of its size, by reduction factor. libjpeg skips most of the
+# inverse DCT work for those, so they are much faster than a full decode
+REDUCED_COLOR_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+REDUCED_GRAYSCALE_FLAGS = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                           4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                           8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# Start Of Frame markers (baseline, progressive, lossless, arithmetic...). They hold the size of the image
+JPEG_SOF_MARKERS = frozenset((0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF))
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = frozenset([0x01, 0xD8, 0xD9] + list(range(0xD0, 0xD8)))
+
+
+def readJpegSize(filePath):
+    """
+    Reads the size of a JPEG image out of its Start Of Frame header, without decoding the image
+    :param filePath: Path of the image
+    :return: Tuple (width, height), or None in case the file is not a JPEG (or it is corrupted)
+    """
+    try:
+        with open(filePath, 'rb') as inFile:
+            if inFile.read(2) != b'\xff\xd8':
+                return None
+
+            while True:
+                byte = inFile.read(1)
+                if not byte:
+                    return None
+                if byte != b'\xff':
+                    continue
+
+                # A marker may be preceded by any amount of 0xFF fill bytes
+                marker = inFile.read(1)
+                while marker == b'\xff':
+                    marker = inFile.read(1)
+                if not marker:
+                    return None
+
+                marker = marker[0]
+                if marker in JPEG_STANDALONE_MARKERS:
+                    continue
+
+                lengthBytes = inFile.read(2)
+                if len(lengthBytes) < 2:
+                    return None
+                length = struct.unpack('>H', lengthBytes)[0]
+
+                if marker in JPEG_SOF_MARKERS:
+                    header = inFile.read(5)  # Precision (1 byte), height (2 bytes), width (2 bytes)
+                    if len(header) < 5:
+                        return None
+                    _, height, width = struct.unpack('>BHH', header)
+                    return width, height
+
+                inFile.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+
+def chooseReductionFactor(imageSize, shape):
+    """
+    Choose the biggest reduction factor (1, 2, 4 or 8) whose decoded image is still not smaller than the target
+    shape, so the final resize never upscales. The image might be rotated by its EXIF orientation while it is
+    decoded, so the factor must fit both orientations.
+    :param imageSize: (width, height) of the image, as stored in the file
+    :param shape: (width, height) we are going to resize the image to
+    :return: The reduction factor. 1 means full decode
+    """
+    imageMin, targetMax = min(imageSize), max(shape)
+    for factor in (8, 4, 2):
+        if imageMin // factor >= targetMax:
+            return factor
+    return 1
+
+
+class ImageLoader(object):
+    """
+    Reads images from disk, keeping the decoded images in an LRU cache, so reading the same file again
+    skips the decoding. Entries are keyed by (path, modification time, file size, flags, shape), so a
+    file that was modified on disk is decoded again.
+    Cached images are shared between callers, hence they are read-only. Copy an image before modifying it.
+    """
+
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES, maxEntries=None, isUsingReducedDecode=True):
+        """
+        Constructs a new ImageLoader
+        :param maxBytes: Maximum total size (bytes) of the decoded images we keep
+        :param maxEntries: Maximum amount of decoded images we keep. None means unbounded
+        :param isUsingReducedDecode: Whether to decode JPEG images at 1/2, 1/4 or 1/8 of their size when
+        they are going to be resized to a shape that small anyway. See chooseReductionFactor
+        """
+        self.cache = LruCache(maxEntries=maxEntries, maxBytes=maxBytes)
+        self.isUsingReducedDecode = isUsingReducedDecode
+
+    def readImage(self, filePath, flags=cv2.IMREAD_COLOR, shape=None):
+        """
+        Reads an image, or fetches it from the cache when the file has not changed since it was decoded
+        :param filePath: Path of the image to read
+        :param flags: Flags to use for reading the image. e.g. cv2.IMREAD_GRAYSCALE
+        :param shape: Optional (width, height) to resize the image to, as expected by cv2.resize
+        :return: The image (read-only numpy.ndarray), or None in case it could not be read
+        """
+        key = self.createKey(filePath, flags, shape)
+        if key is None:
+            return None
+
+        image = self.cache.get(key)
+        if image is None:
+            image = self.decodeImage(filePath, flags, shape)
+            if image is None:
+                return None
+            image.flags.writeable = False
+            self.cache.put(key, image)
+
+        return image
+
+    @staticmethod
+    def createKey(filePath, flags, shape):
+        try:
+            stat = os.stat(filePath)
+        except OSError:
+            return None
+        return os.path.abspath(filePath), stat.st_mtime_ns, stat.st_size, flags, tuple(shape) if shape else None
+
+    def decodeImage(self, filePath, flags, shape):
+        if shape is not None and self.isUsingReducedDecode:
+            flags = self.getReducedFlags(filePath, flags, shape)
+
+        image = cv2.imread(filePath, flags)
+        if image is not None and shape is not None:
+            image = cv2.resize(image, tuple(shape))
+        return image
+
+    @staticmethod
+    def getReducedFlags(filePath, flags, shape):
+        """
+        :return: The flags to decode an image with, when we need it resized to the specified shape
+        """
+        reducedFlags = {cv2.IMREAD_COLOR: REDUCED_COLOR_FLAGS, cv2.IMREAD_GRAYSCALE: REDUCED_GRAYSCALE_FLAGS}
+        if flags not in reducedFlags:
+            return flags
+
+        imageSize = readJpegSize(filePath)
+        if imageSize is None:
+            return flags
+
+        factor = chooseReductionFactor(imageSize, shape)
+        return flags if factor == 1 else reducedFlags[flags][factor]
+
+    def clear(self):
+        self.cache.clear()
+        return self
+
+    def getStatistics(self):
+        return self.cache.getStatistics()
+
+
+# Modules are imported only once, so this variable will be a singleton of ImageLoader.
+imageLoader = ImageLoader()
+
+
+def readImage(filePath, flags=cv2.IMREAD_COLOR, shape=None):
+    """
+    Reads an image using the shared ImageLoader. See ImageLoader.readImage
+    """
+    return imageLoader.readImage(filePath, flags, shape)
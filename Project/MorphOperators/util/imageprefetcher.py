@@ -0,0 +1,118 @@
+__author__ = "Haim Adrian"
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from util.imageloader import imageLoader, readJpegSize
+
+DEFAULT_WORKERS_COUNT = 2
+DEFAULT_DEPTH = 4
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+class ImagePrefetcher(object):
+    """
+    Decodes images in background threads, before they are needed. e.g. the next scenes of a batch while
+    the current one is being processed, or the files a user has just selected.
+    Images are decoded through an ImageLoader, so a prefetched image also lands in the cache of the loader.
+    The amount of prefetched images which were not read yet is bounded by depth, and their estimated
+    decoded size is bounded by maxBytes. When a bound is exceeded, the oldest prefetch is discarded.
+    """
+
+    def __init__(self, loader=imageLoader, workersCount=DEFAULT_WORKERS_COUNT, depth=DEFAULT_DEPTH,
+                 maxBytes=DEFAULT_MAX_BYTES):
+        """
+        Constructs a new ImagePrefetcher
+        :param loader: The ImageLoader to decode images with
+        :param workersCount: Amount of decoding threads
+        :param depth: Maximum amount of prefetched images that were not read yet
+        :param maxBytes: Maximum total (estimated) size of prefetched images that were not read yet
+        """
+        self.loader = loader
+        self.depth = depth
+        self.maxBytes = maxBytes
+        self.executor = ThreadPoolExecutor(max_workers=workersCount, thread_name_prefix='ImagePrefetcher')
+        self.prefetched = OrderedDict()  # Key -> (future, estimated size). Oldest first
+        self.prefetchedBytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def createKey(filePath, flags, shape):
+        return os.path.abspath(filePath), flags, tuple(shape) if shape else None
+
+    @staticmethod
+    def estimateSize(filePath, flags, shape):
+        """
+        :return: Estimated size (bytes) of the decoded image, without decoding it
+        """
+        channels = 1 if flags == cv2.IMREAD_GRAYSCALE else 3
+        if shape is not None:
+            return shape[0] * shape[1] * channels
+
+        imageSize = readJpegSize(filePath)
+        if imageSize is not None:
+            return imageSize[0] * imageSize[1] * channels
+
+        # Not a JPEG. Compressed images are usually smaller than decoded ones, so this is the least it takes
+        return os.path.getsize(filePath)
+
+    def prefetch(self, filePath, flags=cv2.IMREAD_COLOR, shape=None):
+        """
+        Start decoding an image in background. Prefetching the same image again does nothing
+        :param filePath: Path of the image to read
+        :param flags: Flags to use for reading the image
+        :param shape: Optional (width, height) to resize the image to
+        :return: Whether the image is being prefetched (False when it does not exist or it is bigger than maxBytes)
+        """
+        if not os.path.isfile(filePath):
+            return False
+
+        key = self.createKey(filePath, flags, shape)
+        size = self.estimateSize(filePath, flags, shape)
+        if size > self.maxBytes:
+            return False
+
+        with self.lock:
+            if key in self.prefetched:
+                return True
+
+            while self.prefetched and (len(self.prefetched) >= self.depth or
+                                       self.prefetchedBytes + size > self.maxBytes):
+                self.discardOldest()
+
+            future = self.executor.submit(self.loader.readImage, filePath, flags, shape)
+            self.prefetched[key] = (future, size)
+            self.prefetchedBytes += size
+
+        return True
+
+    def discardOldest(self):
+        # Must be called while holding the lock
+        _, (future, size) = self.prefetched.popitem(last=False)
+        future.cancel()  # Does nothing when it is already decoding or done
+        self.prefetchedBytes -= size
+
+    def readImage(self, filePath, flags=cv2.IMREAD_COLOR, shape=None):
+        """
+        Reads an image. When it is being prefetched, wait for the prefetch rather than decoding it again
+        :return: The image (read-only numpy.ndarray), or None in case it could not be read
+        """
+        key = self.createKey(filePath, flags, shape)
+        with self.lock:
+            future, size = self.prefetched.pop(key, (None, 0))
+            self.prefetchedBytes -= size
+
+        if future is not None and not future.cancelled():
+            return future.result()
+
+        return self.loader.readImage(filePath, flags, shape)
+
+    def shutdown(self):
+        with self.lock:
+            while self.prefetched:
+                self.discardOldest()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,108 @@
+__author__ = "Haim Adrian"
+
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def sizeOf(value):
+    """
+    Estimate how many bytes a cached value holds. numpy arrays, and other values holding buffers
+    (e.g. logic.rlemask.RunLengthMask), are counted by their nbytes. Tuples, lists and dictionaries are
+    counted by their elements.
+    :param value: The value to measure
+    :return: Size in bytes
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(sizeOf(element) for element in value)
+    if isinstance(value, dict):
+        return sum(sizeOf(key) + sizeOf(element) for key, element in value.items())
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+class LruCache(object):
+    """
+    A thread-safe Least Recently Used cache, bounded by amount of entries and/or total size in bytes.
+    When a bound is exceeded, the least recently used entries are evicted.
+    """
+
+    def __init__(self, maxEntries=None, maxBytes=None, sizeFunction=sizeOf):
+        """
+        Constructs a new LruCache
+        :param maxEntries: Maximum amount of entries. None means unbounded
+        :param maxBytes: Maximum total size (bytes) of the values. None means unbounded
+        :param sizeFunction: Function used to measure the size (bytes) of a value
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.sizeFunction = sizeFunction
+        self.entries = OrderedDict()  # Key -> (value, size). Most recently used at the end
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Store a value. A value bigger than maxBytes is not stored at all.
+        :return: The value
+        """
+        size = self.sizeFunction(value)
+        with self.lock:
+            if key in self.entries:
+                self.totalBytes -= self.entries.pop(key)[1]
+            if self.maxBytes is not None and size > self.maxBytes:
+                return value
+            self.entries[key] = (value, size)
+            self.totalBytes += size
+            self.evict()
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+            self.totalBytes -= entry[1]
+            return entry[0]
+
+    def evict(self):
+        while self.entries and ((self.maxEntries is not None and len(self.entries) > self.maxEntries) or
+                                (self.maxBytes is not None and self.totalBytes > self.maxBytes)):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.totalBytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
+        return self
+
+    def getStatistics(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.totalBytes, 'hits': self.hits, 'misses': self.misses}
@@ -1,5 +1,6 @@
 __author__ = "Haim Adrian"
 
+import hashlib
 import os
 from ast import literal_eval
 
@@ -22,6 +23,40 @@ DEFAULT_STRUCTURE_ELEMENT_DONTCARE_WIDTH = 5
 DEFAULT_OBJECT_MARKER_THICKNESS = 2
 DEFAULT_OBJECT_MARKER_COLOR = (0, 255, 0)
 DEFAULT_OBJECT_ROTATE_DEGREE_INC = 3
+DEFAULT_GRADIENT_BACKEND = 'exact'  # See logic.functions.GRADIENT_BACKENDS
+DEFAULT_IS_GRAY_FIRST = False
+DEFAULT_BLUR_BACKEND = 'median'  # See logic.functions.BLUR_BACKENDS
+DEFAULT_THRESHOLD_METHOD = 'fixed'  # See logic.thresholding.THRESHOLD_METHODS
+DEFAULT_MORPHOLOGY_BACKEND = 'opencv'  # See logic.morphology.MORPHOLOGY_BACKENDS
+DEFAULT_HOLE_FILL_METHOD = 'closing'  # See logic.morphology.HOLE_FILL_METHODS
+DEFAULT_HOLE_FILL_CLOSING_RADIUS = 2
+DEFAULT_HIT_MISS_BACKEND = 'opencv'  # See logic.integralhitmiss.HIT_MISS_BACKENDS
+
+# Names of the settings, in the order they are stored in the settings file
+SETTINGS_FIELDS = ('gammaCorrectionValue',
+                   'blurKernelSize',
+                   'isUsingGradientEdgeDetector',
+                   'threshold1',
+                   'threshold2',
+                   'isBrightBackground',
+                   'morphCloseIterationsCount',
+                   'morphOpenIterationsCount',
+                   'morphDilateIterationsCount',
+                   'morphErodeIterationsCount',
+                   'structuringElementDontCareWidth',
+                   'markColor',
+                   'markThickness',
+                   'imageShape',
+                   'morphologicalMaskShape',
+                   'objectRotationDegreeInc',
+                   'gradientBackend',
+                   'isGrayFirst',
+                   'blurBackend',
+                   'thresholdMethod',
+                   'morphologyBackend',
+                   'holeFillMethod',
+                   'holeFillClosingRadius',
+                   'hitMissBackend')
 
 
 class Singleton(object):
@@ -56,7 +91,15 @@ class Settings(Singleton):
                  markThickness=DEFAULT_OBJECT_MARKER_THICKNESS,
                  imageShape=DEFAULT_IMAGE_SHAPE,
                  morphologicalMaskShape=DEFAULT_MORPH_CLOSE_MASK_SHAPE,
-                 objectRotationDegreeInc=DEFAULT_OBJECT_ROTATE_DEGREE_INC):
+                 objectRotationDegreeInc=DEFAULT_OBJECT_ROTATE_DEGREE_INC,
+                 gradientBackend=DEFAULT_GRADIENT_BACKEND,
+                 isGrayFirst=DEFAULT_IS_GRAY_FIRST,
+                 blurBackend=DEFAULT_BLUR_BACKEND,
+                 thresholdMethod=DEFAULT_THRESHOLD_METHOD,
+                 morphologyBackend=DEFAULT_MORPHOLOGY_BACKEND,
+                 holeFillMethod=DEFAULT_HOLE_FILL_METHOD,
+                 holeFillClosingRadius=DEFAULT_HOLE_FILL_CLOSING_RADIUS,
+                 hitMissBackend=DEFAULT_HIT_MISS_BACKEND):
         """
         Constructs a new Settings instance.
 
@@ -76,6 +119,14 @@ class Settings(Singleton):
         :param imageShape: See imageShape
         :param morphologicalMaskShape: See morphologicalMaskShape
         :param objectRotationDegreeInc: See objectRotationDegreeInc
+        :param gradientBackend: See gradientBackend
+        :param isGrayFirst: See isGrayFirst
+        :param blurBackend: See blurBackend
+        :param thresholdMethod: See thresholdMethod
+        :param morphologyBackend: See morphologyBackend
+        :param holeFillMethod: See holeFillMethod
+        :param holeFillClosingRadius: See holeFillClosingRadius
+        :param hitMissBackend: See hitMissBackend
         """
         self.gammaCorrectionValue = gammaCorrectionValue
         self.blurKernelSize = blurKernelSize
@@ -93,6 +144,14 @@ class Settings(Singleton):
         self.imageShape = imageShape
         self.morphologicalMaskShape = morphologicalMaskShape
         self.objectRotationDegreeInc = objectRotationDegreeInc
+        self.gradientBackend = gradientBackend
+        self.isGrayFirst = isGrayFirst
+        self.blurBackend = blurBackend
+        self.thresholdMethod = thresholdMethod
+        self.morphologyBackend = morphologyBackend
+        self.holeFillMethod = holeFillMethod
+        self.holeFillClosingRadius = holeFillClosingRadius
+        self.hitMissBackend = hitMissBackend
 
     @property
     def gammaCorrectionValue(self):
@@ -102,7 +161,7 @@ class Settings(Singleton):
         when object color is similar to the background color.
         gamma values < 1 will shift the image towards the darker end of the spectrum
         while gamma values > 1 will make the image appear lighter.
-        gamma = 1 means no affect.
+        gamma = 1 means no affect. (Non positive values have no meaning, and have no affect either)
         Default value is 1.3
 
         :return: Gamma correction value (Remember to invert)
@@ -339,6 +398,147 @@ class Settings(Singleton):
     def objectRotationDegreeInc(self, value):
         self.__objectRotationDegreeInc = value
 
+    @property
+    def gradientBackend(self):
+        """
+        How to calculate the gradient magnitude, when using gradient edge detector.
+        'exact' is the gradient of np.gradient, 'sobel' uses Sobel derivatives and 'l1' sums their absolute
+        values rather than calculating square root. Sobel based backends are faster, and smoother.
+        Default value is 'exact'
+
+        :return: Name of the gradient backend
+        """
+        return self.__gradientBackend
+
+    @gradientBackend.setter
+    def gradientBackend(self, value):
+        self.__gradientBackend = value
+
+    @property
+    def isGrayFirst(self):
+        """
+        A flag indicating whether to convert images to gray before blurring them (fast mode).
+        The blur, which is the most expensive step of the pre-processing, then runs on a single channel rather
+        than on three, and gamma correction and threshold are applied together in a single pass.
+        Gray is a weighted sum of the channels, so blurring it is not exactly the same as blurring the channels.
+        Binary images might differ a little at the edges of the objects. See benchmark.grayfirstreport
+        Default value is False
+
+        :return: Whether we convert images to gray before blurring them or not
+        """
+        return self.__isGrayFirst
+
+    @isGrayFirst.setter
+    def isGrayFirst(self, value):
+        self.__isGrayFirst = value
+
+    @property
+    def blurBackend(self):
+        """
+        How to blur the images. 'median' is the median of the blur kernel, while 'gaussian', 'box' and
+        'downsampled' (median over half the resolution) are faster approximations of it.
+        Use logic.objectdetectionlogic.selectBlurBackend to find the fastest one which keeps the binary images
+        close enough to those of the median.
+        Default value is 'median'
+
+        :return: Name of the blur backend
+        """
+        return self.__blurBackend
+
+    @blurBackend.setter
+    def blurBackend(self, value):
+        self.__blurBackend = value
+
+    @property
+    def thresholdMethod(self):
+        """
+        How to select the threshold of the gray-scale images. 'fixed' uses threshold1, while 'otsu' and
+        'triangle' select a threshold per image, out of its histogram, so the same settings suit different
+        lighting. 'adaptive' selects a threshold (Otsu) per tile of the image.
+        Default value is 'fixed'
+
+        :return: Name of the threshold method
+        """
+        return self.__thresholdMethod
+
+    @thresholdMethod.setter
+    def thresholdMethod(self, value):
+        self.__thresholdMethod = value
+
+    @property
+    def morphologyBackend(self):
+        """
+        Engine of the closing and opening of the binary images. 'opencv' uses cv2 erosions and dilations,
+        while 'lut' uses 3x3 lookup tables (See logic.lutmorphology) when the morphological mask is 3x3, and
+        'rle' works on the runs of foreground pixels (See logic.rlemask), which suits scenes of a few objects.
+        All of them produce the same images.
+        Default value is 'opencv'
+
+        :return: Name of the morphology backend
+        """
+        return self.__morphologyBackend
+
+    @morphologyBackend.setter
+    def morphologyBackend(self, value):
+        self.__morphologyBackend = value
+
+    @property
+    def holeFillMethod(self):
+        """
+        How to fill the holes inside the objects of the binary images. 'closing' closes them with
+        morphCloseIterationsCount iterations. 'reconstruction' closes with holeFillClosingRadius iterations only,
+        to bridge little gaps in the edges, and then fills the holes by a flood fill of the background.
+        Reconstruction is cheaper, and does not merge objects which are close to each other.
+        Default value is 'closing'
+
+        :return: Name of the hole fill method
+        """
+        return self.__holeFillMethod
+
+    @holeFillMethod.setter
+    def holeFillMethod(self, value):
+        self.__holeFillMethod = value
+
+    @property
+    def holeFillClosingRadius(self):
+        """
+        How many closing iterations to perform before filling the holes by reconstruction. See holeFillMethod
+        Default value is 2
+
+        :return: Amount of iterations
+        """
+        return self.__holeFillClosingRadius
+
+    @holeFillClosingRadius.setter
+    def holeFillClosingRadius(self, value):
+        self.__holeFillClosingRadius = value
+
+    @property
+    def hitMissBackend(self):
+        """
+        Engine of the hit & miss of the templates. 'opencv' uses cv2.MORPH_HITMISS, whose cost grows with the area
+        of the structuring element. 'integral' tests rectangles of the structuring element with four lookups of a
+        summed-area table each, and 'rle' dilates the runs of the image by the row runs of the structuring element.
+        All of them produce the same images over binary images of 0 and 255. Other images fall back to 'opencv'.
+        'rle' is the fastest, as the images hold a few objects.
+        Default value is 'opencv'
+
+        :return: Name of the hit & miss backend
+        """
+        return self.__hitMissBackend
+
+    @hitMissBackend.setter
+    def hitMissBackend(self, value):
+        self.__hitMissBackend = value
+
+    def snapshot(self):
+        """
+        Take an immutable copy of the current settings. A detection should run with a snapshot, so the
+        settings dialog can modify the settings while a detection is running.
+        :return: SettingsSnapshot
+        """
+        return SettingsSnapshot({field: getattr(self, field) for field in SETTINGS_FIELDS})
+
     def save(self):
         """
         Store settings to file
@@ -371,7 +571,15 @@ class Settings(Singleton):
                                 str(self.markThickness) + '\n',
                                 str(self.imageShape) + '\n',
                                 str(self.morphologicalMaskShape) + '\n',
-                                str(self.objectRotationDegreeInc)])
+                                str(self.objectRotationDegreeInc) + '\n',
+                                str(self.gradientBackend) + '\n',
+                                str(self.isGrayFirst) + '\n',
+                                str(self.blurBackend) + '\n',
+                                str(self.thresholdMethod) + '\n',
+                                str(self.morphologyBackend) + '\n',
+                                str(self.holeFillMethod) + '\n',
+                                str(self.holeFillClosingRadius) + '\n',
+                                str(self.hitMissBackend)])
         return self
 
     def load(self):
@@ -404,6 +612,32 @@ class Settings(Singleton):
                     self.imageShape = literal_eval(inFile.readline().strip())
                     self.morphologicalMaskShape = literal_eval(inFile.readline().strip())
                     self.objectRotationDegreeInc = int(inFile.readline().strip())
+
+                    # Settings added later are missing from files that were saved before. Keep their defaults
+                    gradientBackend = inFile.readline().strip()
+                    if gradientBackend:
+                        self.gradientBackend = gradientBackend
+                    isGrayFirst = inFile.readline().strip()
+                    if isGrayFirst:
+                        self.isGrayFirst = (isGrayFirst == 'True')
+                    blurBackend = inFile.readline().strip()
+                    if blurBackend:
+                        self.blurBackend = blurBackend
+                    thresholdMethod = inFile.readline().strip()
+                    if thresholdMethod:
+                        self.thresholdMethod = thresholdMethod
+                    morphologyBackend = inFile.readline().strip()
+                    if morphologyBackend:
+                        self.morphologyBackend = morphologyBackend
+                    holeFillMethod = inFile.readline().strip()
+                    if holeFillMethod:
+                        self.holeFillMethod = holeFillMethod
+                    holeFillClosingRadius = inFile.readline().strip()
+                    if holeFillClosingRadius:
+                        self.holeFillClosingRadius = int(holeFillClosingRadius)
+                    hitMissBackend = inFile.readline().strip()
+                    if hitMissBackend:
+                        self.hitMissBackend = hitMissBackend
             except Exception as e:
                 print('ERROR - Error has occurred while reading settings file. File has to be ' +
                       'overridden. Error:', str(e))
@@ -426,6 +660,98 @@ class Settings(Singleton):
         self.imageShape = DEFAULT_IMAGE_SHAPE
         self.morphologicalMaskShape = DEFAULT_MORPH_CLOSE_MASK_SHAPE
         self.objectRotationDegreeInc = DEFAULT_OBJECT_ROTATE_DEGREE_INC
+        self.gradientBackend = DEFAULT_GRADIENT_BACKEND
+        self.isGrayFirst = DEFAULT_IS_GRAY_FIRST
+        self.blurBackend = DEFAULT_BLUR_BACKEND
+        self.thresholdMethod = DEFAULT_THRESHOLD_METHOD
+        self.morphologyBackend = DEFAULT_MORPHOLOGY_BACKEND
+        self.holeFillMethod = DEFAULT_HOLE_FILL_METHOD
+        self.holeFillClosingRadius = DEFAULT_HOLE_FILL_CLOSING_RADIUS
+        self.hitMissBackend = DEFAULT_HIT_MISS_BACKEND
+
+
+def freezeValue(value):
+    # Shapes and colors might arrive as lists (e.g. from JSON). Tuples are hashable and compare equal to tuples
+    if isinstance(value, list):
+        return tuple(freezeValue(element) for element in value)
+    return value
+
+
+def fingerprintOf(items):
+    """
+    :param items: Iterable of (field, value) pairs
+    :return: A canonical digest of the pairs. Equal settings have equal digests, in all processes and launches
+    """
+    return hashlib.blake2b(repr(tuple(items)).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class SettingsSnapshot(object):
+    """
+    An immutable copy of Settings, taken with Settings.snapshot(). It has the same fields as Settings, so it
+    can be passed wherever settings are read.
+    The fingerprint of a snapshot identifies all of its values, and subFingerprint() identifies a subset of
+    them. e.g. the fields a pipeline stage depends on, so caches can key on the fields that matter to them.
+    """
+    __slots__ = SETTINGS_FIELDS + ('fingerprint',)
+
+    def __init__(self, values):
+        """
+        Constructs a new SettingsSnapshot
+        :param values: Dictionary of field name -> value, holding all of the SETTINGS_FIELDS
+        """
+        for field in SETTINGS_FIELDS:
+            object.__setattr__(self, field, freezeValue(values[field]))
+        object.__setattr__(self, 'fingerprint', self.subFingerprint(SETTINGS_FIELDS))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SettingsSnapshot is immutable. Use replace() to get a modified copy')
+
+    def __delattr__(self, name):
+        raise AttributeError('SettingsSnapshot is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, SettingsSnapshot) and self.fingerprint == other.fingerprint
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def __reduce__(self):
+        # Slots with a blocked __setattr__ cannot be restored by the default pickling
+        return SettingsSnapshot, (self.toDictionary(),)
+
+    def __repr__(self):
+        return 'SettingsSnapshot({})'.format(self.toDictionary())
+
+    def subFingerprint(self, fields):
+        """
+        :param fields: Names of the fields to fingerprint
+        :return: A digest of the values of the specified fields only
+        """
+        return fingerprintOf((field, getattr(self, field)) for field in fields)
+
+    def diff(self, other):
+        """
+        :param other: Another snapshot (or Settings)
+        :return: Tuple of the names of the fields whose values differ between the two, in SETTINGS_FIELDS order
+        """
+        return tuple(field for field in SETTINGS_FIELDS if getattr(self, field) != freezeValue(getattr(other, field)))
+
+    def replace(self, **changes):
+        """
+        :param changes: Field name -> new value
+        :return: A new snapshot, with the specified fields modified
+        """
+        return SettingsSnapshot(dict(self.toDictionary(), **changes))
+
+    def toDictionary(self):
+        return {field: getattr(self, field) for field in SETTINGS_FIELDS}
+
+    def snapshot(self):
+        # Already immutable, so callers can snapshot settings without checking what they got
+        return self
 
 
 # Modules are imported only once, so this variable will be a singleton of Settings.
@@ -0,0 +1,216 @@
+__author__ = "Haim Adrian"
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class Span(object):
+    """
+    A named, timed section of code. Use it as a context manager, through Tracer.span().
+    When a span completes it records its wall time, the CPU time of the executing thread and the
+    tracemalloc peak (bytes above the memory in use when the span started) while it was open.
+    Note that tracemalloc peak is process wide, so spans running in parallel threads affect each other.
+    """
+    __slots__ = ('tracer', 'name', 'args', 'threadId', 'startTime', 'startCpuTime', 'startMemory', 'wallTime',
+                 'cpuTime', 'memoryPeak', 'depth')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.threadId = threading.get_ident()
+        self.startTime = 0.0
+        self.startCpuTime = 0.0
+        self.startMemory = 0
+        self.wallTime = 0.0
+        self.cpuTime = 0.0
+        self.memoryPeak = 0  # Highest traced memory in use while the span was open (bytes, absolute)
+        self.depth = 0
+
+    def __enter__(self):
+        self.tracer.onSpanStart(self)
+        self.startCpuTime = time.thread_time()
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.wallTime = time.perf_counter() - self.startTime
+        self.cpuTime = time.thread_time() - self.startCpuTime
+        self.tracer.onSpanEnd(self)
+        return False
+
+    @property
+    def memoryPeakDelta(self):
+        """
+        :return: How many bytes above the memory in use when the span started were in use at the peak
+        """
+        return max(0, self.memoryPeak - self.startMemory)
+
+
+class NoopSpan(object):
+    """
+    The span we return when tracing is off. It does nothing, so it costs (almost) nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer(object):
+    """
+    Collects spans of the object detection pipeline, so we can see where the time (and memory) went.
+    Tracing is off by default. When it is off, span() returns a shared no-op span.
+    Spans can be exported as Chrome trace-event JSON, to be viewed with chrome://tracing or Perfetto.
+    """
+
+    def __init__(self):
+        self.isEnabled = False
+        self.isTrackingMemory = False
+        self.isTracemallocStartedByUs = False
+        self.spans = []  # Completed spans
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Stack of the open spans, per thread
+        self.epoch = time.perf_counter()
+
+    def enable(self, isTrackingMemory=True):
+        """
+        Start collecting spans
+        :param isTrackingMemory: Whether to record tracemalloc peak of the spans. This makes allocations
+        slower, so disable it when all you need is timing
+        :return: self
+        """
+        self.isTrackingMemory = isTrackingMemory
+        if isTrackingMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.isTracemallocStartedByUs = True
+        self.isEnabled = True
+        return self
+
+    def disable(self):
+        """
+        Stop collecting spans. Collected spans are kept until clear() is called
+        :return: self
+        """
+        self.isEnabled = False
+        if self.isTracemallocStartedByUs:
+            tracemalloc.stop()
+            self.isTracemallocStartedByUs = False
+        self.isTrackingMemory = False
+        return self
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+        self.epoch = time.perf_counter()
+        return self
+
+    def span(self, name, **args):
+        """
+        Create a span to be used with a "with" statement. e.g.
+            with tracer.span('blur', kernel=13):
+                ...
+        :param name: Name of the span
+        :param args: Optional arguments to attach to the span. (Exported with it)
+        :return: The span, or a no-op span when tracing is off
+        """
+        if not self.isEnabled:
+            return NOOP_SPAN
+        return Span(self, name, args)
+
+    def getStack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def onSpanStart(self, span):
+        stack = self.getStack()
+        span.depth = len(stack)
+        if self.isTrackingMemory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # Fold the peak so far into the enclosing span before we reset it for the new span
+            if stack:
+                stack[-1].memoryPeak = max(stack[-1].memoryPeak, peak)
+            tracemalloc.reset_peak()
+            span.startMemory = span.memoryPeak = current
+        stack.append(span)
+
+    def onSpanEnd(self, span):
+        stack = self.getStack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        if self.isTrackingMemory and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            span.memoryPeak = max(span.memoryPeak, peak)
+            if stack:
+                stack[-1].memoryPeak = max(stack[-1].memoryPeak, span.memoryPeak)
+            tracemalloc.reset_peak()
+        with self.lock:
+            self.spans.append(span)
+
+    def getSpans(self):
+        with self.lock:
+            return list(self.spans)
+
+    def summarize(self, spans=None):
+        """
+        Aggregate spans by name
+        :param spans: The spans to aggregate. Default is all of the collected spans
+        :return: Dictionary of span name -> {'count', 'wallMs', 'cpuMs', 'memoryPeakBytes'}, where times are
+        the totals of all spans with that name and memory is the highest peak among them
+        """
+        summary = {}
+        for span in (self.getSpans() if spans is None else spans):
+            entry = summary.setdefault(span.name, {'count': 0, 'wallMs': 0.0, 'cpuMs': 0.0, 'memoryPeakBytes': 0})
+            entry['count'] += 1
+            entry['wallMs'] += span.wallTime * 1000.0
+            entry['cpuMs'] += span.cpuTime * 1000.0
+            entry['memoryPeakBytes'] = max(entry['memoryPeakBytes'], span.memoryPeakDelta)
+        return summary
+
+    def toChromeTrace(self):
+        """
+        :return: The collected spans as a Chrome trace-event dictionary (complete events, "ph": "X")
+        """
+        processId = os.getpid()
+        events = []
+        for span in self.getSpans():
+            args = {key: str(value) for key, value in span.args.items()}
+            args['cpuMs'] = round(span.cpuTime * 1000.0, 3)
+            if self.isTrackingMemory or span.memoryPeak > 0:
+                args['memoryPeakBytes'] = span.memoryPeakDelta
+            events.append({'name': span.name,
+                           'cat': 'detection',
+                           'ph': 'X',
+                           'ts': round((span.startTime - self.epoch) * 1e6, 3),
+                           'dur': round(span.wallTime * 1e6, 3),
+                           'pid': processId,
+                           'tid': span.threadId,
+                           'args': args})
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def exportChromeTrace(self, outFilePath):
+        """
+        Store the collected spans as Chrome trace-event JSON
+        :param outFilePath: Path of the file to store the trace to
+        :return: self
+        """
+        print('INFO - Storing trace to file:', outFilePath)
+        with open(outFilePath, 'w') as outFile:
+            json.dump(self.toChromeTrace(), outFile)
+        return self
+
+
+# Modules are imported only once, so this variable will be a singleton of Tracer.
+tracer = Tracer()
@@ -1,6 +1,7 @@
 __author__ = "Haim Adrian"
 
 import tkinter as tk
+import tkinter.ttk as ttk
 
 
 BACKGROUND_COLOR = '#3C3F41'
@@ -142,6 +143,25 @@ def spinBox(master, values, width, validate_command, side=None):
     return spinbox
 
 
+def comboBox(master, values, width):
+    """
+    A utility method used for creating a read-only combobox under a specified master, with dark background.
+    (The dark style of TCombobox is configured by the main dialog)
+    :param master: Owner of the created combobox
+    :param values: A tuple containing the values to select from
+    :param width: The width of the combobox
+    :return: The created combobox, followed by its StringVar
+    """
+    combo_var = tk.StringVar()
+    combobox = ttk.Combobox(master=master,
+                            values=values,
+                            width=width,
+                            font=FONT_REGULAR,
+                            state='readonly',
+                            textvariable=combo_var)
+    return combobox, combo_var
+
+
 def center(window):
     """
     Centers a tkinter window within the screen
@@ -9,13 +9,21 @@ import tkinter.filedialog as tkfiledialog
 
 
 class FileInput(tk.Frame):
-    def __init__(self, master, tooltip, imageOnly=True):
+    def __init__(self, master, tooltip, imageOnly=True, changeConsumer=None):
+        """
+        Constructs a new FileInput
+        :param master: Owner of the input
+        :param tooltip: Tooltip of the entry and the button
+        :param imageOnly: Whether to select images only, or videos too
+        :param changeConsumer: Optional. Called with the selected file path whenever it changes
+        """
         tk.Frame.__init__(self, master)
 
         self.background = ctl.BACKGROUND_COLOR
         self.configure(background=ctl.BACKGROUND_COLOR)
 
         self.imageOnly = imageOnly
+        self.changeConsumer = changeConsumer
         self.openFileButton = None  # tk.Button
         self.filePathEntry = None  # tk.Entry
         self.openFileButtonTooltip = None  # view.tooltip.Tooltip
@@ -24,7 +32,10 @@ class FileInput(tk.Frame):
 
         self.magnifyingIcon = tk.PhotoImage(file=os.path.abspath(
             os.path.join('resource', 'magnifying-icon.png')))
+        self.filePathVariable = tk.StringVar(self)
+        self.filePathVariable.trace_add('write', self.onFilePathChanged)
         self.filePathEntry = ctl.entry(self)
+        self.filePathEntry.configure(textvariable=self.filePathVariable)
         self.filePathEntry.pack(fill=tk.X, side=tk.LEFT, expand=True)
         self.filePathEntryTooltip = Tooltip(self.filePathEntry, tooltip)
 
@@ -50,6 +61,10 @@ class FileInput(tk.Frame):
         self.filePathEntry.delete(0, tk.END)
         self.filePathEntry.insert(0, fileName)
 
+    def onFilePathChanged(self, *args):
+        if self.changeConsumer is not None:
+            self.changeConsumer(self.getSelectedFilePath())
+
     def getSelectedFilePath(self):
         return self.filePathEntry.get().strip()
 
@@ -1,26 +1,103 @@
 __author__ = "Haim Adrian"
 
 import os
+import queue
+import threading
 import tkinter as tk
 import tkinter.ttk as ttk
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
 from tkinter.ttk import Style
 
-import cv2
 import numpy as np
 from matplotlib import pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-from matplotlib.figure import Figure
 
 import view.controls as ctl
+from logic.detectionprocess import DetectionProcess
 from logic.objectdetectionlogic import runObjectDetection
+from util.cancellation import CancellationToken, DetectionCancelledError
+from util.imageprefetcher import ImagePrefetcher
 from util.settings import Settings
 from view.fileinput import FileInput
+from view.resultpanel import ResultPanel
 from view.settingsdialog import SettingsDialog
 from view.tooltip import Tooltip
 
 TITLE = 'Morphological Object Detector'
+# Virtual event through which background threads wake the GUI thread up, to drain the events queue
+DETECTION_EVENT = '<<DetectionEvent>>'
+
+# Kinds of events a detection job posts to the GUI thread
+STATUS_EVENT = 'status'
+PROGRESS_EVENT = 'progress'
+OUTCOME_EVENT = 'outcome'
+PARTIAL_EVENT = 'partial'
+ERROR_EVENT = 'error'
+FINISHED_EVENT = 'finished'
+
+
+class DetectionJobManager(object):
+    """
+    Runs detection jobs one after the other, on a background executor. A new job is either queued after the
+    running one, or it supersedes it: the running and the queued jobs are cancelled, so an obsolete detection
+    stops at its next cancellation check rather than completing the whole sweep.
+    """
+
+    def __init__(self, finishedConsumer=None):
+        """
+        Constructs a new DetectionJobManager
+        :param finishedConsumer: Optional. Called (from the executor thread) whenever a job has finished, after
+        it was removed from the pending jobs, so isIdle already reflects it
+        """
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='DetectionJob')
+        self.tokens = []  # Tokens of the jobs that were submitted and have not finished yet. Oldest first
+        self.lock = threading.Lock()
+        self.finishedConsumer = finishedConsumer
+
+    def submit(self, job, isSuperseding=False):
+        """
+        Submit a job
+        :param job: Function receiving the CancellationToken of the job
+        :param isSuperseding: Whether to cancel the running and queued jobs, or to queue after them
+        :return: The CancellationToken of the job
+        """
+        token = CancellationToken()
+        with self.lock:
+            if isSuperseding:
+                for pendingToken in self.tokens:
+                    pendingToken.cancel()
+            self.tokens.append(token)
+
+        self.executor.submit(self.runJob, job, token)
+        return token
+
+    def runJob(self, job, token):
+        try:
+            # A job that was cancelled while it was queued is skipped altogether
+            if not token.isCancelled():
+                job(token)
+        finally:
+            with self.lock:
+                self.tokens.remove(token)
+            if self.finishedConsumer is not None:
+                self.finishedConsumer()
+
+    def cancelAll(self):
+        with self.lock:
+            for token in self.tokens:
+                token.cancel()
+
+    def isIdle(self):
+        with self.lock:
+            return not self.tokens
+
+    def getPendingCount(self):
+        with self.lock:
+            return len(self.tokens)
+
+    def shutdown(self):
+        self.cancelAll()
+        self.executor.shutdown(wait=False)
 
 
 class MainDialog(tk.Frame):
@@ -45,10 +122,16 @@ class MainDialog(tk.Frame):
         self.progressBar = None  # tk.Progressbar
         self.settingsButton = None  # tk.Button
         self.goButton = None  # tk.Button
+        self.stopButton = None  # tk.Button
+        self.supersedeCheckButton = None  # tk.Checkbutton
+        self.supersedeCheckVar = None  # tk.IntVar. Whether a new run cancels the running one, or is queued
+        self.processCheckButton = None  # tk.Checkbutton
+        self.processCheckVar = None  # tk.IntVar. Whether to run the detection in a separate process
         self.openObj1FileButton = None  # tk.Button
         self.popupImageButton = None  # tk.Button
         self.settingsButtonTooltip = None  # view.tooltip.Tooltip
         self.goButtonTooltip = None  # view.tooltip.Tooltip
+        self.stopButtonTooltip = None  # view.tooltip.Tooltip
         self.popupImageButtonTooltip = None  # view.tooltip.Tooltip
         self.filePathObj1Entry = None  # tk.Entry
         self.filePathObj2Entry = None  # tk.Entry
@@ -57,9 +140,12 @@ class MainDialog(tk.Frame):
         self.playIcon = None  # tk.PhotoImage
         self.popoutIcon = None  # tk.PhotoImage
         self.settingsIcon = None  # tk.PhotoImage
-        self.figure = None  # A reference to pyplot figure, so we can destroy it
+        self.resultPanel = None  # view.resultpanel.ResultPanel. Created when there is a first outcome to show
         self.style = None  # tk.ttk.Style
         self.isRunning = False  # Indication of when we wait for the worker to finish
+        self.events = queue.Queue()  # Events (kind, value, token) posted by the detection jobs to the GUI thread
+        self.isWakeUpPending = threading.Event()  # Set when the GUI thread was woken up and has not drained yet
+        self.jobManager = DetectionJobManager(lambda: self.postEvent(FINISHED_EVENT))  # Runs the detections
         self.obj1 = None  # A reference to the input image. It is being set by the action
         self.obj2 = None  # A reference to the input image. It is being set by the action
         self.image = None  # A reference to the input image. It is being set by the action
@@ -71,7 +157,8 @@ class MainDialog(tk.Frame):
         self.hitMissObj1 = None  # A reference to the processed image (outcome).
         self.hitMissObj2 = None  # A reference to the processed image (outcome).
         self.imageMarks = None  # A reference to the processed image (outcome).
-        self.error = False  # Indication for a failure during algorithm
+        self.imagePrefetcher = ImagePrefetcher()  # Decodes the selected files while the user is still selecting
+        self.detectionProcess = DetectionProcess()  # Runs the detections out of the GUI process, when selected
         self.progressTextFormat = '{0}%'
 
         self.style = Style(master)
@@ -105,6 +192,8 @@ class MainDialog(tk.Frame):
         self.createWorkAreaSection(master)
 
         master.bind('<Return>', self.onEnterPressed)
+        master.bind(DETECTION_EVENT, self.drainEvents)
+        toplevel.protocol('WM_DELETE_WINDOW', self.onClose)
         master.geometry("1000x800")
 
     def createTitleSection(self, master):
@@ -129,11 +218,15 @@ class MainDialog(tk.Frame):
         self.actionFrame = ctl.frame(master, tk.X)
         self.magnifyingIcon = tk.PhotoImage(file=os.path.abspath(
             os.path.join('resource', 'magnifying-icon.png')))
-        self.filePathObj1Entry = FileInput(self.actionFrame, "Select First Object")
+        self.filePathObj1Entry = FileInput(self.actionFrame, "Select First Object",
+                                           changeConsumer=lambda path: self.imagePrefetcher.prefetch(path))
         self.filePathObj1Entry.pack(fill=tk.X, side=tk.TOP, expand=False)
-        self.filePathObj2Entry = FileInput(self.actionFrame, "Select Second Object")
+        self.filePathObj2Entry = FileInput(self.actionFrame, "Select Second Object",
+                                           changeConsumer=lambda path: self.imagePrefetcher.prefetch(path))
         self.filePathObj2Entry.pack(fill=tk.X, side=tk.TOP, expand=False)
-        self.filePathImageEntry = FileInput(self.actionFrame, "Select Image or Video")
+        self.filePathImageEntry = FileInput(self.actionFrame, "Select Image or Video",
+                                            changeConsumer=lambda path: self.imagePrefetcher.prefetch(
+                                                path, shape=self.settings.imageShape))
         self.filePathImageEntry.pack(fill=tk.X, side=tk.TOP, expand=False)
 
         # Get a second line in the actions area, so the checkbox will be under the entry
@@ -149,6 +242,14 @@ class MainDialog(tk.Frame):
         self.goButtonTooltip = Tooltip(self.goButton, 'Run')
         self.goButton.pack(side=tk.RIGHT)
 
+        self.stopButton = ttk.Button(master=helper_frame,
+                                     text='Stop',
+                                     command=self.onStopPressed,
+                                     style='TButton')
+        self.stopButtonTooltip = Tooltip(self.stopButton, 'Cancel the running and the queued detections')
+        self.stopButton.pack(side=tk.RIGHT)
+        self.stopButton['state'] = 'disabled'
+
         self.settingsIcon = tk.PhotoImage(file=os.path.abspath(
             os.path.join('resource', 'settings-icon.png')))
         self.settingsButton = ttk.Button(master=helper_frame,
@@ -168,6 +269,15 @@ class MainDialog(tk.Frame):
                                                'Pops out the image with as a pyplot dialog')
         self.popupImageButton.pack(side=tk.LEFT)
         self.popupImageButton['state'] = 'disabled'
+
+        self.supersedeCheckButton, self.supersedeCheckVar = \
+            ctl.checkButton(helper_frame, 'New run cancels the running detection')
+        self.supersedeCheckVar.set(1)
+        self.supersedeCheckButton.pack(side=tk.LEFT)
+
+        self.processCheckButton, self.processCheckVar = \
+            ctl.checkButton(helper_frame, 'Run detection in a separate process')
+        self.processCheckButton.pack(side=tk.LEFT)
         helper_frame.pack(fill=tk.X, side=tk.TOP, expand=False)
 
     def createStatusSection(self, master):
@@ -235,28 +345,26 @@ class MainDialog(tk.Frame):
     def startProgress(self):
         """
         Prepare for starting a progress in the progress bar, for visualizing process.
-        We also start checking the job queue to detect if the algorithm has finished its execution
-        so we can display the outcome
+        The outcome is displayed once the job posts it. See drainEvents
         :return: None
         """
         self.setUserComponentsState('disabled')
         self.image = self.obj1 = self.obj2 = self.objectsImage = self.objectsBinaryImage = \
             self.objectsClosingImage = self.imageBinary = self.imageClosing = self.imageMarks = None
         self.isRunning = True
-        self.periodicallyCheckOutcome()
-
-        if self.figure is not None:
-            self.figure.set_visible(False)
-            self.figure.clear()
-            self.figure = None
+        self.clearFigure()
 
-            # Remove all children so we will not have issues with pyplot's painting
-            for child in self.figureFrame.winfo_children():
-                child.destroy()
+    def clearFigure(self):
+        """
+        Remove the plots of a previous outcome
+        :return: None
+        """
+        if self.resultPanel is not None:
+            self.resultPanel.clear()
 
     def stopProgress(self):
         """
-        Stops the progress of the progress bar, and the periodic check of the job queue
+        Stops the progress of the progress bar, once there are no more queued jobs
         :return: None
         """
         self.progressBar['value'] = 0
@@ -266,26 +374,42 @@ class MainDialog(tk.Frame):
     def setUserComponentsState(self, new_state):
         """
         Sets the state of user components to 'normal' or 'disabled'.
-        When the algorithm is running in background, we disable the user components so there
-        won't be a mess
+        When the algorithm is running in background, we disable the components acting on the outcome.
+        The inputs stay enabled, so user can queue another run (or replace the running one)
         :param new_state: The new state to set. Can be one of 'normal' or 'disabled'
         :return: None
         """
-        self.goButton['state'] = new_state
         self.popupImageButton['state'] = new_state
-        self.filePathObj1Entry.setState(new_state)
-        self.filePathObj2Entry.setState(new_state)
-        self.filePathImageEntry.setState(new_state)
+        self.stopButton['state'] = 'normal' if new_state == 'disabled' else 'disabled'
 
     def showSettingsDialog(self):
         """
-        Displaying Settings dialog so user can customize the algorithm settings
+        Displaying Settings dialog so user can customize the algorithm settings.
+        When the selected files are valid images, the dialog previews the settings on them
         :return: None
         """
-        settings = SettingsDialog(self.master).result
+        dialog = SettingsDialog(self.master, self.readPreviewImages())
+        settings = dialog.result
         if settings:
             self.settings = settings
             self.settings.save()
+            if dialog.isRunRequested:
+                self.onEnterPressed()
+
+    def readPreviewImages(self):
+        """
+        :return: Tuple of the selected images (obj1, obj2, image), or None when one of them cannot be read
+        """
+        filePaths = (self.filePathObj1Entry.getSelectedFilePath(),
+                     self.filePathObj2Entry.getSelectedFilePath(),
+                     self.filePathImageEntry.getSelectedFilePath())
+        if not all(os.path.isfile(filePath) for filePath in filePaths):
+            return None
+
+        images = (self.imagePrefetcher.readImage(filePaths[0]),
+                  self.imagePrefetcher.readImage(filePaths[1]),
+                  self.imagePrefetcher.readImage(filePaths[2], shape=self.settings.imageShape))
+        return images if all(image is not None for image in images) else None
 
     def onEnterPressed(self, event=None):
         """
@@ -311,19 +435,50 @@ class MainDialog(tk.Frame):
         obj2FilePath = self.filePathObj2Entry.getSelectedFilePath()
         imageFilePath = self.filePathImageEntry.getSelectedFilePath()
         if isValidFile(obj1FilePath) and isValidFile(obj2FilePath) and isValidFile(imageFilePath):
+            isSuperseding = bool(self.supersedeCheckVar.get())
+            if self.isRunning and not isSuperseding:
+                self.updateStatus('Queued. {} detection(s) ahead'.format(self.jobManager.getPendingCount()))
+            elif self.isRunning:
+                # Images of the superseded detection must not stay under the status of the new one
+                self.clearFigure()
+
+            # Run it in background so the progress bar will not get blocked.
+            # (We cannot block te gui thread)
+            # The job gets a snapshot of the settings, so editing them meanwhile does not affect it
+            settings = self.settings.snapshot()
+            isInProcess = bool(self.processCheckVar.get())
+            self.jobManager.submit(lambda token: self.executeObjectCounterUsingMorphOperator(obj1FilePath,
+                                                                                             obj2FilePath,
+                                                                                             imageFilePath,
+                                                                                             settings,
+                                                                                             token,
+                                                                                             isInProcess),
+                                   isSuperseding)
             if not self.isRunning:
                 self.startProgress()
 
-                # Run it in background so the progress bar will not get blocked.
-                # (We cannot block te gui thread)
-                t = Thread(target=self.executeObjectCounterUsingMorphOperator, args=(obj1FilePath,
-                                                                                     obj2FilePath,
-                                                                                     imageFilePath))
-                t.start()
-            else:
-                print('WARN - Already running. Cannot run multiple detections in parallel.')
+    def onStopPressed(self):
+        """
+        Cancel the running detection and the queued ones. The running detection stops at its next
+        cancellation check, which is a matter of milliseconds
+        :return: None
+        """
+        self.jobManager.cancelAll()
+
+    def onClose(self):
+        """
+        This event is raised when user closes the window. The running and queued detections are cancelled,
+        and the background workers are stopped: the job executor, the detection process (which holds shared
+        memory) and the image prefetcher
+        :return: None
+        """
+        self.jobManager.shutdown()
+        self.detectionProcess.shutdown()
+        self.imagePrefetcher.shutdown()
+        self.winfo_toplevel().destroy()
 
-    def executeObjectCounterUsingMorphOperator(self, obj1FilePath, obj2FilePath, imageFilePath):
+    def executeObjectCounterUsingMorphOperator(self, obj1FilePath, obj2FilePath, imageFilePath, settings,
+                                               cancellationToken, isInProcess=False):
         """
         The job of executing Harris Detector algorithm.
         It takes time so we have a specific action for that, such that we can run it using a
@@ -331,91 +486,128 @@ class MainDialog(tk.Frame):
         :param obj1FilePath: Path to the selected first object
         :param obj2FilePath: Path to the selected second object
         :param imageFilePath: Path to the selected image
+        :param settings: SettingsSnapshot to run the detection with
+        :param cancellationToken: CancellationToken of the job
+        :param isInProcess: Whether to run the detection in the detection process rather than in this thread.
+        The detection competes with the GUI over the GIL, which makes the GUI stutter while it is running
         :return: None
         """
-        self.obj1 = cv2.imread(obj1FilePath)
-        self.obj2 = cv2.imread(obj2FilePath)
-        self.image = cv2.resize(cv2.imread(imageFilePath), self.settings.imageShape)
-
-        # To make the line shorter.........
-        a, b, c, d, e, f, g, h = runObjectDetection(self.obj1,
-                                                    self.obj2,
-                                                    self.image,
-                                                    self.settings,
-                                                    lambda text: self.updateStatus(text),
-                                                    lambda progress: self.updateProgress(progress))
-        self.objectsImage = a
-        self.objectsBinaryImage = b
-        self.objectsClosingImage = c
-        self.imageBinary = d
-        self.imageClosing = e
-        self.hitMissObj1 = f
-        self.hitMissObj2 = g
-        self.imageMarks = h
-
-        if self.image is None or self.objectsImage is None:
-            self.error = True
-
-        self.stopProgress()
-
-    def showImages(self):
+        # Images were prefetched when they were selected, and decoded images are cached, so running
+        # again with the same files skips the decoding
+        obj1 = self.imagePrefetcher.readImage(obj1FilePath)
+        obj2 = self.imagePrefetcher.readImage(obj2FilePath)
+        image = self.imagePrefetcher.readImage(imageFilePath, shape=settings.imageShape)
+
+        def postJobEvent(kind, value=None):
+            # Events of the job are dropped once it is cancelled, even when they were already posted
+            self.postEvent(kind, value, cancellationToken)
+
+        detect = self.detectionProcess.detect if isInProcess else runObjectDetection
+        try:
+            outcome = detect(obj1,
+                             obj2,
+                             image,
+                             settings,
+                             lambda text: postJobEvent(STATUS_EVENT, text),
+                             lambda progress: postJobEvent(PROGRESS_EVENT, progress),
+                             cancellationToken=cancellationToken,
+                             partialResultConsumer=lambda images, obj1Centroids: postJobEvent(PARTIAL_EVENT,
+                                                                                              images))
+        except DetectionCancelledError:
+            self.postEvent(STATUS_EVENT, 'Detection was cancelled')
+            return
+        except Exception as e:
+            print('ERROR - Error has occurred while running detection:', str(e))
+            postJobEvent(ERROR_EVENT)
+            return
+
+        if image is None or outcome[0] is None:
+            postJobEvent(ERROR_EVENT)
+        else:
+            # The whole outcome is handed over at once, so the GUI never sees a partial one
+            postJobEvent(OUTCOME_EVENT, (obj1, obj2, image) + tuple(outcome))
+
+    def postEvent(self, kind, value=None, token=None):
         """
-        When Harris Detector job has finished we display the results as embedded figure
+        Post an event to the GUI thread. Can be called from any thread.
+        The GUI thread is woken up once, and it drains all of the events that were posted until then
+        :param kind: Kind of the event. e.g. STATUS_EVENT
+        :param value: Value of the event. e.g. the status text
+        :param token: Optional. CancellationToken of the job posting the event. The event is dropped when the
+        job is cancelled (superseded or stopped) before the GUI thread gets to it
         :return: None
         """
-        self.figure = Figure(figsize=(5, 5), dpi=100)
-        axes = self.figure.add_subplot(241, title='Objects')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.objectsImage[:, :, ::-1]))  # -1 means BGRtoRGB
-        axes = self.figure.add_subplot(242, title='Objects Binary')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.objectsBinaryImage), cmap="gray")
-        axes = self.figure.add_subplot(243, title='Objects Closing (Morph)')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.objectsClosingImage), cmap="gray")
-        axes = self.figure.add_subplot(244, title='Obj1 Hit&Miss in Image')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.hitMissObj1), cmap="gray")
-        axes = self.figure.add_subplot(245, title='Image Marks')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.imageMarks[:, :, ::-1]))  # -1 means BGRtoRGB
-        axes = self.figure.add_subplot(246, title='Image Binary')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.imageBinary), cmap="gray")
-        axes = self.figure.add_subplot(247, title='Image Closing (Morph)')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.imageClosing), cmap="gray")
-        axes = self.figure.add_subplot(248, title='Obj2 Hit&Miss in Image')
-        axes.axis("off")
-        axes.imshow(np.uint8(self.hitMissObj2), cmap="gray")
-
-        self.figure.subplots_adjust(0.05, 0.1, 0.95, 0.9, 0.2, 0.25)
-        canvas = FigureCanvasTkAgg(self.figure, self.figureFrame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(side=tk.BOTTOM, fill=tk.BOTH, expand=True)
-        toolbar = NavigationToolbar2Tk(canvas, self.figureFrame)
-        toolbar.update()
-        canvas._tkcanvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-
-    def periodicallyCheckOutcome(self):
-        """
-        Check every 200 ms if there is something new to show, which means a worker
-        has finished and we can pick the output and show it in the GUI
-        """
-        if self.error:
-            self.error = False
-            self.stopProgress()
-            messagebox.showerror('Error', 'Error has occurred while trying to detect corners')
-            self.image = self.objectsImage = None
-            return None
+        self.events.put((kind, value, token))
+        if not self.isWakeUpPending.is_set():
+            self.isWakeUpPending.set()
+            try:
+                self.master.event_generate(DETECTION_EVENT, when='tail')
+            except (tk.TclError, RuntimeError):
+                # The main loop has already ended (window was closed), there is no one to wake up
+                pass
 
-        if self.image is not None and self.objectsImage is not None:
-            self.stopProgress()
-            # Plot the images, embedded within our dialog rather than popping up another dialog.
-            self.showImages()
+    def drainEvents(self, event=None):
+        """
+        Handle the events which were posted by the detection jobs. Runs on the GUI thread.
+        Progress events are coalesced, there is no point in painting progress values that were already passed
+        :param event: The virtual event that woke us up (Not in use)
+        :return: None
+        """
+        # Clear first, so an event that is posted while we drain wakes us up again
+        self.isWakeUpPending.clear()
+
+        progress = None
+        while True:
+            try:
+                kind, value, token = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if token is not None and token.isCancelled():
+                continue
+
+            if kind == PROGRESS_EVENT:
+                progress = value
+                continue
+
+            if progress is not None:
+                self.updateProgress(progress)
+                progress = None
+
+            if kind == STATUS_EVENT:
+                self.updateStatus(value)
+            elif kind == ERROR_EVENT:
+                messagebox.showerror('Error', 'Error has occurred while trying to detect objects')
+            elif kind == OUTCOME_EVENT:
+                self.obj1, self.obj2, self.image, self.objectsImage, self.objectsBinaryImage, \
+                    self.objectsClosingImage, self.imageBinary, self.imageClosing, self.hitMissObj1, \
+                    self.hitMissObj2, self.imageMarks = value
+
+                # Plot the images, embedded within our dialog rather than popping up another dialog.
+                self.showImages(value[3:])
+            elif kind == PARTIAL_EVENT:
+                # Results of the first object, while the second one is still being swept
+                self.showImages(value)
+            elif kind == FINISHED_EVENT and self.isRunning and self.jobManager.isIdle():
+                self.stopProgress()
+
+        if progress is not None:
+            self.updateProgress(progress)
+
+    def showImages(self, outcome):
+        """
+        When Harris Detector job has finished we display the results as embedded figure
+        :param outcome: The images returned by runObjectDetection, or the partial ones (with None for the
+        images that are not ready yet)
+        :return: None
+        """
+        # The panel is created once, and later outcomes are updated in place
+        if self.resultPanel is None:
+            self.resultPanel = ResultPanel(self.figureFrame)
 
-        if self.isRunning:
-            self.master.after(50, self.periodicallyCheckOutcome)
+        objsImg, objsBinaryImg, objsClosingImg, imgBinary, imgClosing, hitMissObj1, hitMissObj2, imgMarks = outcome
+        self.resultPanel.showImages((objsImg, objsBinaryImg, objsClosingImg, hitMissObj1, imgMarks, imgBinary,
+                                     imgClosing, hitMissObj2))
 
     def popupImage(self):
         """
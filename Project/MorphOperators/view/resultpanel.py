@@ -0,0 +1,114 @@
+__author__ = "Haim Adrian"
+
+import tkinter as tk
+
+import cv2
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
+
+# Title of each plot, and whether its image is a BGR (color) image or a grayscale one. In outcome order
+RESULT_PLOTS = (('Objects', True),
+                ('Objects Binary', False),
+                ('Objects Closing (Morph)', False),
+                ('Obj1 Hit&Miss in Image', False),
+                ('Image Marks', True),
+                ('Image Binary', False),
+                ('Image Closing (Morph)', False),
+                ('Obj2 Hit&Miss in Image', False))
+
+
+def downsampleToFit(image, width, height):
+    """
+    Downsample an image so it is not bigger than the specified size (pixels), keeping its aspect ratio.
+    There is no point in handing matplotlib more pixels than it can paint, it would only resample them again.
+    :param image: The image to downsample
+    :param width: Width (pixels) available for the image
+    :param height: Height (pixels) available for the image
+    :return: The downsampled image, or the image itself when it already fits
+    """
+    scale = min(width / image.shape[1], height / image.shape[0])
+    if scale >= 1:
+        return image
+
+    shape = (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale)))
+    return cv2.resize(image, shape, interpolation=cv2.INTER_AREA)
+
+
+class ResultPanel(object):
+    """
+    The embedded figure displaying the outcome of a detection. The figure, its canvas and its toolbar are
+    created once. Next outcomes replace the data of the existing images, and when the displayed shapes have not
+    changed, only the images are repainted (blitting) rather than the whole figure.
+    """
+
+    def __init__(self, master):
+        """
+        Constructs a new ResultPanel
+        :param master: Frame to add the canvas and the toolbar to
+        """
+        self.figure = Figure(figsize=(5, 5), dpi=100)
+        for index, (title, _) in enumerate(RESULT_PLOTS):
+            axes = self.figure.add_subplot(241 + index, title=title)
+            axes.axis("off")
+        self.figure.subplots_adjust(0.05, 0.1, 0.95, 0.9, 0.2, 0.25)
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master)
+        self.canvas.get_tk_widget().pack(side=tk.BOTTOM, fill=tk.BOTH, expand=True)
+        self.toolbar = NavigationToolbar2Tk(self.canvas, master)
+        self.toolbar.update()
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.canvas.draw()
+
+    def showImages(self, images):
+        """
+        Display the images of an outcome
+        :param images: The eight images of the outcome, ordered as RESULT_PLOTS. A partial outcome has None
+        for the images which are not ready yet. Those plots are left empty
+        :return: None
+        """
+        isFullDrawRequired = False
+        for axes, (_, isColor), image in zip(self.figure.axes, RESULT_PLOTS, images):
+            if image is None:
+                # Hiding a painted image requires painting the figure, blitting only paints over
+                for axesImage in axes.images:
+                    isFullDrawRequired = isFullDrawRequired or axesImage.get_visible()
+                    axesImage.set_visible(False)
+                continue
+
+            # The size of the axes in pixels. It changes when the window is resized
+            image = downsampleToFit(np.uint8(image), axes.bbox.width, axes.bbox.height)
+            if isColor:
+                image = image[:, :, ::-1]  # -1 means BGRtoRGB
+
+            if axes.images and axes.images[0].get_array().shape == image.shape:
+                axesImage = axes.images[0]
+                axesImage.set_data(image)
+                axesImage.set_visible(True)
+                if not isColor:
+                    axesImage.autoscale()  # Stretch the gray levels as imshow does
+            else:
+                # A new shape means new limits for the axes, so the whole figure has to be painted
+                for axesImage in axes.images:
+                    axesImage.remove()
+                axes.imshow(image, cmap=None if isColor else "gray")
+                isFullDrawRequired = True
+
+        if isFullDrawRequired:
+            self.canvas.draw()
+        else:
+            # Images are opaque and keep their extent, so painting them over the previous ones is enough
+            for axes, image in zip(self.figure.axes, images):
+                if image is not None:
+                    axes.draw_artist(axes.images[0])
+                    self.canvas.blit(axes.bbox)
+
+    def clear(self):
+        """
+        Hide the images of a previous outcome
+        :return: None
+        """
+        for axes in self.figure.axes:
+            for axesImage in axes.images:
+                axesImage.set_visible(False)
+        self.canvas.draw_idle()
@@ -6,9 +6,35 @@ from ast import literal_eval
 from tkinter import messagebox
 
 import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 
 import view.controls as ctl
-from util.settings import settingsInstance
+from logic.functions import BLUR_BACKENDS, GRADIENT_BACKENDS
+from logic.integralhitmiss import HIT_MISS_BACKENDS
+from logic.morphology import HOLE_FILL_METHODS, MORPHOLOGY_BACKENDS
+from logic.objectdetectionlogic import runPreview, selectBlurBackend
+from logic.thresholding import THRESHOLD_METHODS
+from util.settings import SettingsSnapshot, settingsInstance
+
+# How long to wait after the last edit before we update the preview, so typing does not recompute every key
+PREVIEW_DEBOUNCE_MS = 150
+PREVIEW_TITLES = ('Objects Binary', 'Objects Closing (Morph)', 'Image Binary', 'Image Closing (Morph)')
+
+# Ranges [start, end] of the numeric editors. Validators check them when the editors lose focus, and the preview
+# checks them as the user types
+EDITOR_RANGES = {'gammaCorrectionValue': (-2.5, 2.5),
+                 'blurKernelSize': (1, 40),
+                 'threshold1': (0, 255),
+                 'threshold2': (0, 255),
+                 'morphCloseIterationsCount': (1, 20),
+                 'morphOpenIterationsCount': (1, 20),
+                 'morphDilateIterationsCount': (1, 20),
+                 'morphErodeIterationsCount': (1, 20),
+                 'structuringElementDontCareWidth': (1, 15),
+                 'markThickness': (1, 20),
+                 'objectRotationDegreeInc': (1, 91),
+                 'holeFillClosingRadius': (1, 20)}
 
 
 def resetText(widget, value):
@@ -86,7 +112,13 @@ def numericInRangeValidator(widget, oldText, newText, start, end):
 
 
 class SettingsDialog(tk.Toplevel):
-    def __init__(self, parent):
+    def __init__(self, parent, previewImages=None):
+        """
+        Constructs (and shows) a new SettingsDialog
+        :param parent: Parent window
+        :param previewImages: Optional tuple of BGR images (obj1, obj2, image). When specified, the dialog
+        previews the binary and closing images of the edited settings, at a reduced resolution
+        """
         tk.Toplevel.__init__(self, parent)
 
         # Hide the dialog in the task bar. Let it be an inner window of the parent window
@@ -102,14 +134,26 @@ class SettingsDialog(tk.Toplevel):
         self.closing = False  # Marker to see if we cancel the window, to avoid of validating input
         self.gammaCorrectionValueSpinbox = None  # tk.Spinbox
         self.blurKernelSizeSpinbox = None  # tk.Spinbox
+        self.blurBackendCombobox = None  # ttk.Combobox
+        self.blurBackendVar = None  # tk.StringVar - to hold the value of the blur backend combobox
+        self.fastestBlurButton = None  # tk.Button - selects the fastest blur backend. See selectFastestBlur
+        self.grayFirstCheckVar = None  # tk.IntVar - to hold the value of the gray first checkbox
+        self.grayFirstCheckButton = None  # tk.Checkbutton
         self.gradientEdgeCheckVar = None  # tk.IntVar - to hold the value of the gradient checkbox
         self.gradientEdgeCheckButton = None  # tk.Checkbutton
+        self.gradientBackendCombobox = None  # ttk.Combobox
+        self.gradientBackendVar = None  # tk.StringVar - to hold the value of the gradient backend combobox
         self.threshold1Spinbox = None  # tk.Spinbox
         self.threshold2Spinbox = None  # tk.Spinbox
+        self.thresholdMethodCombobox = None  # ttk.Combobox
+        self.thresholdMethodVar = None  # tk.StringVar - to hold the value of the threshold method combobox
         self.brightBackgroundCheckVar = None  # tk.IntVar - to hold the value of the bright checkbox
         self.brightBackgroundCheckButton = None  # tk.Checkbutton
         self.morphCloseIterationsCountSpinbox = None  # tk.Spinbox
         self.morphOpenIterationsCountSpinbox = None  # tk.Spinbox
+        self.holeFillMethodCombobox = None  # ttk.Combobox
+        self.holeFillMethodVar = None  # tk.StringVar - to hold the value of the hole fill method combobox
+        self.holeFillClosingRadiusSpinbox = None  # tk.Spinbox
         self.morphDilateIterationsCountSpinbox = None  # tk.Spinbox
         self.morphErodeIterationsCountSpinbox = None  # tk.Spinbox
         self.structuringElementDontCareWidthSpinbox = None  # tk.Spinbox
@@ -120,12 +164,25 @@ class SettingsDialog(tk.Toplevel):
         self.markColorEntry = None  # tk.Entry
         self.morphologicalMaskShape = settingsInstance.morphologicalMaskShape  # Tuple (Width, Height)
         self.morphologicalMaskShapeEntry = None  # tk.Entry
+        self.morphologyBackendCombobox = None  # ttk.Combobox
+        self.morphologyBackendVar = None  # tk.StringVar - to hold the value of the morphology backend combobox
         self.objectRotationDegreeIncSpinbox = None  # tk.Spinbox
-
-        # Build the body
-        body = tk.Frame(self)
+        self.hitMissBackendCombobox = None  # ttk.Combobox
+        self.hitMissBackendVar = None  # tk.StringVar - to hold the value of the hit & miss backend combobox
+        self.previewImages = previewImages  # Tuple (obj1, obj2, image) to preview the settings on
+        self.previewFigure = None  # matplotlib Figure of the preview
+        self.previewCanvas = None  # FigureCanvasTkAgg of the preview
+        self.previewAfterId = None  # Identifier of the scheduled preview update, so we can debounce it
+        self.isRunRequested = False  # Whether user asked to run the detection with the result
+
+        # Build the body. The preview (if any) is to the right of the editors
+        content = tk.Frame(self, bg=ctl.BACKGROUND_COLOR)
+        body = tk.Frame(content)
         self.initial_focus = self.body(body)
-        body.pack(padx=5, pady=5)
+        body.pack(side=tk.LEFT, padx=5, pady=5, anchor=tk.N)
+        if self.previewImages is not None:
+            self.createPreview(content)
+        content.pack()
 
         # Dialog buttons
         self.buttonbox()
@@ -170,17 +227,35 @@ class SettingsDialog(tk.Toplevel):
         r += 1
         self.initBlurKernelSizeEditor(frame, r)
 
+        r += 1
+        self.initBlurBackendEditor(frame, r)
+
+        r += 1
+        self.grayFirstCheckButton, self.grayFirstCheckVar = \
+            ctl.checkButton(frame, 'Convert to Gray before Blur (Fast)')
+        self.grayFirstCheckButton.grid(row=r, columnspan=2, padx=5, pady=5, sticky=tk.W)
+
         r += 1
         self.gradientEdgeCheckButton, self.gradientEdgeCheckVar = \
             ctl.checkButton(frame, 'Use Gradient Edge Detector')
         self.gradientEdgeCheckButton.grid(row=r, columnspan=2, padx=5, pady=5, sticky=tk.W)
 
+        r += 1
+        ctl.label(frame, text='Gradient Backend').grid(row=r, padx=5, pady=5, sticky=tk.W)
+        self.gradientBackendCombobox, self.gradientBackendVar = ctl.comboBox(frame, GRADIENT_BACKENDS, 3)
+        self.gradientBackendCombobox.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
+
         r += 1
         self.initThreshold1Editor(frame, r)
 
         r += 1
         self.initThreshold2Editor(frame, r)
 
+        r += 1
+        ctl.label(frame, text='Threshold Method').grid(row=r, padx=5, pady=5, sticky=tk.W)
+        self.thresholdMethodCombobox, self.thresholdMethodVar = ctl.comboBox(frame, THRESHOLD_METHODS, 3)
+        self.thresholdMethodCombobox.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
+
         r += 1
         self.brightBackgroundCheckButton, self.brightBackgroundCheckVar = \
             ctl.checkButton(frame, 'Bright Background Images')
@@ -206,6 +281,21 @@ class SettingsDialog(tk.Toplevel):
                                                       self.morphOpenIterationsCountSpinbox.get()),
                                                   self.openIterationsCountValidator)
 
+        r += 1
+        ctl.label(frame, text='Hole Fill Method').grid(row=r, padx=5, pady=5, sticky=tk.W)
+        self.holeFillMethodCombobox, self.holeFillMethodVar = ctl.comboBox(frame, HOLE_FILL_METHODS, 3)
+        self.holeFillMethodCombobox.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
+
+        r += 1
+        self.holeFillClosingRadiusSpinbox = \
+            self.createMorphIterationsCountEditor(frame,
+                                                  r,
+                                                  'Iterations of Closing before Hole Fill',
+                                                  lambda event: self.holeFillClosingRadiusValidator(
+                                                      settingsInstance.holeFillClosingRadius,
+                                                      self.holeFillClosingRadiusSpinbox.get()),
+                                                  self.holeFillClosingRadiusValidator)
+
         r += 1
         self.morphDilateIterationsCountSpinbox = \
             self.createMorphIterationsCountEditor(frame,
@@ -248,14 +338,117 @@ class SettingsDialog(tk.Toplevel):
         r += 1
         self.initMorphologicalMaskShapeEditor(frame, r)
 
+        r += 1
+        ctl.label(frame, text='Morphology Backend').grid(row=r, padx=5, pady=5, sticky=tk.W)
+        self.morphologyBackendCombobox, self.morphologyBackendVar = ctl.comboBox(frame, MORPHOLOGY_BACKENDS, 3)
+        self.morphologyBackendCombobox.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
+
         r += 1
         self.initObjectRotationDegreeInc(frame, r)
 
+        r += 1
+        ctl.label(frame, text='Hit & Miss Backend').grid(row=r, padx=5, pady=5, sticky=tk.W)
+        self.hitMissBackendCombobox, self.hitMissBackendVar = ctl.comboBox(frame, HIT_MISS_BACKENDS, 3)
+        self.hitMissBackendCombobox.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
+
         # Load settings object to the editors
         self.initSettings()
 
         return frame
 
+    def createPreview(self, master):
+        """
+        Preview area contains a figure with the binary and closing images, updated as the settings are edited
+        :param master: Master frame to add the preview to
+        :return: None
+        """
+        previewFrame = tk.Frame(master, bg='white')
+        previewFrame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        self.previewFigure = Figure(figsize=(4, 4), dpi=100)
+        for index, title in enumerate(PREVIEW_TITLES):
+            axes = self.previewFigure.add_subplot(221 + index, title=title)
+            axes.axis('off')
+        self.previewFigure.subplots_adjust(0.02, 0.02, 0.98, 0.92, 0.05, 0.2)
+
+        self.previewCanvas = FigureCanvasTkAgg(self.previewFigure, previewFrame)
+        self.previewCanvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+
+        # Any edit schedules an update of the preview. The preview skips the hit & miss sweep and the marking, so
+        # their editors (erode/dilate counts, don't care width, rotation, hit & miss backend, mark color and
+        # thickness) do not affect it and are not bound
+        for spinbox in (self.gammaCorrectionValueSpinbox, self.blurKernelSizeSpinbox, self.threshold1Spinbox,
+                        self.threshold2Spinbox, self.morphCloseIterationsCountSpinbox,
+                        self.morphOpenIterationsCountSpinbox, self.holeFillClosingRadiusSpinbox):
+            spinbox.configure(command=self.schedulePreview)
+            spinbox.bind('<KeyRelease>', self.schedulePreview, add='+')
+        for checkButton in (self.grayFirstCheckButton, self.gradientEdgeCheckButton,
+                            self.brightBackgroundCheckButton):
+            checkButton.configure(command=self.schedulePreview)
+        for combobox in (self.blurBackendCombobox, self.gradientBackendCombobox, self.thresholdMethodCombobox,
+                         self.morphologyBackendCombobox, self.holeFillMethodCombobox):
+            combobox.bind('<<ComboboxSelected>>', self.schedulePreview, add='+')
+        for entry in (self.imageShapeEntry, self.morphologicalMaskShapeEntry):
+            entry.bind('<FocusOut>', self.schedulePreview, add='+')
+
+        self.updatePreview()
+
+    def schedulePreview(self, event=None):
+        """
+        Update the preview once user stops editing for PREVIEW_DEBOUNCE_MS
+        :param event: The event of the edit (Not in use)
+        :return: None
+        """
+        if self.previewAfterId is not None:
+            self.after_cancel(self.previewAfterId)
+        self.previewAfterId = self.after(PREVIEW_DEBOUNCE_MS, self.updatePreview)
+
+    def updatePreview(self):
+        """
+        Run the cheap stages with the edited settings, and show their outcome. Settings that cannot be parsed
+        yet (e.g. while typing) leave the preview as is
+        :return: None
+        """
+        self.previewAfterId = None
+        if self.closing:
+            return
+
+        try:
+            values = self.readEditors()
+            if not self.isPreviewable(values):
+                return
+            settings = SettingsSnapshot(dict(settingsInstance.snapshot().toDictionary(), **values))
+        except (ValueError, TypeError):
+            # e.g. a spinbox which was cleared in order to type a new value
+            return
+
+        images = runPreview(*self.previewImages, settings)
+
+        for axes, image in zip(self.previewFigure.axes, images):
+            if axes.images and axes.images[0].get_array().shape == image.shape:
+                axes.images[0].set_data(image)
+            else:
+                title = axes.get_title()
+                axes.clear()
+                axes.axis('off')
+                axes.set_title(title)
+                axes.imshow(image, cmap='gray', vmin=0, vmax=255)
+        self.previewCanvas.draw_idle()
+
+    @staticmethod
+    def isPreviewable(values):
+        """
+        Apply the rules of the validators to the values of the editors. Validators run when an editor loses
+        focus, while the preview runs as the user types, so it might get a value the validators would reject
+        (e.g. an even blur kernel size, on the way to typing 13)
+        :param values: Dictionary of settings field name -> value. See readEditors
+        :return: Whether the values can be previewed
+        """
+        for name, (start, end) in EDITOR_RANGES.items():
+            if not start <= values[name] <= end:
+                return False
+        return values['blurKernelSize'] % 2 == 1 and values['threshold1'] < values['threshold2']
+
     def initGammaCorrectionEditor(self, frame, r):
         ctl.label(frame, text='Gamma Correction Value').grid(row=r, padx=5, pady=5, sticky=tk.W)
         # np.arange yields bad values.. e.g. -1.60000000e00 or 1.599
@@ -290,6 +483,50 @@ class SettingsDialog(tk.Toplevel):
                                                        self.blurKernelSizeSpinbox.get()))
         self.blurKernelSizeSpinbox.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
 
+    def initBlurBackendEditor(self, frame, r):
+        ctl.label(frame, text='Blur Backend').grid(row=r, padx=5, pady=5, sticky=tk.W)
+        blurFrame = tk.Frame(frame, bg=ctl.BACKGROUND_COLOR)
+        blurFrame.grid(row=r, column=1, padx=5, pady=5, sticky=tk.EW)
+        self.blurBackendCombobox, self.blurBackendVar = ctl.comboBox(blurFrame, BLUR_BACKENDS, 3)
+        self.blurBackendCombobox.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        # Benchmarking requires images, so it is available when we have images to preview only
+        self.fastestBlurButton = tk.Button(blurFrame,
+                                           text='Fastest',
+                                           width=6,
+                                           command=self.selectFastestBlur,
+                                           font=ctl.FONT_REGULAR,
+                                           foreground='white',
+                                           background=ctl.BACKGROUND_TOOLTIP_COLOR,
+                                           state=tk.NORMAL if self.previewImages is not None else tk.DISABLED)
+        self.fastestBlurButton.pack(side=tk.RIGHT, padx=(5, 0))
+
+    def selectFastestBlur(self):
+        """
+        Command of the Fastest button. Benchmarks the blur backends over the preview images, with the edited
+        settings, and selects the fastest one which keeps the binary images close to those of the median
+        :return: None
+        """
+        try:
+            settings = SettingsSnapshot(dict(settingsInstance.snapshot().toDictionary(), **self.readEditors()))
+        except Exception as e:
+            messagebox.showerror('Illegal Input', 'Cannot benchmark the blur with the current settings: ' + str(e))
+            return
+
+        self.configure(cursor='watch')
+        self.update_idletasks()
+        try:
+            selected, report = selectBlurBackend(*self.previewImages, settings)
+        finally:
+            self.configure(cursor='')
+
+        for backend, durationMs, difference in report:
+            print('INFO - Blur backend {}: {:.2f} ms, binary images differ by {:.3f}%'.format(backend, durationMs,
+                                                                                          difference))
+        print('INFO - Fastest blur backend within tolerance:', selected)
+        self.blurBackendVar.set(selected)
+        self.schedulePreview()
+
     def initThreshold1Editor(self, frame, r):
         ctl.label(frame, text='Threshold1 (Min)').grid(row=r, padx=5, pady=5, sticky=tk.W)
         self.threshold1Spinbox = \
@@ -420,6 +657,14 @@ class SettingsDialog(tk.Toplevel):
                       foreground='white',
                       background=ctl.ACCEPT_COLOR)
         w.pack(side=tk.RIGHT, padx=5, pady=5)
+        w = tk.Button(box,
+                      text="Apply & Run",
+                      width=12,
+                      command=self.applyAndRun,
+                      font=ctl.FONT_BUTTON,
+                      foreground='white',
+                      background=ctl.ACCEPT_COLOR)
+        w.pack(side=tk.RIGHT, padx=5, pady=5)
 
         self.bind("<Return>", self.ok)
         self.bind("<Escape>", self.cancel)
@@ -451,6 +696,18 @@ class SettingsDialog(tk.Toplevel):
         self.apply()
         self.cancel()
 
+    def applyAndRun(self, event=None):
+        """
+        Command of the Apply & Run button. Same as OK, and the caller runs the full detection
+        :param event:
+        :return: None
+        """
+        self.isRunRequested = True
+        self.ok(event)
+        if self.__result is None:
+            # Validation failed, the dialog is still open
+            self.isRunRequested = False
+
     def cancel(self, event=None):
         """
         Command of the CANCEL button
@@ -459,6 +716,9 @@ class SettingsDialog(tk.Toplevel):
         """
         # Sign that we are closing the window, so we will not perform any validation during exit
         self.closing = True
+        if self.previewAfterId is not None:
+            self.after_cancel(self.previewAfterId)
+            self.previewAfterId = None
 
         # Put focus back to the parent window
         self.parent.focus_set()
@@ -485,25 +745,40 @@ class SettingsDialog(tk.Toplevel):
         Gather data into settings variable and set it as the result
         :return: None
         """
-        settingsInstance.gammaCorrectionValue = float(self.gammaCorrectionValueSpinbox.get())
-        settingsInstance.blurKernelSize = int(self.blurKernelSizeSpinbox.get())
-        settingsInstance.isUsingGradientEdgeDetector = bool(self.gradientEdgeCheckVar.get())
-        settingsInstance.threshold1 = int(self.threshold1Spinbox.get())
-        settingsInstance.threshold2 = int(self.threshold2Spinbox.get())
-        settingsInstance.isBrightBackground = bool(self.brightBackgroundCheckVar.get())
-        settingsInstance.morphCloseIterationsCount = int(self.morphCloseIterationsCountSpinbox.get())
-        settingsInstance.morphOpenIterationsCount = int(self.morphOpenIterationsCountSpinbox.get())
-        settingsInstance.morphDilateIterationsCount = int(self.morphDilateIterationsCountSpinbox.get())
-        settingsInstance.morphErodeIterationsCount = int(self.morphErodeIterationsCountSpinbox.get())
-        settingsInstance.structuringElementDontCareWidth = \
-            int(self.structuringElementDontCareWidthSpinbox.get())
-        settingsInstance.markColor = self.markColor
-        settingsInstance.markThickness = int(self.markThicknessSpinbox.get())
-        settingsInstance.imageShape = self.imageShape
-        settingsInstance.morphologicalMaskShape = self.morphologicalMaskShape
-        settingsInstance.objectRotationDegreeInc = int(self.objectRotationDegreeIncSpinbox.get())
+        for name, value in self.readEditors().items():
+            setattr(settingsInstance, name, value)
         self.__result = settingsInstance
 
+    def readEditors(self):
+        """
+        Parse the values of the editors. Shapes and color are the ones validated when their editors lost focus
+        :return: Dictionary of settings field name -> value
+        """
+        return {'gammaCorrectionValue': float(self.gammaCorrectionValueSpinbox.get()),
+                'blurKernelSize': int(self.blurKernelSizeSpinbox.get()),
+                'isUsingGradientEdgeDetector': bool(self.gradientEdgeCheckVar.get()),
+                'threshold1': int(self.threshold1Spinbox.get()),
+                'threshold2': int(self.threshold2Spinbox.get()),
+                'isBrightBackground': bool(self.brightBackgroundCheckVar.get()),
+                'morphCloseIterationsCount': int(self.morphCloseIterationsCountSpinbox.get()),
+                'morphOpenIterationsCount': int(self.morphOpenIterationsCountSpinbox.get()),
+                'morphDilateIterationsCount': int(self.morphDilateIterationsCountSpinbox.get()),
+                'morphErodeIterationsCount': int(self.morphErodeIterationsCountSpinbox.get()),
+                'structuringElementDontCareWidth': int(self.structuringElementDontCareWidthSpinbox.get()),
+                'markColor': self.markColor,
+                'markThickness': int(self.markThicknessSpinbox.get()),
+                'imageShape': self.imageShape,
+                'morphologicalMaskShape': self.morphologicalMaskShape,
+                'objectRotationDegreeInc': int(self.objectRotationDegreeIncSpinbox.get()),
+                'gradientBackend': self.gradientBackendVar.get(),
+                'isGrayFirst': bool(self.grayFirstCheckVar.get()),
+                'blurBackend': self.blurBackendVar.get(),
+                'thresholdMethod': self.thresholdMethodVar.get(),
+                'morphologyBackend': self.morphologyBackendVar.get(),
+                'holeFillMethod': self.holeFillMethodVar.get(),
+                'holeFillClosingRadius': int(self.holeFillClosingRadiusSpinbox.get()),
+                'hitMissBackend': self.hitMissBackendVar.get()}
+
     def markThicknessValidator(self, oldText, newText):
         """
         A function used to validate the input of iterations count spinbox.
@@ -514,32 +789,37 @@ class SettingsDialog(tk.Toplevel):
         if self.closing:
             return True
 
-        return numericInRangeValidator(self.markThicknessSpinbox, oldText, newText, 1, 20)
+        return numericInRangeValidator(self.markThicknessSpinbox, oldText, newText, *EDITOR_RANGES['markThickness'])
 
     def closeIterationsCountValidator(self, oldText, newText):
         if self.closing:
             return True
-        return numericInRangeValidator(self.morphCloseIterationsCountSpinbox, oldText, newText, 1, 20)
+        return numericInRangeValidator(self.morphCloseIterationsCountSpinbox, oldText, newText, *EDITOR_RANGES['morphCloseIterationsCount'])
 
     def openIterationsCountValidator(self, oldText, newText):
         if self.closing:
             return True
-        return numericInRangeValidator(self.morphOpenIterationsCountSpinbox, oldText, newText, 1, 20)
+        return numericInRangeValidator(self.morphOpenIterationsCountSpinbox, oldText, newText, *EDITOR_RANGES['morphOpenIterationsCount'])
+
+    def holeFillClosingRadiusValidator(self, oldText, newText):
+        if self.closing:
+            return True
+        return numericInRangeValidator(self.holeFillClosingRadiusSpinbox, oldText, newText, *EDITOR_RANGES['holeFillClosingRadius'])
 
     def dilateIterationsCountValidator(self, oldText, newText):
         if self.closing:
             return True
-        return numericInRangeValidator(self.morphDilateIterationsCountSpinbox, oldText, newText, 1, 20)
+        return numericInRangeValidator(self.morphDilateIterationsCountSpinbox, oldText, newText, *EDITOR_RANGES['morphDilateIterationsCount'])
 
     def erodeIterationsCountValidator(self, oldText, newText):
         if self.closing:
             return True
-        return numericInRangeValidator(self.morphErodeIterationsCountSpinbox, oldText, newText, 1, 20)
+        return numericInRangeValidator(self.morphErodeIterationsCountSpinbox, oldText, newText, *EDITOR_RANGES['morphErodeIterationsCount'])
 
     def structuringElementDontCareValidator(self, oldText, newText):
         if self.closing:
             return True
-        return numericInRangeValidator(self.structuringElementDontCareWidthSpinbox, oldText, newText, 1, 15)
+        return numericInRangeValidator(self.structuringElementDontCareWidthSpinbox, oldText, newText, *EDITOR_RANGES['structuringElementDontCareWidth'])
 
     def gammaCorrectionValidator(self, oldText, newText):
         """
@@ -551,7 +831,7 @@ class SettingsDialog(tk.Toplevel):
         if self.closing:
             return True
 
-        return numericInRangeValidator(self.gammaCorrectionValueSpinbox, oldText, newText, -2.5, 2.5)
+        return numericInRangeValidator(self.gammaCorrectionValueSpinbox, oldText, newText, *EDITOR_RANGES['gammaCorrectionValue'])
 
     def blurKernelSizeValidator(self, oldText, newText):
         """
@@ -563,7 +843,7 @@ class SettingsDialog(tk.Toplevel):
         if self.closing or newText == '':
             return True
 
-        if numericInRangeValidator(self.blurKernelSizeSpinbox, oldText, newText, 1, 40):
+        if numericInRangeValidator(self.blurKernelSizeSpinbox, oldText, newText, *EDITOR_RANGES['blurKernelSize']):
             if int(newText) % 2 != 1:
                 messagebox.showerror('Illegal Input', 'Kernel size must be odd')
                 self.blurKernelSizeSpinbox.delete(0, tk.END)
@@ -578,7 +858,7 @@ class SettingsDialog(tk.Toplevel):
         if self.closing or newText == '':
             return True
 
-        return numericInRangeValidator(self.objectRotationDegreeIncSpinbox, oldText, newText, 1, 91)
+        return numericInRangeValidator(self.objectRotationDegreeIncSpinbox, oldText, newText, *EDITOR_RANGES['objectRotationDegreeInc'])
 
     def pixelValueThreshold1Validator(self, oldText, newText):
         """
@@ -590,7 +870,7 @@ class SettingsDialog(tk.Toplevel):
         if self.closing:
             return True
 
-        return numericInRangeValidator(self.threshold1Spinbox, oldText, newText, 0, 255)
+        return numericInRangeValidator(self.threshold1Spinbox, oldText, newText, *EDITOR_RANGES['threshold1'])
 
     def pixelValueThreshold2Validator(self, oldText, newText):
         """
@@ -602,7 +882,7 @@ class SettingsDialog(tk.Toplevel):
         if self.closing:
             return True
 
-        return numericInRangeValidator(self.threshold2Spinbox, oldText, newText, 0, 255)
+        return numericInRangeValidator(self.threshold2Spinbox, oldText, newText, *EDITOR_RANGES['threshold2'])
 
     def numericValidatorCmd(self, widget_name, oldText, newText):
         """
@@ -700,6 +980,8 @@ class SettingsDialog(tk.Toplevel):
         """
         settingsInstance.reset()
         self.initSettings()
+        if self.previewImages is not None:
+            self.schedulePreview()
 
     def initSettings(self):
         """
@@ -712,6 +994,11 @@ class SettingsDialog(tk.Toplevel):
         else:
             self.gradientEdgeCheckButton.deselect()
 
+        if settingsInstance.isGrayFirst:
+            self.grayFirstCheckButton.select()
+        else:
+            self.grayFirstCheckButton.deselect()
+
         if settingsInstance.isBrightBackground:
             self.brightBackgroundCheckButton.select()
         else:
@@ -736,3 +1023,10 @@ class SettingsDialog(tk.Toplevel):
         self.morphologicalMaskShape = settingsInstance.morphologicalMaskShape
         resetText(self.morphologicalMaskShapeEntry, settingsInstance.morphologicalMaskShape)
         resetText(self.objectRotationDegreeIncSpinbox, int(settingsInstance.objectRotationDegreeInc))
+        self.gradientBackendVar.set(settingsInstance.gradientBackend)
+        self.blurBackendVar.set(settingsInstance.blurBackend)
+        self.thresholdMethodVar.set(settingsInstance.thresholdMethod)
+        self.morphologyBackendVar.set(settingsInstance.morphologyBackend)
+        self.holeFillMethodVar.set(settingsInstance.holeFillMethod)
+        resetText(self.holeFillClosingRadiusSpinbox, int(settingsInstance.holeFillClosingRadius))
+        self.hitMissBackendVar.set(settingsInstance.hitMissBackend)